@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Helm Values Engine Benchmark
+
+Generates a large, commented values file and times the values engine in
+scripts/helm_values.py against a PyYAML load/dump round trip: parsing,
+key-path lookups, in-place scalar edits, inserts of new nested keys,
+deletes, serialization and a full parse. It also checks that an unedited
+document is written back byte for byte and that the parsed values match
+PyYAML.
+
+Example:
+  python3 benchmarks/bench_helm_values.py --size-mb 8 --edits 1000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from helm_values import ValuesDocument  # noqa: E402
+
+try:
+    import yaml
+    HAS_YAML = True
+except ImportError:
+    HAS_YAML = False
+
+
+def generate_values(size_bytes, seed=0):
+    """Build a values file of roughly size_bytes with nested maps, lists and comments"""
+    rng = random.Random(seed)
+    lines = ["# Generated values file", "global:", "  imageRegistry: docker.io", ""]
+    service = 0
+    while sum(len(line) + 1 for line in lines) < size_bytes:
+        name = f"service{service}"
+        lines += [
+            f"# -- {name} settings",
+            f"{name}:",
+            "  enabled: true",
+            f"  replicaCount: {rng.randint(1, 10)}  # pods",
+            "  image:",
+            "    repository: bitnami/nginx",
+            f"    tag: 1.25.{rng.randint(0, 9)}-debian-11-r{rng.randint(0, 99)}",
+            "    pullPolicy: IfNotPresent",
+            "  resources:",
+            "    limits:",
+            f"      cpu: {rng.randint(1, 8) * 250}m",
+            f"      memory: {rng.randint(1, 16) * 128}Mi",
+            "  podAnnotations:",
+            "    prometheus.io/scrape: 'true'",
+            f"    prometheus.io/port: '{rng.randint(8000, 9999)}'",
+            "  ingress:",
+            "    hosts:",
+            f"      - name: {name}.example.com",
+            "        paths:",
+            "          - /",
+            "          - /api",
+            "    tls: []",
+            "  env:",
+            "  - name: LOG_LEVEL",
+            "    value: info",
+            "  config: |",
+            "    server {",
+            f"      listen {rng.randint(8000, 9999)};",
+            "    }",
+            "",
+        ]
+        service += 1
+    return "\n".join(lines) + "\n", service
+
+
+def timed(label, func, results):
+    """Run func once, record and return its result"""
+    start = time.perf_counter()
+    value = func()
+    results.append((label, time.perf_counter() - start))
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Helm values engine on large values files")
+    parser.add_argument("--size-mb", type=float, default=4, help="Size of the generated values file in MB")
+    parser.add_argument("--edits", type=int, default=1000, help="Number of lookups/edits of each kind")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    text, services = generate_values(int(args.size_mb * 1024 * 1024), args.seed)
+    rng = random.Random(args.seed)
+    targets = [rng.randrange(services) for _ in range(args.edits)]
+    print(f"Values file: {len(text) / 1024 / 1024:.1f} MB, {text.count(chr(10))} lines, {services} services")
+    print()
+
+    results = []
+    document = timed("engine: load (split into sections)", lambda: ValuesDocument(text), results)
+    if document.to_text() != text:
+        print("FAIL: unedited round trip is not byte-identical")
+        return 1
+    timed(f"engine: {args.edits} gets", lambda: [document.get(f"service{i}.image.tag") for i in targets], results)
+    timed(f"engine: {args.edits} scalar sets", lambda: [
+        document.set(f"service{i}.image.tag", f"1.26.{n}") for n, i in enumerate(targets)], results)
+    timed(f"engine: {args.edits} nested inserts", lambda: [
+        document.set(f"service{i}.extra{n}.enabled", True) for n, i in enumerate(targets)], results)
+    timed(f"engine: {args.edits} deletes", lambda: [
+        document.delete(f"service{i}.extra{n}") for n, i in enumerate(targets)], results)
+    edited = timed("engine: serialize", document.to_text, results)
+    values = timed("engine: parse every section", document.to_python, results)
+
+    if HAS_YAML:
+        loaded = timed("pyyaml: safe_load", lambda: yaml.safe_load(text), results)
+        timed("pyyaml: dump", lambda: yaml.safe_dump(loaded, default_flow_style=False, sort_keys=False), results)
+        for n, i in enumerate(targets):
+            loaded[f"service{i}"]["image"]["tag"] = f"1.26.{n}"
+        if yaml.safe_load(edited) != loaded or values != loaded:
+            print("FAIL: edited document does not match the PyYAML model")
+            return 1
+    else:
+        print("PyYAML not installed; skipping the comparison (pip install pyyaml)")
+
+    width = max(len(label) for label, _ in results)
+    print(f"{'OPERATION'.ljust(width)}   SECONDS")
+    for label, seconds in results:
+        print(f"{label.ljust(width)}   {seconds:8.3f}")
+    print()
+    print(f"Round trip: unedited output is byte-identical; {text.count('#')} comment markers kept, "
+          f"{edited.count('#')} after edits")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
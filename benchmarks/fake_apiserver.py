@@ -0,0 +1,1034 @@
+#!/usr/bin/env python3
+"""
+Fake Kubernetes/ArgoCD API Server
+
+A local, in-memory stand-in for the Kubernetes API server that serves the
+objects the helper scripts touch: Applications, Deployments, Services,
+Endpoints, Pods, ConfigMaps, Secrets, Namespaces, Ingresses and HPAs.
+
+It implements GET, list (label/field selectors, limit/continue), watch,
+merge/JSON patches and the Deployment scale subresource, plus simple
+controllers that move Applications through OutOfSync/Progressing to
+Synced/Healthy and roll Deployments, Pods and Endpoints after configurable
+delays. Every request can be delayed by an injected latency, and a share
+of the requests can be answered with an injected error (429 with
+Retry-After by default) to exercise the client's retries.
+
+The ArgoCD API server endpoints used by argocd_session.py are served too:
+POST /api/v1/session (the password of argocd-initial-admin-secret gets a
+JWT-shaped token), GET/PATCH /api/v1/applications/<name>, .../sync,
+.../rollback and the /api/v1/stream/applications watch.
+
+/metrics serves Prometheus text with synthetic request counters and
+latency histograms for the Deployments in the canary namespace. Traffic is
+split by ready replicas, so canary-promote.py can be run against it.
+
+Point the scripts at it with KUBE_API_SERVER=http://127.0.0.1:<port>.
+"""
+
+import argparse
+import base64
+import bisect
+import copy
+import heapq
+import itertools
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENVIRONMENTS = ["dev", "staging", "production"]
+CANARY_NAMESPACE = "canary"
+
+# Prometheus default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Resource kind -> (apiVersion, Kind, namespaced)
+KINDS = {
+    "applications": ("argoproj.io/v1alpha1", "Application", True),
+    "deployments": ("apps/v1", "Deployment", True),
+    "services": ("v1", "Service", True),
+    "endpoints": ("v1", "Endpoints", True),
+    "pods": ("v1", "Pod", True),
+    "configmaps": ("v1", "ConfigMap", True),
+    "secrets": ("v1", "Secret", True),
+    "namespaces": ("v1", "Namespace", False),
+    "ingresses": ("networking.k8s.io/v1", "Ingress", True),
+    "horizontalpodautoscalers": ("autoscaling/v2", "HorizontalPodAutoscaler", True),
+}
+
+PATH_RE = re.compile(
+    r"^/(?:api/v1|apis/[^/]+/[^/]+)"
+    r"(?:/namespaces/(?P<ns>[^/]+))?"
+    r"/(?P<kind>[a-z]+)"
+    r"(?:/(?P<name>[^/]+))?"
+    r"(?:/(?P<sub>[^/]+))?$"
+)
+NAMESPACE_PATH_RE = re.compile(r"^/api/v1/namespaces/(?P<name>[^/]+)$")
+
+ARGOCD_API_RE = re.compile(r"^/api/v1/(?:stream/applications|session|applications/(?P<name>[^/]+)(?:/(?P<action>[a-z]+))?)$")
+ADMIN_PASSWORD = "fake-password"
+
+INSTANCE_LABEL = "app.kubernetes.io/instance"
+REFRESH_ANNOTATION = "argocd.argoproj.io/refresh"
+
+
+def now_iso():
+    """Current time in Kubernetes timestamp format"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def merge_patch(target, patch):
+    """Apply an RFC 7386 JSON merge patch"""
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def _pointer(path):
+    """Split an RFC 6901 JSON pointer"""
+    return [p.replace("~1", "/").replace("~0", "~") for p in path.lstrip("/").split("/")] if path else []
+
+
+def json_patch(target, operations):
+    """Apply an RFC 6902 JSON patch"""
+    doc = copy.deepcopy(target)
+    for op in operations:
+        parts = _pointer(op["path"])
+        parent = doc
+        for part in parts[:-1]:
+            parent = parent[int(part)] if isinstance(parent, list) else parent[part]
+        last = parts[-1] if parts else None
+        kind = op["op"]
+        if kind == "test":
+            current = parent[int(last)] if isinstance(parent, list) else parent.get(last)
+            if current != op["value"]:
+                raise ValueError(f"test failed at {op['path']}")
+        elif kind in ("add", "replace"):
+            if isinstance(parent, list):
+                if last == "-":
+                    parent.append(op["value"])
+                elif kind == "add":
+                    parent.insert(int(last), op["value"])
+                else:
+                    parent[int(last)] = op["value"]
+            else:
+                if kind == "replace" and last not in parent:
+                    raise ValueError(f"path not found: {op['path']}")
+                parent[last] = op["value"]
+        elif kind == "remove":
+            if isinstance(parent, list):
+                parent.pop(int(last))
+            else:
+                del parent[last]
+        else:
+            raise ValueError(f"unsupported op: {kind}")
+    return doc
+
+
+def match_labels(labels, selector):
+    """Match equality-based label selectors (a=b,c!=d,e)"""
+    if not selector:
+        return True
+    labels = labels or {}
+    for term in selector.split(","):
+        term = term.strip()
+        if "!=" in term:
+            key, value = term.split("!=", 1)
+            if labels.get(key) == value:
+                return False
+        elif "=" in term:
+            key, value = term.split("=", 1)
+            if labels.get(key.rstrip("=")) != value.lstrip("="):
+                return False
+        elif labels.get(term) is None:
+            return False
+    return True
+
+
+def match_fields(obj, selector):
+    """Match metadata.name / metadata.namespace field selectors"""
+    if not selector:
+        return True
+    for term in selector.split(","):
+        key, value = term.split("=", 1)
+        key = key.rstrip("=")
+        field = obj["metadata"].get(key.split(".", 1)[1]) if key.startswith("metadata.") else None
+        if field != value.lstrip("="):
+            return False
+    return True
+
+
+def object_key(obj):
+    """Sort key of an object: (namespace, name)"""
+    return (obj["metadata"].get("namespace") or "", obj["metadata"]["name"])
+
+
+class Store:
+    """Versioned in-memory object store with a watch event log"""
+
+    def __init__(self, history=100000):
+        self.objects = {}
+        self.by_kind = {}
+        self.events = []
+        self.event_versions = []
+        self.history = history
+        self.resource_version = 0
+        self.lock = threading.Condition()
+        self.on_change = []
+
+    def _bump(self, obj):
+        self.resource_version += 1
+        obj["metadata"]["resourceVersion"] = str(self.resource_version)
+
+    def _record(self, event_type, kind, obj):
+        self.events.append((self.resource_version, event_type, kind, copy.deepcopy(obj)))
+        self.event_versions.append(self.resource_version)
+        if len(self.events) > self.history:
+            del self.events[: len(self.events) - self.history]
+            del self.event_versions[: len(self.event_versions) - self.history]
+        self.lock.notify_all()
+
+    def put(self, kind, obj, notify=True):
+        """Create or replace an object"""
+        api_version, kind_name, _ = KINDS[kind]
+        obj.setdefault("apiVersion", api_version)
+        obj.setdefault("kind", kind_name)
+        meta = obj["metadata"]
+        key = (kind, meta.get("namespace"), meta["name"])
+        with self.lock:
+            existed = key in self.objects
+            if not existed:
+                meta.setdefault("creationTimestamp", now_iso())
+                meta.setdefault("generation", 1)
+                meta.setdefault("uid", f"uid-{self.resource_version + 1}")
+            self._bump(obj)
+            self.objects[key] = obj
+            self.by_kind.setdefault(kind, {})[key] = obj
+            self._record("MODIFIED" if existed else "ADDED", kind, obj)
+        if notify:
+            for callback in self.on_change:
+                callback(kind, obj)
+        return obj
+
+    def delete(self, kind, namespace, name):
+        """Delete an object"""
+        with self.lock:
+            obj = self.objects.pop((kind, namespace, name), None)
+            self.by_kind.get(kind, {}).pop((kind, namespace, name), None)
+            if obj is not None:
+                self._bump(obj)
+                self._record("DELETED", kind, obj)
+        return obj
+
+    def get(self, kind, namespace, name):
+        """Return a copy of an object or None"""
+        with self.lock:
+            obj = self.objects.get((kind, namespace, name))
+            return copy.deepcopy(obj) if obj is not None else None
+
+    def list(self, kind, namespace=None, label_selector=None, field_selector=None, after=None, limit=0):
+        """
+        Return copies of matching objects sorted by namespace/name.
+
+        With limit, only the page of objects after the (namespace, name) key
+        in after is copied; returns (items, resource_version, remaining).
+        """
+        with self.lock:
+            items = [
+                obj for (_, ns, _), obj in self.by_kind.get(kind, {}).items()
+                if (namespace is None or ns == namespace)
+                and match_labels(obj["metadata"].get("labels"), label_selector)
+                and match_fields(obj, field_selector)
+            ]
+            items.sort(key=object_key)
+            start = bisect.bisect_right([object_key(obj) for obj in items], after) if after else 0
+            end = start + limit if limit else len(items)
+            return copy.deepcopy(items[start:end]), str(self.resource_version), max(0, len(items) - end)
+
+    def update(self, kind, namespace, name, mutate, bump_generation=False):
+        """Mutate an object in place under the lock"""
+        with self.lock:
+            obj = self.objects.get((kind, namespace, name))
+            if obj is None:
+                return None
+            new = copy.deepcopy(obj)
+            mutate(new)
+            if new == obj:
+                return copy.deepcopy(obj)
+            if bump_generation and new.get("spec") != obj.get("spec"):
+                new["metadata"]["generation"] = obj["metadata"].get("generation", 1) + 1
+            self._bump(new)
+            self.objects[(kind, namespace, name)] = new
+            self.by_kind[kind][(kind, namespace, name)] = new
+            self._record("MODIFIED", kind, new)
+            result = copy.deepcopy(new)
+        for callback in self.on_change:
+            callback(kind, result)
+        return result
+
+    def events_since(self, resource_version, kind, namespace, label_selector, field_selector):
+        """Return (events, oldest) newer than resource_version for a watch"""
+        with self.lock:
+            oldest = self.events[0][0] if self.events else self.resource_version + 1
+            start = bisect.bisect_right(self.event_versions, resource_version)
+            out = [
+                (rv, event_type, obj) for rv, event_type, k, obj in self.events[start:]
+                if k == kind
+                and (namespace is None or obj["metadata"].get("namespace") == namespace)
+                and match_labels(obj["metadata"].get("labels"), label_selector)
+                and match_fields(obj, field_selector)
+            ]
+            return out, oldest
+
+
+class Scheduler:
+    """Runs delayed callbacks on a background thread"""
+
+    def __init__(self):
+        self.queue = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def call_later(self, delay, callback, *args):
+        """Schedule callback(*args) after delay seconds"""
+        with self.cond:
+            heapq.heappush(self.queue, (time.monotonic() + delay, next(self.counter), callback, args))
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.queue or self.queue[0][0] > time.monotonic():
+                    timeout = self.queue[0][0] - time.monotonic() if self.queue else None
+                    self.cond.wait(timeout)
+                _, _, callback, args = heapq.heappop(self.queue)
+            try:
+                callback(*args)
+            except Exception as e:  # keep the controller loop alive
+                print(f"fake-apiserver: controller error: {e}", file=sys.stderr)
+
+
+class FakeTraffic:
+    """
+    Synthetic HTTP traffic for the canary namespace, exposed as Prometheus text.
+
+    Every scrape advances the counters by the time elapsed since the last
+    one: each ready pod serves rps_per_pod requests per second, with the
+    error rate and log-normal latency configured for its Deployment.
+    """
+
+    def __init__(self, store, rps_per_pod=20.0, profiles=None, seed=0):
+        self.store = store
+        self.rps_per_pod = rps_per_pod
+        # Deployment name -> (error rate, median latency in seconds)
+        self.profiles = profiles or {}
+        self.random = random.Random(seed)
+        self.requests = {}
+        self.buckets = {}
+        self.last = time.monotonic()
+        self.carry = {}
+        self.lock = threading.Lock()
+
+    def _advance(self):
+        now = time.monotonic()
+        elapsed, self.last = now - self.last, now
+        deployments, _, _ = self.store.list("deployments", CANARY_NAMESPACE)
+        for deployment in deployments:
+            name = deployment["metadata"]["name"]
+            ready = (deployment.get("status") or {}).get("readyReplicas", 0)
+            expected = self.rps_per_pod * ready * elapsed + self.carry.get(name, 0.0)
+            count = int(expected)
+            self.carry[name] = expected - count
+            error_rate, median = self.profiles.get(name, (0.001, 0.04))
+            errors = sum(1 for _ in range(count) if self.random.random() < error_rate)
+            codes = self.requests.setdefault(name, {"200": 0, "500": 0})
+            codes["200"] += count - errors
+            codes["500"] += errors
+            histogram = self.buckets.setdefault(name, [0] * (len(LATENCY_BUCKETS) + 1))
+            for _ in range(count):
+                latency = self.random.lognormvariate(math.log(median), 0.5)
+                histogram[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def exposition(self):
+        """Advance the traffic and render it as Prometheus text"""
+        with self.lock:
+            self._advance()
+            lines = ["# HELP http_requests_total Requests served.", "# TYPE http_requests_total counter"]
+            for name, codes in sorted(self.requests.items()):
+                for code, value in codes.items():
+                    lines.append(f'http_requests_total{{deployment="{name}",code="{code}"}} {value}')
+            lines += ["# HELP http_request_duration_seconds Request latency.",
+                      "# TYPE http_request_duration_seconds histogram"]
+            for name, histogram in sorted(self.buckets.items()):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), histogram):
+                    cumulative += count
+                    lines.append(f'http_request_duration_seconds_bucket{{deployment="{name}",le="{bound}"}} '
+                                 f'{cumulative}')
+                lines.append(f'http_request_duration_seconds_count{{deployment="{name}"}} {cumulative}')
+            return "\n".join(lines) + "\n"
+
+
+class FakeCluster:
+    """The store plus simple Application, Deployment and Endpoints controllers"""
+
+    def __init__(self, sync_delay=0.2, rollout_delay=0.2, endpoints_delay=0.05, degraded_apps=()):
+        self.store = Store()
+        self.scheduler = Scheduler()
+        self.sync_delay = sync_delay
+        self.rollout_delay = rollout_delay
+        self.endpoints_delay = endpoints_delay
+        self.degraded_apps = set(degraded_apps)
+        self.store.on_change.append(self._changed)
+        self.pod_counter = itertools.count(1)
+        self.pods_by_owner = {}
+        self.pod_label_index = {}
+        self.pods_lock = threading.RLock()
+
+    # -- controllers -------------------------------------------------------
+
+    def _changed(self, kind, obj):
+        meta = obj["metadata"]
+        if kind == "applications":
+            annotations = meta.get("annotations") or {}
+            status = obj.get("status") or {}
+            if REFRESH_ANNOTATION in annotations or status.get("observedSpec") != obj.get("spec"):
+                self.scheduler.call_later(0, self._app_progressing, meta["namespace"], meta["name"])
+        elif kind == "deployments":
+            status = obj.get("status") or {}
+            if status.get("observedGeneration") != meta.get("generation"):
+                self.scheduler.call_later(self.rollout_delay, self._rollout, meta["namespace"], meta["name"])
+        elif kind == "services":
+            self.scheduler.call_later(self.endpoints_delay, self._sync_endpoints, meta["namespace"], meta["name"])
+
+    def _app_progressing(self, namespace, name):
+        def mutate(app):
+            status = app.setdefault("status", {})
+            status["observedSpec"] = copy.deepcopy(app.get("spec"))
+            status.setdefault("sync", {})["status"] = "OutOfSync"
+            status.setdefault("health", {})["status"] = "Progressing"
+        if self.store.update("applications", namespace, name, mutate) is not None:
+            self.scheduler.call_later(self.sync_delay, self._app_synced, namespace, name)
+
+    def _app_synced(self, namespace, name):
+        def mutate(app):
+            annotations = app["metadata"].get("annotations") or {}
+            annotations.pop(REFRESH_ANNOTATION, None)
+            app["metadata"]["annotations"] = annotations
+            status = app.setdefault("status", {})
+            status["observedSpec"] = copy.deepcopy(app.get("spec"))
+            status["sync"] = {"status": "Synced", "revision": app["spec"]["source"].get("targetRevision", "")}
+            health = "Degraded" if name in self.degraded_apps else "Healthy"
+            status["health"] = {"status": health}
+            status["reconciledAt"] = now_iso()
+            # A newly deployed source becomes the next deployment history entry
+            history = status.setdefault("history", [])
+            if not history or history[-1]["source"] != app["spec"]["source"]:
+                history.append({"id": history[-1]["id"] + 1 if history else 0,
+                                "revision": app["spec"]["source"].get("targetRevision", ""),
+                                "deployedAt": now_iso(), "source": copy.deepcopy(app["spec"]["source"])})
+            for resource in status.get("resources") or []:
+                resource["status"] = "Synced"
+                resource["health"] = {"status": health}
+        self.store.update("applications", namespace, name, mutate)
+
+    def _add_pod(self, namespace, owner, labels):
+        index = next(self.pod_counter)
+        name = f"{owner}-{index:05d}"
+        self.store.put("pods", {
+            "metadata": {"name": name, "namespace": namespace, "labels": dict(labels)},
+            "status": {"phase": "Running",
+                       "podIP": f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}",
+                       "conditions": [{"type": "Ready", "status": "True"}]},
+        }, notify=False)
+        self.pods_by_owner.setdefault((namespace, owner), []).append(name)
+        for pair in labels.items():
+            self.pod_label_index.setdefault((namespace,) + pair, set()).add(name)
+
+    def _remove_pod(self, namespace, owner, name):
+        pod = self.store.delete("pods", namespace, name)
+        self.pods_by_owner[(namespace, owner)].remove(name)
+        for pair in (pod["metadata"].get("labels") or {}).items():
+            self.pod_label_index.get((namespace,) + pair, set()).discard(name)
+
+    def _matching_services(self, namespace, labels):
+        """Names of services whose selector matches a label set"""
+        with self.store.lock:
+            return [
+                svc_name for (_, ns, svc_name), svc in self.store.by_kind.get("services", {}).items()
+                if ns == namespace and (svc["spec"].get("selector") or {})
+                and all(labels.get(k) == v for k, v in svc["spec"]["selector"].items())
+            ]
+
+    def _rollout(self, namespace, name, sync_endpoints=True):
+        deployment = self.store.get("deployments", namespace, name)
+        if deployment is None:
+            return
+        replicas = deployment["spec"].get("replicas", 1)
+        labels = deployment["spec"]["template"]["metadata"].get("labels", {})
+        with self.pods_lock:
+            pods = list(self.pods_by_owner.get((namespace, name), []))
+            for pod_name in pods[replicas:]:
+                self._remove_pod(namespace, name, pod_name)
+            for _ in range(len(pods), replicas):
+                self._add_pod(namespace, name, labels)
+        if sync_endpoints and len(pods) != replicas:
+            for service in self._matching_services(namespace, labels):
+                self._sync_endpoints(namespace, service)
+
+        def mutate(dep):
+            dep["status"] = {
+                "observedGeneration": dep["metadata"].get("generation", 1),
+                "replicas": replicas, "updatedReplicas": replicas,
+                "readyReplicas": replicas, "availableReplicas": replicas,
+            }
+        self.store.update("deployments", namespace, name, mutate)
+
+    def _sync_endpoints(self, namespace, name):
+        service = self.store.get("services", namespace, name)
+        if service is None:
+            return
+        selector = service["spec"].get("selector") or {}
+        addresses = []
+        if selector:
+            with self.pods_lock:
+                names = set.intersection(*[self.pod_label_index.get((namespace,) + pair, set())
+                                           for pair in selector.items()])
+            for pod_name in sorted(names):
+                pod = self.store.get("pods", namespace, pod_name)
+                if pod is None:
+                    continue
+                addresses.append({"ip": pod["status"]["podIP"],
+                                  "targetRef": {"kind": "Pod", "name": pod_name, "namespace": namespace}})
+        subsets = [{"addresses": addresses, "ports": [{"port": 80, "protocol": "TCP"}]}] if addresses else []
+        existing = self.store.get("endpoints", namespace, name)
+        if existing is None:
+            self.store.put("endpoints", {
+                "metadata": {"name": name, "namespace": namespace,
+                             "labels": dict(service["metadata"].get("labels") or {})},
+                "subsets": subsets,
+            })
+        elif existing.get("subsets") != subsets:
+            self.store.update("endpoints", namespace, name, lambda ep: ep.__setitem__("subsets", subsets))
+
+    # -- seeding -------------------------------------------------------------
+
+    def seed(self, apps=1, blue_green=True):
+        """Create namespaces, the ArgoCD admin secret and a fleet of applications"""
+        for ns in ["argocd", "default", CANARY_NAMESPACE] + ENVIRONMENTS:
+            self.store.put("namespaces", {"metadata": {"name": ns}})
+        self.store.put("secrets", {
+            "metadata": {"name": "argocd-initial-admin-secret", "namespace": "argocd"},
+            "data": {"password": base64.b64encode(ADMIN_PASSWORD.encode("utf-8")).decode("ascii")},
+        })
+        for i in range(1, apps + 1):
+            for env in ENVIRONMENTS:
+                self.add_application(f"app{i}", env)
+            if blue_green:
+                self.add_blue_green(f"app{i}", "production")
+        self.add_canary("nginx", CANARY_NAMESPACE)
+        # Let the controllers settle the seeded objects
+        for (kind, ns, name) in list(self.store.objects):
+            if kind == "deployments":
+                self._rollout(ns, name, sync_endpoints=False)
+            elif kind == "applications":
+                self._app_synced(ns, name)
+        for (kind, ns, name) in list(self.store.objects):
+            if kind == "services":
+                self._sync_endpoints(ns, name)
+
+    def add_application(self, app, env, replicas=1):
+        """Create an Application and the resources it manages"""
+        name = f"{app}-{env}"
+        labels = {INSTANCE_LABEL: name}
+        resources = [
+            {"group": "apps", "version": "v1", "kind": "Deployment", "namespace": env, "name": name},
+            {"group": "", "version": "v1", "kind": "Service", "namespace": env, "name": name},
+            {"group": "", "version": "v1", "kind": "ConfigMap", "namespace": env, "name": name},
+        ]
+        self.store.put("deployments", {
+            "metadata": {"name": name, "namespace": env, "labels": dict(labels)},
+            "spec": {"replicas": replicas, "selector": {"matchLabels": dict(labels)},
+                     "template": {"metadata": {"labels": dict(labels)}}},
+        }, notify=False)
+        self.store.put("services", {
+            "metadata": {"name": name, "namespace": env, "labels": dict(labels)},
+            "spec": {"type": "ClusterIP", "clusterIP": "10.96.0.1", "selector": dict(labels)},
+        }, notify=False)
+        self.store.put("configmaps", {
+            "metadata": {"name": name, "namespace": env, "labels": dict(labels)},
+            "data": {"nginx.conf": "server {}"},
+        }, notify=False)
+        if env != "dev":
+            resources.append({"group": "networking.k8s.io", "version": "v1", "kind": "Ingress",
+                              "namespace": env, "name": name})
+            self.store.put("ingresses", {
+                "metadata": {"name": name, "namespace": env, "labels": dict(labels)},
+                "spec": {"rules": [{"host": f"{name}.example.com"}]},
+            }, notify=False)
+        if env == "production":
+            resources.append({"group": "autoscaling", "version": "v2", "kind": "HorizontalPodAutoscaler",
+                              "namespace": env, "name": name})
+            self.store.put("horizontalpodautoscalers", {
+                "metadata": {"name": name, "namespace": env, "labels": dict(labels)},
+                "spec": {"minReplicas": 1, "maxReplicas": 5},
+                "status": {"currentReplicas": replicas},
+            }, notify=False)
+        self.store.put("applications", {
+            "metadata": {"name": name, "namespace": "argocd", "labels": {"app": app, "environment": env}},
+            "spec": {
+                "project": "default",
+                "source": {"repoURL": "https://charts.bitnami.com/bitnami", "chart": "nginx",
+                           "targetRevision": "15.0.2",
+                           "helm": {"parameters": [{"name": "replicaCount", "value": str(replicas)},
+                                                   {"name": "service.type", "value": "ClusterIP"}]}},
+                "destination": {"server": "https://kubernetes.default.svc", "namespace": env},
+            },
+            "status": {"resources": resources, "history": [{
+                "id": 0, "revision": "15.0.1", "deployedAt": now_iso(),
+                "source": {"repoURL": "https://charts.bitnami.com/bitnami", "chart": "nginx",
+                           "targetRevision": "15.0.1",
+                           "helm": {"parameters": [{"name": "replicaCount", "value": str(replicas)},
+                                                   {"name": "service.type", "value": "ClusterIP"}]}},
+            }]},
+        }, notify=False)
+
+    def add_blue_green(self, app, namespace, replicas=2):
+        """Create the blue/green Deployments and active/preview Services"""
+        for version, count in (("blue", replicas), ("green", 0)):
+            labels = {"app": f"{app}-bg", "version": version}
+            self.store.put("deployments", {
+                "metadata": {"name": f"{app}-{version}", "namespace": namespace},
+                "spec": {"replicas": count, "selector": {"matchLabels": dict(labels)},
+                         "template": {"metadata": {"labels": dict(labels)}}},
+            }, notify=False)
+        for service in ("active", "preview"):
+            self.store.put("services", {
+                "metadata": {"name": f"{app}-bg-{service}", "namespace": namespace},
+                "spec": {"type": "ClusterIP", "selector": {"app": f"{app}-bg", "version": "blue"}},
+            }, notify=False)
+
+    def add_canary(self, app, namespace, replicas=4):
+        """Create the stable/canary Deployments behind one Service"""
+        for track, count in (("stable", replicas), ("canary", 0)):
+            labels = {"app": app, "track": track}
+            self.store.put("deployments", {
+                "metadata": {"name": f"{app}-{track}", "namespace": namespace},
+                "spec": {"replicas": count, "selector": {"matchLabels": dict(labels)},
+                         "template": {"metadata": {"labels": dict(labels)}}},
+            }, notify=False)
+        self.store.put("services", {
+            "metadata": {"name": app, "namespace": namespace},
+            "spec": {"type": "ClusterIP", "selector": {"app": app}},
+        }, notify=False)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """HTTP front end for the fake cluster"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server_version = "fake-apiserver"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    # -- helpers -------------------------------------------------------------
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_text(self, status, text):
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, reason, message):
+        self._send_json(status, {"kind": "Status", "apiVersion": "v1", "status": "Failure",
+                                 "reason": reason, "message": message, "code": status})
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _route(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        match = NAMESPACE_PATH_RE.match(parsed.path)
+        if match:
+            return "namespaces", None, match.group("name"), None, query, parsed.path
+        match = PATH_RE.match(parsed.path)
+        if not match or match.group("kind") not in KINDS:
+            return None, None, None, None, query, parsed.path
+        return match.group("kind"), match.group("ns"), match.group("name"), match.group("sub"), query, parsed.path
+
+    def _inject_fault(self):
+        """Answer a share of the API requests with the injected error instead of serving them"""
+        server = self.server
+        if not server.fault_rate or random.random() >= server.fault_rate:
+            return False
+        if urllib.parse.urlsplit(self.path).path in ("/_fake/stats", "/metrics"):
+            return False
+        # The body is drained so the connection can be kept alive
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        with server.stats_lock:
+            server.stats["faults"] = server.stats.get("faults", 0) + 1
+        reason = {429: "TooManyRequests", 503: "ServiceUnavailable"}.get(server.fault_status, "InternalError")
+        data = json.dumps({"kind": "Status", "apiVersion": "v1", "status": "Failure", "reason": reason,
+                           "message": "injected fault", "code": server.fault_status}).encode("utf-8")
+        self.send_response(server.fault_status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if server.fault_retry_after is not None and server.fault_status in (429, 503):
+            self.send_header("Retry-After", str(server.fault_retry_after))
+        self.end_headers()
+        self.wfile.write(data)
+        return True
+
+    def _count(self, verb):
+        stats = self.server.stats
+        with self.server.stats_lock:
+            stats["requests"] += 1
+            stats[verb] = stats.get(verb, 0) + 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    # -- verbs ---------------------------------------------------------------
+
+    def do_GET(self):
+        if self._inject_fault():
+            return
+        if ARGOCD_API_RE.match(urllib.parse.urlsplit(self.path).path):
+            return self._argocd("GET")
+        kind, ns, name, sub, query, path = self._route()
+        if path == "/_fake/stats":
+            with self.server.stats_lock:
+                return self._send_json(200, dict(self.server.stats))
+        if path == "/metrics":
+            return self._send_text(200, self.server.traffic.exposition())
+        if path == "/version":
+            self._count("get")
+            return self._send_json(200, {"major": "1", "minor": "29", "gitVersion": "v1.29.0-fake"})
+        if kind is None:
+            self._count("get")
+            return self._error(404, "NotFound", f"unknown path {path}")
+        store = self.server.cluster.store
+        if name:
+            self._count("get")
+            obj = store.get(kind, ns, name)
+            if obj is None:
+                return self._error(404, "NotFound", f'{kind} "{name}" not found')
+            if sub == "scale":
+                return self._send_json(200, {"kind": "Scale", "spec": {"replicas": obj["spec"].get("replicas", 1)},
+                                             "metadata": obj["metadata"]})
+            return self._send_json(200, obj)
+        if query.get("watch") in ("1", "true"):
+            self._count("watch")
+            return self._watch(kind, ns, query)
+        self._count("list")
+        # The continue token is the namespace/name of the last object returned
+        token = query.get("continue")
+        after = tuple(token.split("/", 1)) if token else None
+        items, resource_version, remaining = store.list(kind, ns, query.get("labelSelector"),
+                                                        query.get("fieldSelector"), after,
+                                                        int(query.get("limit") or 0))
+        metadata = {"resourceVersion": resource_version}
+        if remaining:
+            metadata["continue"] = "/".join(object_key(items[-1]))
+            metadata["remainingItemCount"] = remaining
+        api_version, kind_name, _ = KINDS[kind]
+        self._send_json(200, {"kind": f"{kind_name}List", "apiVersion": api_version,
+                              "metadata": metadata, "items": items})
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_line(self, body):
+        """Send one JSON line as an HTTP chunk"""
+        data = json.dumps(body).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _watch(self, kind, ns, query):
+        store = self.server.cluster.store
+        resource_version = int(query.get("resourceVersion") or store.resource_version)
+        timeout = float(query.get("timeoutSeconds") or 300)
+        deadline = time.monotonic() + timeout
+        self._start_stream()
+        write_event = self._write_line
+
+        try:
+            while time.monotonic() < deadline:
+                with store.lock:
+                    events, oldest = store.events_since(resource_version, kind, ns,
+                                                        query.get("labelSelector"), query.get("fieldSelector"))
+                    if not events and resource_version + 1 < oldest:
+                        write_event({"type": "ERROR", "object": {"kind": "Status", "code": 410,
+                                                                 "reason": "Expired", "message": "too old"}})
+                        break
+                    if not events:
+                        store.lock.wait(min(0.5, max(0.0, deadline - time.monotonic())))
+                        continue
+                for rv, event_type, obj in events:
+                    write_event({"type": event_type, "object": obj})
+                    resource_version = rv
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def do_POST(self):
+        if self._inject_fault():
+            return
+        if ARGOCD_API_RE.match(urllib.parse.urlsplit(self.path).path):
+            return self._argocd("POST")
+        self._count("post")
+        self._error(405, "MethodNotAllowed", "POST is only served for the ArgoCD API")
+
+    def do_PATCH(self):
+        if self._inject_fault():
+            return
+        if ARGOCD_API_RE.match(urllib.parse.urlsplit(self.path).path):
+            return self._argocd("PATCH")
+        self._count("patch")
+        kind, ns, name, sub, _, path = self._route()
+        if kind is None or not name:
+            return self._error(404, "NotFound", f"unknown path {path}")
+        body = self._read_body()
+        content_type = self.headers.get("Content-Type", "")
+        store = self.server.cluster.store
+        if store.get(kind, ns, name) is None:
+            return self._error(404, "NotFound", f'{kind} "{name}" not found')
+        if sub == "scale":
+            body = {"spec": {"replicas": body["spec"]["replicas"]}}
+        error = []
+
+        def mutate(obj):
+            try:
+                if "json-patch" in content_type:
+                    patched = json_patch(obj, body)
+                else:
+                    patched = merge_patch(obj, body)
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                error.append(str(e))
+                return
+            obj.clear()
+            obj.update(patched)
+
+        result = store.update(kind, ns, name, mutate, bump_generation=True)
+        if error:
+            return self._error(422, "Invalid", error[0])
+        self._send_json(200, result)
+
+
+    # -- ArgoCD API ------------------------------------------------------------
+
+    def _argocd_error(self, status, message):
+        # grpc-gateway error body; code 16 is UNAUTHENTICATED, 5 NOT_FOUND, 3 INVALID_ARGUMENT
+        code = {401: 16, 404: 5}.get(status, 3)
+        self._send_json(status, {"error": message, "code": code, "message": message})
+
+    def _argocd(self, method):
+        self._count("argocd")
+        parsed = urllib.parse.urlsplit(self.path)
+        match = ARGOCD_API_RE.match(parsed.path)
+        if parsed.path == "/api/v1/session":
+            body = self._read_body() or {}
+            if method != "POST" or body.get("username") != "admin" or body.get("password") != ADMIN_PASSWORD:
+                return self._argocd_error(401, "Invalid username or password")
+            return self._send_json(200, {"token": self.server.issue_token()})
+        if not self.server.token_valid(self.headers.get("Authorization", "")):
+            self._read_body()
+            return self._argocd_error(401, "invalid session: token is expired")
+        if parsed.path == "/api/v1/stream/applications":
+            return self._argocd_stream(dict(urllib.parse.parse_qsl(parsed.query)).get("name"))
+        name, action = match.group("name"), match.group("action")
+        body = self._read_body() or {}
+        store = self.server.cluster.store
+        if store.get("applications", "argocd", name) is None:
+            return self._argocd_error(404, f'applications.argoproj.io "{name}" not found')
+        if method == "GET" and not action:
+            return self._send_json(200, store.get("applications", "argocd", name))
+        error = []
+
+        def mutate(app):
+            if method == "PATCH" and not action:
+                patch = json.loads(body.get("patch") or "{}")
+                patched = json_patch(app, patch) if body.get("patchType") == "json" else merge_patch(app, patch)
+                app.clear()
+                app.update(patched)
+            elif method == "POST" and action == "sync":
+                app["metadata"].setdefault("annotations", {})[REFRESH_ANNOTATION] = "normal"
+            elif method == "POST" and action == "rollback":
+                entries = [entry for entry in (app.get("status") or {}).get("history") or []
+                           if entry["id"] == body.get("id")]
+                if not entries:
+                    error.append(f"application {name} does not have deployment with id {body.get('id')}")
+                    return
+                app["spec"]["source"] = copy.deepcopy(entries[0]["source"])
+            else:
+                error.append(f"unsupported {method} {parsed.path}")
+
+        result = store.update("applications", "argocd", name, mutate)
+        if error:
+            return self._argocd_error(400, error[0])
+        self._send_json(200, result)
+
+    def _argocd_stream(self, name):
+        """Application events as grpc-gateway stream lines, starting with the current state"""
+        store = self.server.cluster.store
+        with store.lock:
+            app = store.get("applications", "argocd", name)
+            resource_version = store.resource_version
+        deadline = time.monotonic() + 300
+        self._start_stream()
+        try:
+            if app is not None:
+                self._write_line({"result": {"type": "ADDED", "application": app}})
+            while time.monotonic() < deadline:
+                with store.lock:
+                    events, _ = store.events_since(resource_version, "applications", "argocd", None,
+                                                   f"metadata.name={name}" if name else None)
+                    if not events:
+                        store.lock.wait(min(0.5, max(0.0, deadline - time.monotonic())))
+                        continue
+                for rv, event_type, obj in events:
+                    self._write_line({"result": {"type": event_type, "application": obj}})
+                    resource_version = rv
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+class FakeApiServer(ThreadingHTTPServer):
+    """Threaded HTTP server bound to a FakeCluster"""
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address, cluster, latency=0.0, verbose=False):
+        super().__init__(address, Handler)
+        self.cluster = cluster
+        self.latency = latency
+        self.verbose = verbose
+        self.stats = {"requests": 0}
+        self.stats_lock = threading.Lock()
+        self.traffic = FakeTraffic(cluster.store)
+        self.token_ttl = 86400
+        self.tokens = set()
+        # Share of requests answered with fault_status (and Retry-After: fault_retry_after)
+        self.fault_rate = 0.0
+        self.fault_status = 429
+        self.fault_retry_after = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve on a background thread"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def issue_token(self):
+        """A JWT-shaped ArgoCD session token (unsigned) that expires after token_ttl seconds"""
+        def encode(part):
+            return base64.urlsafe_b64encode(json.dumps(part).encode("utf-8")).rstrip(b"=").decode("ascii")
+        token = ".".join([encode({"alg": "none", "typ": "JWT"}),
+                          encode({"iss": "argocd", "sub": "admin", "exp": int(time.time() + self.token_ttl),
+                                  "jti": str(uuid.uuid4())}),
+                          "fake"])
+        with self.stats_lock:
+            self.tokens.add(token)
+        return token
+
+    def token_valid(self, authorization):
+        """True for 'Bearer <token>' with an unexpired token issued by this server"""
+        token = authorization[len("Bearer "):] if authorization.startswith("Bearer ") else ""
+        with self.stats_lock:
+            if token not in self.tokens:
+                return False
+        payload = token.split(".")[1]
+        expiry = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["exp"]
+        return expiry > time.time()
+
+    def reset_stats(self):
+        """Clear request counters"""
+        with self.stats_lock:
+            self.stats.clear()
+            self.stats["requests"] = 0
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Run a fake Kubernetes/ArgoCD API server')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to bind')
+    parser.add_argument('--port', type=int, default=8001, help='Port to bind (0 picks a free port)')
+    parser.add_argument('--apps', type=int, default=1, help='Number of applications per environment')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Latency injected into every request')
+    parser.add_argument('--sync-delay', type=float, default=0.2, help='Seconds before an Application becomes Synced')
+    parser.add_argument('--rollout-delay', type=float, default=0.2, help='Seconds before a Deployment is ready')
+    parser.add_argument('--degraded', action='append', default=[], help='Application that turns Degraded')
+    parser.add_argument('--rps-per-pod', type=float, default=20.0, help='Synthetic requests per second per ready canary-namespace pod')
+    parser.add_argument('--canary-error-rate', type=float, default=0.001, help='Error rate of nginx-canary on /metrics')
+    parser.add_argument('--canary-latency-ms', type=float, default=40.0, help='Median latency of nginx-canary on /metrics')
+    parser.add_argument('--argocd-token-ttl', type=float, default=86400, help='Seconds before an ArgoCD session token expires')
+    parser.add_argument('--fault-rate', type=float, default=0.0, help='Share of requests answered with --fault-status')
+    parser.add_argument('--fault-status', type=int, default=429, help='Status of an injected fault (e.g., 429, 503)')
+    parser.add_argument('--fault-retry-after', type=int, help='Retry-After seconds sent with an injected 429 or 503')
+    parser.add_argument('--verbose', action='store_true', help='Log every request')
+    args = parser.parse_args()
+
+    cluster = FakeCluster(sync_delay=args.sync_delay, rollout_delay=args.rollout_delay,
+                          degraded_apps=args.degraded)
+    cluster.seed(args.apps)
+    server = FakeApiServer((args.host, args.port), cluster, latency=args.latency_ms / 1000.0,
+                           verbose=args.verbose)
+    server.token_ttl = args.argocd_token_ttl
+    server.fault_rate = args.fault_rate
+    server.fault_status = args.fault_status
+    server.fault_retry_after = args.fault_retry_after
+    server.traffic.rps_per_pod = args.rps_per_pod
+    server.traffic.profiles = {"nginx-stable": (0.001, 0.04),
+                               "nginx-canary": (args.canary_error_rate, args.canary_latency_ms / 1000.0)}
+    print(f"Fake API server listening on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+End-to-End Benchmarks for the Python Scripts
+
+Starts the fake API server (benchmarks/fake_apiserver.py) seeded with a
+fleet of applications and runs test-argocd-helm.py (for the fleet and for
+the one application changed by the last commit), modify-and-test-helm.py
+and promote-blue-green.py (one application, then the whole fleet in waves)
+against it, once per fleet size. For each run it
+reports wall-clock time, API calls (read from the server's /_fake/stats),
+subprocess spawns of kubectl/argocd/helm (counted by shims placed first on
+PATH) and the peak RSS of the script process.
+
+Everything runs offline on a plain Linux box. With --baseline the results
+are compared to a previous --json report and the exit code is non-zero on
+a regression, so the suite can gate CI.
+
+Example:
+  python3 benchmarks/run_benchmarks.py --sizes 1,100,1000
+  python3 benchmarks/run_benchmarks.py --sizes 1,100 --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(os.path.dirname(BENCH_DIR), "scripts")
+ENVIRONMENTS = ["dev", "staging", "production"]
+SHIMMED_COMMANDS = ["kubectl", "argocd", "helm", "jq"]
+
+SHIM = """#!/bin/sh
+echo "$(basename "$0") $*" >> "{log}"
+echo "$(basename "$0") is not available in the benchmark environment" >&2
+exit 1
+"""
+
+# Metrics compared against a baseline; wall time is machine dependent and only checked when asked
+COUNTERS = ["api_calls", "spawns"]
+
+
+def start_server(apps, args):
+    """Start the fake API server and return (process, url)"""
+    command = [
+        sys.executable, os.path.join(BENCH_DIR, "fake_apiserver.py"), "--port", "0", "--apps", str(apps),
+        "--sync-delay", str(args.sync_delay), "--rollout-delay", str(args.rollout_delay),
+        "--latency-ms", str(args.latency_ms),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    line = process.stdout.readline()
+    if "listening on" not in line:
+        process.kill()
+        raise RuntimeError(f"Fake API server failed to start: {line.strip()}")
+    return process, line.rsplit(" ", 1)[-1].strip()
+
+
+def api_calls(url):
+    """Total requests served so far"""
+    with urllib.request.urlopen(f"{url}/_fake/stats", timeout=10) as response:
+        return json.loads(response.read())["requests"]
+
+
+def prepare_workdir(workdir, apps):
+    """Create PATH shims and the values files the scripts expect"""
+    shim_dir = os.path.join(workdir, "bin")
+    os.makedirs(shim_dir)
+    spawn_log = os.path.join(workdir, "spawns.log")
+    for command in SHIMMED_COMMANDS:
+        path = os.path.join(shim_dir, command)
+        with open(path, "w") as f:
+            f.write(SHIM.format(log=spawn_log))
+        os.chmod(path, 0o755)
+    for env in ENVIRONMENTS:
+        helm_dir = os.path.join(workdir, "gitops-solution", "environments", env, "helm-values")
+        os.makedirs(helm_dir)
+        for i in range(1, apps + 1):
+            with open(os.path.join(helm_dir, f"app{i}-values.yaml"), "w") as f:
+                f.write("# Benchmark values\nreplicaCount: 1\nimage:\n  tag: 1.25.3-debian-11-r5\n")
+    commit_values(workdir)
+    return shim_dir, spawn_log
+
+
+def commit_values(workdir):
+    """Commit the values files, then a change to one of them (what most pipeline runs see)"""
+    git = ["git", "-C", workdir, "-c", "user.name=benchmark", "-c", "user.email=benchmark@localhost",
+           "-c", "commit.gpgsign=false"]
+    subprocess.run(git + ["init", "-q"], check=True)
+    subprocess.run(git + ["add", "gitops-solution"], check=True)
+    subprocess.run(git + ["commit", "-q", "-m", "Benchmark values"], check=True)
+    with open(os.path.join(workdir, "gitops-solution", "environments", "staging", "helm-values",
+                           "app1-values.yaml"), "a") as f:
+        f.write("podAnnotations:\n  benchmark: changed\n")
+    subprocess.run(git + ["commit", "-q", "-a", "-m", "Change app1 in staging"], check=True)
+
+
+def scenarios(apps, workdir):
+    """(name, argv) for every script run at this fleet size"""
+    manifest = os.path.join(workdir, "changes.json")
+    with open(manifest, "w") as f:
+        json.dump([{"app": f"app{i}", "environment": "dev", "key": "image.tag", "value": "1.25.4"}
+                   for i in range(1, apps + 1)], f)
+    return [
+        ("test-argocd-helm", [os.path.join(SCRIPTS_DIR, "test-argocd-helm.py"), "--all", "--output", "json"]),
+        ("test-changed", [os.path.join(SCRIPTS_DIR, "test-argocd-helm.py"), "--changed", "HEAD~1..HEAD",
+                          "--output", "json"]),
+        ("modify-and-test-helm", [os.path.join(SCRIPTS_DIR, "modify-and-test-helm.py"), "--batch", manifest]),
+        # Undoes the batch edit of app1-dev from the snapshot it saved
+        ("restore-snapshot", [os.path.join(SCRIPTS_DIR, "restore-snapshot.py"), "app1-dev"]),
+        ("promote-blue-green", [os.path.join(SCRIPTS_DIR, "promote-blue-green.py"), "app1", "production",
+                                "--skip-confirmation"]),
+        ("promote-fleet", [os.path.join(SCRIPTS_DIR, "promote-blue-green.py"), "--all", "--namespace", "production",
+                           "--waves", "5,25,100", "--concurrency", "4,16,32"]),
+        # Offline: a cold render of every values file, then the same run answered from the cache
+        ("render-values", [os.path.join(SCRIPTS_DIR, "render-values.py"), "--output", "json"]),
+        ("render-values-cached", [os.path.join(SCRIPTS_DIR, "render-values.py"), "--output", "json"]),
+        # Reads back the timings the runs above recorded
+        ("latency-report", [os.path.join(SCRIPTS_DIR, "latency-report.py"), "--window", "1h"]),
+    ]
+
+
+def run_script(argv, url, shim_dir, spawn_log, workdir, timeout):
+    """Run one script and measure it"""
+    env = dict(os.environ)
+    env.update(KUBE_API_SERVER=url, PATH=shim_dir + os.pathsep + env.get("PATH", ""), PYTHONUNBUFFERED="1",
+               GITOPS_SNAPSHOT_DIR=os.path.join(workdir, "snapshots"),
+               GITOPS_LATENCY_DB=os.path.join(workdir, "latency.db"),
+               GITOPS_RENDER_CACHE=os.path.join(workdir, "render-cache"))
+    env.pop("KUBECONFIG", None)
+    open(spawn_log, "w").close()
+    calls_before = api_calls(url)
+    log_path = os.path.join(workdir, "output.log")
+    with open(log_path, "w") as log:
+        start = time.monotonic()
+        process = subprocess.Popen([sys.executable] + argv, cwd=workdir, env=env, stdin=subprocess.DEVNULL,
+                                   stdout=log, stderr=subprocess.STDOUT)
+        deadline = start + timeout
+        while True:
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            if time.monotonic() > deadline:
+                process.kill()
+                pid, status, usage = os.wait4(process.pid, 0)
+                break
+            time.sleep(0.01)
+        wall = time.monotonic() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    with open(spawn_log) as f:
+        spawns = sum(1 for _ in f)
+    with open(log_path) as f:
+        output = f.read()
+    return {
+        "exit_code": process.returncode,
+        "wall_seconds": round(wall, 3),
+        "api_calls": api_calls(url) - calls_before,
+        "spawns": spawns,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "output_tail": output.splitlines()[-5:] if process.returncode else [],
+    }
+
+
+def run_size(apps, args):
+    """Run every scenario against a fresh server seeded with apps applications per environment"""
+    results = []
+    workdir = tempfile.mkdtemp(prefix=f"gitops-bench-{apps}-")
+    process = None
+    try:
+        shim_dir, spawn_log = prepare_workdir(workdir, apps)
+        process, url = start_server(apps, args)
+        for name, argv in scenarios(apps, workdir):
+            result = run_script(argv, url, shim_dir, spawn_log, workdir, args.timeout)
+            result.update(scenario=name, apps=apps)
+            results.append(result)
+            print(f"  {name} @ {apps}: {result['wall_seconds']:.2f}s, {result['api_calls']} API calls, "
+                  f"{result['spawns']} spawns, {result['peak_rss_mb']} MB"
+                  + ("" if result["exit_code"] == 0 else f", exit {result['exit_code']}"), file=sys.stderr)
+    finally:
+        if process:
+            process.kill()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, max_regression, check_wall):
+    """Return a list of regression messages against a baseline report"""
+    previous = {(r["scenario"], r["apps"]): r for r in baseline.get("results", [])}
+    metrics = COUNTERS + (["wall_seconds"] if check_wall else [])
+    regressions = []
+    for result in results:
+        before = previous.get((result["scenario"], result["apps"]))
+        if not before:
+            continue
+        for metric in metrics:
+            limit = before[metric] * (1 + max_regression)
+            # Allow a little absolute slack so tiny counts do not flap
+            if result[metric] > limit and result[metric] - before[metric] > (1 if metric != "wall_seconds" else 0.5):
+                regressions.append(f"{result['scenario']} @ {result['apps']} apps: {metric} "
+                                   f"{before[metric]} -> {result[metric]}")
+    return regressions
+
+
+def print_table(results):
+    """Print results as an aligned table"""
+    rows = [("SCENARIO", "APPS", "WALL (s)", "API CALLS", "SPAWNS", "PEAK RSS (MB)", "EXIT")]
+    for r in results:
+        rows.append((r["scenario"], str(r["apps"]), f"{r['wall_seconds']:.2f}", str(r["api_calls"]),
+                     str(r["spawns"]), f"{r['peak_rss_mb']:.1f}", str(r["exit_code"])))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("   ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Python scripts against a local fake API server")
+    parser.add_argument("--sizes", default="1,100,1000", help="Comma-separated fleet sizes (apps per environment)")
+    parser.add_argument("--sync-delay", type=float, default=0.05, help="Seconds before an Application is Synced")
+    parser.add_argument("--rollout-delay", type=float, default=0.05, help="Seconds before a Deployment is ready")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latency injected into every API request")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds before a script run is killed")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="Fail on regressions against a previous --json report")
+    parser.add_argument("--max-regression", type=float, default=0.10,
+                        help="Allowed relative increase over the baseline (default 0.10)")
+    parser.add_argument("--check-wall-time", action="store_true", help="Also gate on wall-clock time")
+    args = parser.parse_args()
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        print(f"Fleet of {size} app(s) per environment...", file=sys.stderr)
+        results.extend(run_size(size, args))
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": [{k: v for k, v in r.items() if k != "output_tail"} for r in results]}, f,
+                      indent=2)
+            f.write("\n")
+
+    failed = [r for r in results if r["exit_code"] != 0]
+    for r in failed:
+        print(f"\n{r['scenario']} @ {r['apps']} apps exited with {r['exit_code']}:", file=sys.stderr)
+        for line in r["output_tail"]:
+            print(f"  {line}", file=sys.stderr)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression, args.check_wall_time)
+        for message in regressions:
+            print(f"REGRESSION: {message}", file=sys.stderr)
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+API Call Layer
+
+Every request the scripts send to the Kubernetes and ArgoCD API servers
+goes through one process-wide CallLayer, which:
+
+- rate-limits requests with a token bucket per API group (core, apps,
+  argoproj.io, ..., and argocd for the ArgoCD API), so a fleet-wide run
+  cannot flood the server. A 429 answer halves the rate of its group (at
+  most once a second, so a burst of concurrent 429s counts once); every
+  successful request raises it again by one request per second, up to
+  the configured rate.
+- coalesces identical reads in flight: a GET of a path another thread is
+  already fetching waits for that response instead of sending its own.
+  A completed write starts a new generation of reads, so a read issued
+  after a write never joins one sent before it.
+- retries with exponential backoff and full jitter: a 429 for any request
+  (the server did not process it), a 500/502/503/504 or a dropped
+  connection for reads (a write may have been applied), and a refused
+  connection for any request (it never arrived). A Retry-After header is
+  honoured.
+- counts what it did per group: stats() returns the requests sent, the
+  requests that queued for a token and how long they waited, the reads
+  coalesced, the retries and the 429 answers.
+
+Settings:
+
+  GITOPS_API_QPS       requests per second per API group (default 100;
+                       0 turns the rate limiter off)
+  GITOPS_API_BURST     requests a group may send at once (default 2 x QPS)
+  GITOPS_API_RETRIES   retries of a failed request (default 4)
+  GITOPS_API_COALESCE  off sends every read, even identical ones
+  GITOPS_API_STATS     print the per-group stats to stderr on exit
+"""
+
+import atexit
+import http.client
+import os
+import random
+import sys
+import threading
+import time
+
+import tracing
+
+QPS_ENV = "GITOPS_API_QPS"
+BURST_ENV = "GITOPS_API_BURST"
+RETRIES_ENV = "GITOPS_API_RETRIES"
+COALESCE_ENV = "GITOPS_API_COALESCE"
+STATS_ENV = "GITOPS_API_STATS"
+DISABLED = ("off", "none", "0", "false", "no")
+
+DEFAULT_QPS = 100
+DEFAULT_RETRIES = 4
+# Backoff before retry n (from 0) is uniform in [0, min(BACKOFF_CAP, BACKOFF_BASE * 2**n)]
+BACKOFF_BASE = 0.2
+BACKOFF_CAP = 10.0
+# Longest Retry-After honoured; a longer one is cut to this
+RETRY_AFTER_CAP = 60.0
+# A 429 never brings a group below this rate, and cuts it at most once per RATE_CUT_INTERVAL seconds
+MIN_QPS = 1.0
+RATE_CUT_INTERVAL = 1.0
+
+# Statuses retried for reads; 429 is retried for every request
+RETRYABLE_STATUSES = (500, 502, 503, 504)
+# Connection failures after which a read is retried
+CONNECTION_ERRORS = (OSError, http.client.HTTPException)
+# Methods safe to send twice
+IDEMPOTENT = ("GET", "HEAD")
+
+
+def api_group(path):
+    """The API group of a Kubernetes request path: core, apps, argoproj.io, ..."""
+    parts = path.split("?", 1)[0].strip("/").split("/")
+    if parts[0] == "api":
+        return "core"
+    if parts[0] == "apis" and len(parts) > 1:
+        return parts[1]
+    return parts[0] or "other"
+
+
+def _retry_after(error):
+    """Seconds of a Retry-After header carried by an error, or None"""
+    value = getattr(error, "retry_after", None)
+    try:
+        return min(RETRY_AFTER_CAP, max(0.0, float(value))) if value is not None else None
+    except ValueError:
+        # The HTTP-date form is not used by the API servers
+        return None
+
+
+class TokenBucket:
+    """Token bucket whose rate backs off on 429 answers and recovers on successes"""
+
+    def __init__(self, rate, burst):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.cut = None
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token and return the seconds to wait before using it. Tokens
+        may go negative, so waiting requests are served in arrival order.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def throttled(self):
+        """The server answered 429: halve the rate"""
+        with self.lock:
+            now = time.monotonic()
+            if self.cut is not None and now - self.cut < RATE_CUT_INTERVAL:
+                return
+            self.cut = now
+            self.rate = max(min(MIN_QPS, self.max_rate), self.rate / 2)
+
+    def succeeded(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + 1)
+
+
+class GroupStats:
+    """Counters of one API group"""
+
+    def __init__(self):
+        self.requests = 0
+        self.queued = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.coalesced = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+
+    def as_dict(self, bucket=None):
+        result = {
+            "requests": self.requests,
+            "queued": self.queued,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "max_wait_seconds": round(self.max_wait, 3),
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "failures": self.failures,
+        }
+        if bucket is not None:
+            result["qps"] = round(bucket.rate, 1)
+        return result
+
+
+class _Flight:
+    """A read in flight that identical reads wait for"""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CallLayer:
+    """Rate limiting, coalescing and retries shared by every API client of the process"""
+
+    def __init__(self, qps=DEFAULT_QPS, burst=None, retries=DEFAULT_RETRIES, coalesce=True):
+        self.qps = qps
+        self.burst = burst if burst else 2 * qps
+        self.retries = retries
+        self.coalesce = coalesce
+        self._buckets = {}
+        self._stats = {}
+        self._flights = {}
+        # Bumped by every completed write; part of the coalescing key
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _group(self, group):
+        """The (bucket, stats) of a group, created on first use"""
+        with self._lock:
+            if group not in self._stats:
+                self._stats[group] = GroupStats()
+                self._buckets[group] = TokenBucket(self.qps, self.burst) if self.qps > 0 else None
+            return self._buckets[group], self._stats[group]
+
+    def _acquire(self, group, bucket, stats):
+        """Wait for a token of the group's bucket"""
+        if bucket is None:
+            return
+        delay = bucket.reserve()
+        if delay <= 0:
+            return
+        with self._lock:
+            stats.queued += 1
+            stats.waiting += 1
+            stats.max_waiting = max(stats.max_waiting, stats.waiting)
+        start = time.perf_counter()
+        time.sleep(delay)
+        waited = time.perf_counter() - start
+        with self._lock:
+            stats.waiting -= 1
+            stats.wait_seconds += waited
+            stats.max_wait = max(stats.max_wait, waited)
+        tracing.record(f"rate limit {group}", "queue", start, waited)
+
+    def _retryable(self, method, error):
+        """Whether a failed request may be sent again"""
+        status = getattr(error, "status", None)
+        if status is not None:
+            return status == 429 or (status in RETRYABLE_STATUSES and method in IDEMPOTENT)
+        if isinstance(error, ConnectionRefusedError):
+            return True
+        return isinstance(error, CONNECTION_ERRORS) and method in IDEMPOTENT
+
+    def _send(self, method, group, bucket, stats, send):
+        attempt = 0
+        while True:
+            self._acquire(group, bucket, stats)
+            with self._lock:
+                stats.requests += 1
+            try:
+                result = send()
+            except Exception as e:
+                if getattr(e, "status", None) == 429:
+                    with self._lock:
+                        stats.throttled += 1
+                    if bucket is not None:
+                        bucket.throttled()
+                if attempt >= self.retries or not self._retryable(method, e):
+                    with self._lock:
+                        stats.failures += 1
+                    raise
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                retry_after = _retry_after(e)
+                if retry_after is not None:
+                    # Jitter on top, so the clients told the same delay do not all come back at once
+                    delay = retry_after + random.uniform(0, BACKOFF_BASE)
+                attempt += 1
+                with self._lock:
+                    stats.retries += 1
+                time.sleep(delay)
+                continue
+            if bucket is not None:
+                bucket.succeeded()
+            return result
+
+    def call(self, method, path, send, group=None, coalesce=True, key=None):
+        """
+        Send a request through the layer and return what send() returns.
+
+        send() performs one attempt and raises on failure; an exception
+        with a status attribute (ApiError) is an HTTP error answer.
+        group defaults to the API group of path. A GET with coalesce set
+        shares the result (or the exception) of an identical GET in flight:
+        one of the same group and key (default: path).
+        """
+        group = group or api_group(path)
+        bucket, stats = self._group(group)
+        if method != "GET" or not (coalesce and self.coalesce):
+            try:
+                return self._send(method, group, bucket, stats, send)
+            finally:
+                if method not in IDEMPOTENT:
+                    with self._lock:
+                        self._generation += 1
+        with self._lock:
+            key = (group, path if key is None else key, self._generation)
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                stats.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = self._send(method, group, bucket, stats, send)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        """{group: counters} of every API group used so far"""
+        with self._lock:
+            return {group: stats.as_dict(self._buckets.get(group)) for group, stats in sorted(self._stats.items())}
+
+
+def print_stats(stats, stream):
+    """Print the per-group stats as a table"""
+    if not stats:
+        return
+    columns = ("requests", "queued", "wait_seconds", "max_wait_seconds", "coalesced", "retries", "throttled",
+               "failures")
+    rows = [("GROUP",) + tuple(column.upper() for column in columns)]
+    rows += [(group,) + tuple(str(counters[column]) for column in columns) for group, counters in stats.items()]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip(), file=stream)
+
+
+def _number(name, default, kind):
+    value = (os.environ.get(name) or "").strip()
+    if not value:
+        return default
+    try:
+        return max(kind(0), kind(value))
+    except ValueError:
+        print(f"Ignoring {name}={value!r}: not a number", file=sys.stderr)
+        return default
+
+
+_layer = None
+_layer_lock = threading.Lock()
+
+
+def get_call_layer():
+    """Return the process-wide call layer, configured from the environment on first use"""
+    global _layer
+    with _layer_lock:
+        if _layer is None:
+            _layer = CallLayer(
+                qps=_number(QPS_ENV, DEFAULT_QPS, float),
+                burst=_number(BURST_ENV, 0, float),
+                retries=_number(RETRIES_ENV, DEFAULT_RETRIES, int),
+                coalesce=(os.environ.get(COALESCE_ENV) or "").strip().lower() not in DISABLED,
+            )
+            if os.environ.get(STATS_ENV, "").strip().lower() not in ("",) + DISABLED:
+                atexit.register(lambda: print_stats(_layer.stats(), sys.stderr))
+        return _layer
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+ArgoCD Application Patch Builder
+
+Turns Helm values into ArgoCD Helm parameters (one per leaf, with Helm
+`--set` paths such as `image.tag` or `ingress.hosts[0].name`) and builds
+the smallest JSON patch (RFC 6902) that brings a live Application to them:
+only changed parameters are replaced, new ones are appended and
+conflicting leftovers (e.g. a stray `image` parameter next to `image.tag`)
+are removed. Every replace and remove is guarded by a `test` op, so a
+concurrent edit makes the patch fail instead of clobbering it.
+
+A SHA-256 of the parameters is stored in an annotation on the Application.
+When it already matches, no patch (and no refresh) is needed at all. The
+names of the parameters are stored next to it, so a key later deleted from
+the values file is removed from the Application as well; parameters set by
+hand or by another tool are left alone.
+"""
+
+import hashlib
+import json
+
+from helm_values import ValuesError, format_path, parse_path, parse_scalar
+from k8s_client import ARGOCD_NAMESPACE, REFRESH_ANNOTATION, ApiError, resource_path
+
+VALUES_HASH_ANNOTATION = "gitops-solution/values-sha256"
+VALUES_PARAMETERS_ANNOTATION = "gitops-solution/values-parameters"
+AUTOMATED_SYNC = {"prune": True, "selfHeal": True}
+# How API servers word a failed JSON patch test op in a 422 answer
+TEST_FAILED_MESSAGES = ("test failed", "testing value", "test operation does not apply")
+
+
+def helm_parameters(values, prefix=()):
+    """Flatten nested values into a list of ArgoCD Helm parameters"""
+    parameters = []
+    if isinstance(values, dict):
+        items = values.items()
+    elif isinstance(values, list):
+        items = enumerate(values)
+    else:
+        return [_parameter(prefix, values)]
+    for key, value in items:
+        path = prefix + ((key if isinstance(key, int) else str(key)),)
+        if isinstance(value, (dict, list)):
+            # Empty collections cannot be expressed with --set and are left out
+            parameters.extend(helm_parameters(value, path))
+        else:
+            parameters.append(_parameter(path, value))
+    return parameters
+
+
+def _parameter(path, value):
+    if value is None:
+        text = "null"
+    elif isinstance(value, bool):
+        text = "true" if value else "false"
+    else:
+        text = str(value)
+    parameter = {"name": format_path(path), "value": text}
+    # Strings that Helm would read as another type (e.g. a quoted 'true' or '3') keep their type
+    if isinstance(value, str) and (text == "null" or not isinstance(parse_scalar(text), str)):
+        parameter["forceString"] = True
+    return parameter
+
+
+def values_hash(parameters):
+    """Content hash of a parameter list, independent of its order"""
+    canonical = json.dumps(sorted(parameters, key=lambda p: p["name"]), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def pointer(*parts):
+    """Build an RFC 6901 JSON pointer"""
+    return "".join("/" + str(part).replace("~", "~0").replace("/", "~1") for part in parts)
+
+
+def owned_parameters(app):
+    """Names of the parameters the last application_patch() set, from the Application's annotation"""
+    annotations = (app.get("metadata") or {}).get("annotations") or {}
+    try:
+        names = json.loads(annotations.get(VALUES_PARAMETERS_ANNOTATION) or "[]")
+    except ValueError:
+        return set()
+    return {name for name in names if isinstance(name, str)} if isinstance(names, list) else set()
+
+
+def _test_op_failed(error):
+    """Whether an ApiError answers a patch whose test op failed, i.e. the Application changed underneath it"""
+    if error.status == 409:
+        return True
+    message = (error.message or "").lower()
+    return error.status == 422 and any(text in message for text in TEST_FAILED_MESSAGES)
+
+
+def _prefixes(name):
+    """Every parent path of a parameter name (image.tag -> image)"""
+    try:
+        parts = parse_path(name)
+    except ValuesError:
+        return set()
+    return {format_path(parts[:depth]) for depth in range(1, len(parts))}
+
+
+def merge_parameters(parameters, overrides):
+    """
+    Apply override parameters on top of others the way application_patch()
+    applies them to a live Application: a parameter of the same name is
+    replaced in place, parameters that clash with an override (a stray
+    `image` next to `image.tag`) are dropped and new ones are appended.
+    Returns a new list.
+    """
+    wanted = {parameter["name"]: parameter for parameter in overrides}
+    wanted_prefixes = set()
+    for name in wanted:
+        wanted_prefixes |= _prefixes(name)
+    merged = []
+    for parameter in parameters:
+        name = parameter.get("name")
+        if name in wanted:
+            merged.append(dict(wanted[name]))
+        elif name not in wanted_prefixes and not _prefixes(name or "") & wanted.keys():
+            merged.append(dict(parameter))
+    present = {parameter.get("name") for parameter in parameters}
+    merged.extend(dict(parameter) for name, parameter in wanted.items() if name not in present)
+    return merged
+
+
+def application_patch(app, parameters, automated=True, complete=True):
+    """
+    Build the JSON patch that applies parameters to a live Application.
+
+    Returns (operations, changed) where changed lists the parameter names
+    that are added, replaced or removed.
+
+    With complete set, parameters is the whole flattened values file:
+    parameters the previous patch set that are no longer wanted are
+    removed, and the values hash and parameter names are recorded.
+    operations is empty when the stored values hash already matches. When
+    only the hash is missing or stale but every parameter is in place, the
+    patch just records the hash and does not request a refresh.
+
+    With complete unset, parameters only updates some of the values (e.g.
+    a promotion): no other parameter is removed unless it clashes with
+    one of them, the recorded parameter names are kept, and the values
+    hash is dropped since it no longer describes the live parameters.
+    """
+    digest = values_hash(parameters)
+    metadata = app.get("metadata") or {}
+    annotations = metadata.get("annotations") or {}
+    if complete and annotations.get(VALUES_HASH_ANNOTATION) == digest:
+        return [], []
+
+    spec = app.get("spec") or {}
+    source = spec.get("source")
+    if source is None:
+        raise ValueError(f"Application {metadata.get('name')} has no spec.source (multi-source is not supported)")
+    helm = source.get("helm")
+    live = (helm or {}).get("parameters") or []
+
+    operations = []
+    changed = []
+    if helm is None:
+        operations.append({"op": "add", "path": pointer("spec", "source", "helm"), "value": {"parameters": []}})
+    elif helm.get("parameters") is None:
+        operations.append({"op": "add", "path": pointer("spec", "source", "helm", "parameters"), "value": []})
+
+    live_index = {parameter.get("name"): index for index, parameter in enumerate(live)}
+    wanted = {parameter["name"] for parameter in parameters}
+    wanted_prefixes = set()
+    for name in wanted:
+        wanted_prefixes |= _prefixes(name)
+
+    # Replace changed parameters in place
+    for parameter in parameters:
+        index = live_index.get(parameter["name"])
+        if index is None:
+            continue
+        current = live[index]
+        if current.get("value") != parameter["value"] or bool(current.get("forceString")) != bool(
+                parameter.get("forceString")):
+            path = pointer("spec", "source", "helm", "parameters", index)
+            # The whole parameter, so a concurrent change of its value fails the patch too
+            operations.append({"op": "test", "path": path, "value": current})
+            operations.append({"op": "replace", "path": path, "value": parameter})
+            changed.append(parameter["name"])
+
+    # Remove parameters that would clash with the new ones or that were deleted from the values, highest index first
+    owned = owned_parameters(app) if complete else set()
+    removed = [index for index, parameter in enumerate(live)
+               if parameter.get("name") not in wanted
+               and (parameter.get("name") in owned or parameter.get("name") in wanted_prefixes
+                    or _prefixes(parameter.get("name", "")) & wanted)]
+    for index in reversed(removed):
+        path = pointer("spec", "source", "helm", "parameters", index)
+        operations.append({"op": "test", "path": path, "value": live[index]})
+        operations.append({"op": "remove", "path": path})
+        changed.append(live[index].get("name"))
+
+    # Append new parameters
+    for parameter in parameters:
+        if parameter["name"] not in live_index:
+            operations.append({"op": "add", "path": pointer("spec", "source", "helm", "parameters", "-"),
+                               "value": parameter})
+            changed.append(parameter["name"])
+
+    if not complete and not changed:
+        return [], []
+    new_annotations = {}
+    if complete:
+        new_annotations[VALUES_HASH_ANNOTATION] = digest
+        new_annotations[VALUES_PARAMETERS_ANNOTATION] = json.dumps(sorted(wanted), separators=(",", ":"))
+    if changed:
+        new_annotations[REFRESH_ANNOTATION] = "normal"
+        if automated:
+            sync_policy = spec.get("syncPolicy")
+            if sync_policy is None:
+                operations.append({"op": "add", "path": pointer("spec", "syncPolicy"),
+                                   "value": {"automated": dict(AUTOMATED_SYNC)}})
+            elif sync_policy.get("automated") != AUTOMATED_SYNC:
+                operations.append({"op": "add", "path": pointer("spec", "syncPolicy", "automated"),
+                                   "value": dict(AUTOMATED_SYNC)})
+    if metadata.get("annotations") is None:
+        operations.append({"op": "add", "path": pointer("metadata", "annotations"), "value": new_annotations})
+    else:
+        for key, value in new_annotations.items():
+            operations.append({"op": "add", "path": pointer("metadata", "annotations", key), "value": value})
+        # The next complete patch must not skip the values file as already applied
+        if not complete and VALUES_HASH_ANNOTATION in annotations:
+            operations.append({"op": "remove", "path": pointer("metadata", "annotations", VALUES_HASH_ANNOTATION)})
+    return operations, changed
+
+
+def apply_parameters(client, name, parameters, app=None, namespace=ARGOCD_NAMESPACE, attempts=3, complete=True):
+    """
+    Bring an Application to the given Helm parameters with one JSON patch.
+
+    app is the live object when the caller already has it. complete is
+    passed to application_patch(): unset it when parameters is only part
+    of the Application's values. Returns the list of changed parameter
+    names ([] when nothing had to change). A patch rejected because the
+    Application changed underneath it (a failed test op) is rebuilt from a
+    fresh GET and retried; any other rejection is raised at once.
+    """
+    path = resource_path("applications", namespace, name)
+    for attempt in range(attempts):
+        if app is None:
+            app = client.get(path)
+        operations, changed = application_patch(app, parameters, complete=complete)
+        if not operations:
+            return changed
+        try:
+            client.patch(path, operations, patch_type="json")
+            return changed
+        except ApiError as e:
+            if not _test_op_failed(e) or attempt == attempts - 1:
+                raise
+            app = None
+    return []
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+ArgoCD Application Waiter
+
+Waits for one or many ArgoCD Applications to become Synced and Healthy.
+The current state is taken from a single list of the Application
+collection, after which one watch stream (resumed from the list's
+resourceVersion) delivers every change as it happens. Each application
+finishes the moment it is Synced and Healthy, or fails fast when it turns
+Degraded, so there is no polling interval and only one open request to the
+API server no matter how many applications are being waited on.
+"""
+
+import time
+
+import latency_history
+from k8s_client import ARGOCD_NAMESPACE, REFRESH_ANNOTATION, ApiError, application_status, resource_path
+
+# Outcomes reported for each application
+READY = "ready"
+DEGRADED = "degraded"
+TIMEOUT = "timeout"
+MISSING = "missing"
+
+FAIL_FAST_HEALTH = ("Degraded",)
+
+
+def application_outcome(app, fail_fast_health=FAIL_FAST_HEALTH):
+    """Return READY, DEGRADED or None (still settling) for an Application object"""
+    # A pending refresh means the status has not been recomputed yet
+    annotations = app["metadata"].get("annotations") or {}
+    if REFRESH_ANNOTATION in annotations:
+        return None
+    operation = (app.get("status") or {}).get("operationState") or {}
+    if operation.get("phase") in ("Running", "Terminating"):
+        return None
+    sync_status, health_status = application_status(app)
+    if health_status in fail_fast_health:
+        return DEGRADED
+    if sync_status == "Synced" and health_status == "Healthy":
+        return READY
+    return None
+
+
+def wait_for_applications(client, names, timeout=150, namespace=ARGOCD_NAMESPACE,
+                          fail_fast_health=FAIL_FAST_HEALTH, on_update=None):
+    """
+    Wait until every named Application is Synced and Healthy. The time
+    each one took is recorded in the latency history as its sync phase.
+
+    Returns a dict mapping each name to a result dict with the keys
+    outcome (READY, DEGRADED, TIMEOUT or MISSING), sync, health, elapsed
+    (seconds until the outcome was reached) and app (the last Application
+    object seen, None when missing). on_update, if given,
+    is called as on_update(name, sync, health) whenever an application's
+    status changes.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    pending = set(names)
+    results = {}
+    last_seen = {}
+    objects = {}
+    collection = resource_path("applications", namespace)
+    # Narrow the list and the watch to the one object when waiting on a single app
+    field_selector = f"metadata.name={next(iter(pending))}" if len(pending) == 1 else None
+
+    def observe(app):
+        name = app["metadata"]["name"]
+        if name not in pending:
+            return
+        objects[name] = app
+        sync_status, health_status = application_status(app)
+        if last_seen.get(name) != (sync_status, health_status):
+            last_seen[name] = (sync_status, health_status)
+            if on_update:
+                on_update(name, sync_status, health_status)
+        outcome = application_outcome(app, fail_fast_health)
+        if outcome:
+            pending.discard(name)
+            results[name] = {"outcome": outcome, "sync": sync_status, "health": health_status,
+                             "elapsed": time.monotonic() - start, "app": app}
+
+    def relist():
+        listing = client.list(collection, field_selector=field_selector)
+        found = set()
+        for app in listing["items"]:
+            found.add(app["metadata"]["name"])
+            observe(app)
+        for name in pending - found:
+            pending.discard(name)
+            results[name] = {"outcome": MISSING, "sync": None, "health": None,
+                             "elapsed": time.monotonic() - start, "app": None}
+        return listing["metadata"].get("resourceVersion")
+
+    resource_version = relist()
+    while pending and time.monotonic() < deadline:
+        try:
+            for event in client.watch(collection, resource_version=resource_version,
+                                      timeout_seconds=deadline - time.monotonic(),
+                                      field_selector=field_selector):
+                obj = event.get("object") or {}
+                if event.get("type") == "ERROR":
+                    # 410 Gone: our resourceVersion is too old, start again from a fresh list
+                    if obj.get("code") == 410:
+                        resource_version = relist()
+                        break
+                    raise ApiError(obj.get("code", 500), obj.get("reason", "Error"), obj.get("message", ""))
+                resource_version = obj.get("metadata", {}).get("resourceVersion", resource_version)
+                if event.get("type") in ("ADDED", "MODIFIED"):
+                    observe(obj)
+                elif event.get("type") == "DELETED" and obj["metadata"]["name"] in pending:
+                    pending.discard(obj["metadata"]["name"])
+                    results[obj["metadata"]["name"]] = {"outcome": MISSING, "sync": None, "health": None,
+                                                        "elapsed": time.monotonic() - start, "app": None}
+                if not pending or time.monotonic() >= deadline:
+                    break
+        except ApiError as e:
+            if e.status != 410:
+                raise
+            resource_version = relist()
+
+    for name in pending:
+        sync_status, health_status = last_seen.get(name, (None, None))
+        results[name] = {"outcome": TIMEOUT, "sync": sync_status, "health": health_status,
+                         "elapsed": time.monotonic() - start, "app": objects.get(name)}
+    for name, result in results.items():
+        latency_history.record_application(result["app"] or name, "sync", result["elapsed"], result["outcome"])
+    return results
+
+
+def refresh_patch(automated=True):
+    """Merge patch that enables auto-sync and asks ArgoCD for an immediate refresh"""
+    patch = {"metadata": {"annotations": {REFRESH_ANNOTATION: "normal"}}}
+    if automated:
+        patch["spec"] = {"syncPolicy": {"automated": {"prune": True, "selfHeal": True}}}
+    return patch
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+ArgoCD Script Agent
+
+This script keeps the Python scripts loaded in one long-running process and
+runs them on request over a Unix socket. The agent pays the interpreter
+startup, the imports (including PyYAML), the connection settings and the
+API connections once. The ArgoCD namespace probe and the admin secret are
+also reused for --cache-ttl seconds. Each request then costs only the work
+of the script itself.
+
+  argocd-agent.py serve                                 # start the agent
+  argocd-agent.py run test-argocd-helm --all            # run a script in it
+  argocd-agent.py status | stop
+
+Requests and replies are newline-delimited JSON. A request names a script,
+its arguments and the working directory:
+
+  {"script": "test-argocd-helm", "argv": ["--all"], "cwd": "/work"}
+
+The agent streams back {"stream": "stdout"|"stderr", "data": ...} lines
+while the script runs and ends with {"exit": code, "elapsed": seconds}.
+"""
+
+import sys
+import os
+import json
+import time
+import signal
+import socket
+import argparse
+import contextvars
+import importlib.util
+import io
+import socketserver
+import threading
+import traceback
+
+# ANSI color codes
+GREEN = '\033[0;32m'
+RED = '\033[0;31m'
+YELLOW = '\033[0;33m'
+NC = '\033[0m'  # No Color
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = ["test-argocd-helm", "modify-and-test-helm", "promote-blue-green", "validate-and-promote", "canary-promote",
+           "rollback", "restore-snapshot", "latency-report", "render-values"]
+SOCKET_ENV = "GITOPS_AGENT_SOCKET"
+# Streams of the request the current thread runs; unset in the agent's own threads
+REQUEST_STREAMS = contextvars.ContextVar("agent_streams", default=None)
+
+def print_color(color, message):
+    """Print colored message"""
+    print(f"{color}{message}{NC}")
+
+def default_socket_path():
+    """GITOPS_AGENT_SOCKET, or a per-user socket in the runtime directory"""
+    if os.environ.get(SOCKET_ENV):
+        return os.environ[SOCKET_ENV]
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(runtime_dir, f"argocd-agent-{os.getuid()}.sock")
+
+def script_name(name):
+    """Normalize 'test-argocd-helm.py' or a path to a known script name"""
+    name = os.path.basename(name)
+    if name.endswith(".py"):
+        name = name[:-3]
+    if name not in SCRIPTS:
+        raise ValueError(f"unknown script '{name}' (expected one of: {', '.join(SCRIPTS)})")
+    return name
+
+def load_script(name):
+    """Import a hyphenated script as a module without running it"""
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(SCRIPTS_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run_main(module, argv):
+    """Call a script's main(argv) and return its exit code"""
+    try:
+        code = module.main(argv)
+    except SystemExit as e:
+        code = e.code
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+class RequestStream:
+    """Text stream that sends complete lines of one request's output to its client"""
+    
+    def __init__(self, reply, name):
+        self.reply = reply
+        self.name = name
+        self.buffer = ""
+    
+    def write(self, text):
+        self.buffer += text
+        if "\n" in self.buffer:
+            data, _, self.buffer = self.buffer.rpartition("\n")
+            self.reply({"stream": self.name, "data": data + "\n"})
+        return len(text)
+    
+    def flush(self):
+        if self.buffer:
+            data, self.buffer = self.buffer, ""
+            self.reply({"stream": self.name, "data": data})
+    
+    def isatty(self):
+        return False
+
+class ThreadRouter:
+    """
+    Stand-in for sys.stdin/stdout/stderr that sends reads and writes to the
+    streams of the request the calling thread runs (REQUEST_STREAMS). Other
+    threads, including the worker threads a script starts, use the agent's
+    own; the scripts print from the thread that runs main().
+    """
+    
+    def __init__(self, default, name):
+        self.default = default
+        self.name = name
+    
+    def _target(self):
+        streams = REQUEST_STREAMS.get()
+        return streams[self.name] if streams else self.default
+    
+    def write(self, text):
+        return self._target().write(text)
+    
+    def readline(self, *args):
+        return self._target().readline(*args)
+    
+    def read(self, *args):
+        return self._target().read(*args)
+    
+    def flush(self):
+        self._target().flush()
+    
+    def isatty(self):
+        return self._target().isatty()
+    
+    def __getattr__(self, name):
+        return getattr(self.default, name)
+
+class WorkingDirectory:
+    """
+    Shares the process working directory between requests: requests from
+    the same directory run concurrently, a request from another directory
+    waits until the running ones finish
+    """
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.current = os.getcwd()
+        self.active = 0
+    
+    def enter(self, path):
+        with self.condition:
+            while self.active and path != self.current:
+                self.condition.wait()
+            if path != self.current:
+                os.chdir(path)
+                self.current = path
+            self.active += 1
+    
+    def leave(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+class Agent:
+    """Loaded scripts, the shared API client and request statistics"""
+    
+    def __init__(self, cache_ttl=300, max_requests=8):
+        # Imported here, not at the top, so the thin client does not pay for them
+        from k8s_client import get_client
+        from latency_history import flush
+        self.flush_latencies = flush
+        self.modules = {name: load_script(name) for name in SCRIPTS}
+        self.client = get_client()
+        self.client.cache_ttl = cache_ttl
+        self.slots = threading.BoundedSemaphore(max_requests)
+        self.cwd = WorkingDirectory()
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.served = 0
+        self.active = 0
+    
+    def status(self):
+        with self.lock:
+            return {
+                "pid": os.getpid(),
+                "uptime": round(time.monotonic() - self.started, 1),
+                "requests": self.served,
+                "active": self.active,
+                "api_requests": self.client.request_count,
+                "api_groups": self.client.stats(),
+                "scripts": sorted(self.modules),
+            }
+    
+    def run(self, request, reply):
+        """Run one script request, streaming its output through reply(message)"""
+        start = time.monotonic()
+        try:
+            module = self.modules[script_name(request.get("script", ""))]
+            argv = [str(arg) for arg in request.get("argv") or []]
+            cwd = request.get("cwd") or os.getcwd()
+            if not os.path.isdir(cwd):
+                raise ValueError(f"working directory not found: {cwd}")
+        except ValueError as e:
+            reply({"stream": "stderr", "data": f"{e}\n"})
+            reply({"exit": 2, "elapsed": 0.0})
+            return
+    
+        # Prompts read an empty stdin, so they see end of file instead of blocking the agent
+        streams = {"stdin": io.StringIO(), "stdout": RequestStream(reply, "stdout"),
+                   "stderr": RequestStream(reply, "stderr")}
+        with self.slots:
+            with self.lock:
+                self.active += 1
+            self.cwd.enter(cwd)
+            token = REQUEST_STREAMS.set(streams)
+            try:
+                code = run_main(module, argv)
+            except Exception:
+                traceback.print_exc()
+                code = 1
+            finally:
+                streams["stdout"].flush()
+                streams["stderr"].flush()
+                REQUEST_STREAMS.reset(token)
+                self.cwd.leave()
+                with self.lock:
+                    self.active -= 1
+                    self.served += 1
+        # A long-running agent never reaches the atexit hook, so record the timings per request
+        self.flush_latencies()
+        reply({"exit": code, "elapsed": round(time.monotonic() - start, 3)})
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Reads one JSON request per connection and writes newline-delimited JSON replies"""
+    
+    def handle(self):
+        lock = threading.Lock()
+        connected = [True]
+    
+        def reply(message):
+            # A client that went away must not interrupt a running script
+            if not connected[0]:
+                return
+            with lock:
+                try:
+                    self.wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+                    self.wfile.flush()
+                except OSError:
+                    connected[0] = False
+    
+        try:
+            request = json.loads(self.rfile.readline() or b"{}")
+        except ValueError:
+            reply({"error": "invalid request"})
+            return
+        agent = self.server.agent
+        command = request.get("command", "run")
+        if command == "status":
+            reply(agent.status())
+        elif command == "stop":
+            reply({"stopping": True})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+        elif command == "run":
+            agent.run(request, reply)
+        else:
+            reply({"error": f"unknown command '{command}'"})
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def remove_stale_socket(path):
+    """Remove a socket left by an agent that is no longer running; fail if one is"""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(f"an agent is already listening on {path}")
+
+def serve(path, cache_ttl, max_requests):
+    """Load the scripts, connect and serve requests until stopped"""
+    from k8s_client import KubeConfigError
+    try:
+        agent = Agent(cache_ttl, max_requests)
+        remove_stale_socket(path)
+    except (KubeConfigError, OSError) as e:
+        print_color(RED, f"Cannot start the agent: {e}")
+        return 1
+    
+    sys.stdin = ThreadRouter(sys.stdin, "stdin")
+    sys.stdout = ThreadRouter(sys.stdout, "stdout")
+    sys.stderr = ThreadRouter(sys.stderr, "stderr")
+    
+    # Credentials stay warm in this process, so only the owner may connect
+    old_umask = os.umask(0o177)
+    try:
+        server = AgentServer(path, RequestHandler)
+    finally:
+        os.umask(old_umask)
+    server.agent = agent
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    print_color(GREEN, f"ArgoCD agent listening on {path} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+    print_color(YELLOW, f"ArgoCD agent stopped after {agent.status()['requests']} request(s).")
+    return 0
+
+def send(path, request):
+    """Send one request and yield the agent's replies"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    try:
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as replies:
+            for line in replies:
+                yield json.loads(line)
+    finally:
+        sock.close()
+
+def run_remote(path, script, argv, fallback=False):
+    """Run a script in the agent, streaming its output; optionally run it here if no agent is up"""
+    request = {"script": script, "argv": argv, "cwd": os.getcwd()}
+    try:
+        for message in send(path, request):
+            if "stream" in message:
+                target = sys.stdout if message["stream"] == "stdout" else sys.stderr
+                target.write(message["data"])
+                target.flush()
+            elif "exit" in message:
+                return message["exit"]
+            elif "error" in message:
+                print_color(RED, f"Agent error: {message['error']}")
+                return 2
+    except (FileNotFoundError, ConnectionRefusedError):
+        if not fallback:
+            print_color(RED, f"No ArgoCD agent is listening on {path}. Start one with: argocd-agent.py serve")
+            return 1
+        try:
+            return run_main(load_script(script_name(script)), argv)
+        except ValueError as e:
+            print_color(RED, str(e))
+            return 2
+    print_color(RED, "The agent closed the connection before the script finished.")
+    return 1
+
+def main(argv=None):
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Serve the ArgoCD scripts from a long-running agent')
+    parser.add_argument('--socket', default=default_socket_path(), help=f'Unix socket path (default: ${SOCKET_ENV} or a per-user socket)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='Start the agent')
+    serve_parser.add_argument('--cache-ttl', type=float, default=300, help='Seconds the ArgoCD namespace probe and admin secret are reused')
+    serve_parser.add_argument('--max-requests', type=int, default=8, help='Requests run at the same time; more wait for a slot')
+    run_parser = commands.add_parser('run', help='Run a script in the agent')
+    run_parser.add_argument('--fallback', action='store_true', help='Run the script in this process when no agent is listening')
+    run_parser.add_argument('script', help=f'Script to run ({", ".join(SCRIPTS)})')
+    run_parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments passed to the script')
+    commands.add_parser('status', help='Show the agent status')
+    commands.add_parser('stop', help='Stop the agent')
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == 'serve':
+        return serve(args.socket, args.cache_ttl, max(1, args.max_requests))
+    if args.command == 'run':
+        try:
+            script_name(args.script)
+        except ValueError as e:
+            parser.error(str(e))
+        return run_remote(args.socket, args.script, args.args, args.fallback)
+    
+    try:
+        reply = next(send(args.socket, {"command": args.command}), {})
+    except (FileNotFoundError, ConnectionRefusedError):
+        print_color(RED, f"No ArgoCD agent is listening on {args.socket}.")
+        return 1
+    if args.command == 'status':
+        print(json.dumps(reply, indent=2))
+    else:
+        print_color(GREEN, "ArgoCD agent stopping.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
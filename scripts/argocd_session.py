@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+ArgoCD API Session
+
+Talks to the ArgoCD API server (the REST API behind the argocd CLI) over
+one pool of keep-alive HTTPS connections, so a script logs in at most once
+and never starts an argocd process.
+
+The session token is taken from, in this order:
+
+1. ARGOCD_AUTH_TOKEN
+2. The token cache: one token per server in a JSON file readable only by
+   its owner ($ARGOCD_SESSION_CACHE, default
+   ~/.cache/gitops-argocd/sessions.json). Tokens are reused until shortly
+   before the expiry recorded in the JWT.
+3. A login (POST /api/v1/session) with the admin password, read from
+   argocd-initial-admin-secret through the Kubernetes API only when needed
+
+A request answered with 401 (the session was revoked or expired early)
+logs in again once and is retried. The server is ARGOCD_SERVER (default
+localhost:8080, the port-forward used by the shell scripts); TLS is not
+verified for localhost or when ARGOCD_INSECURE is set, like argocd login
+--insecure.
+"""
+
+import base64
+import json
+import os
+import socket
+import ssl
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import latency_history
+import tracing
+from api_calls import get_call_layer
+from app_waiter import DEGRADED, READY, TIMEOUT, application_outcome
+from k8s_client import (ARGOCD_NAMESPACE, ApiError, ConnectionPool, application_status, get_client,
+                        operation_name, resource_path)
+
+SERVER_ENV = "ARGOCD_SERVER"
+TOKEN_ENV = "ARGOCD_AUTH_TOKEN"
+INSECURE_ENV = "ARGOCD_INSECURE"
+CACHE_ENV = "ARGOCD_SESSION_CACHE"
+DEFAULT_SERVER = "localhost:8080"
+ADMIN_SECRET = "argocd-initial-admin-secret"
+
+# A cached token is replaced this many seconds before it expires
+EXPIRY_MARGIN = 60
+
+
+class ArgoCDError(ApiError):
+    """Raised when the ArgoCD API server answers with a non-2xx status"""
+
+
+def admin_password(client=None):
+    """The initial admin password from argocd-initial-admin-secret, or None"""
+    secret = (client or get_client()).get_cached(resource_path("secrets", ARGOCD_NAMESPACE, ADMIN_SECRET))
+    encoded = ((secret or {}).get("data") or {}).get("password")
+    return base64.b64decode(encoded).decode("utf-8") if encoded else None
+
+
+def mask(secret):
+    """A secret for display: never more than its first two characters"""
+    return f"{secret[:2]}{'*' * 8}" if secret and len(secret) > 8 else "*" * 8
+
+
+def token_expiry(token):
+    """exp claim of a JWT in seconds since the epoch, or None (the signature is not checked)"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def token_valid(token, margin=EXPIRY_MARGIN):
+    """True unless the token expires within margin seconds (tokens without exp never expire)"""
+    expiry = token_expiry(token)
+    return bool(token) and (expiry is None or expiry - margin > time.time())
+
+
+def server_url(server):
+    """https://host:port for a bare host:port, as accepted by argocd login"""
+    server = server.strip().rstrip("/")
+    return server if "://" in server else f"https://{server}"
+
+
+def application_history(app):
+    """Deployment history of an Application object, oldest first"""
+    return (app.get("status") or {}).get("history") or []
+
+
+class TokenCache:
+    """Session tokens per ArgoCD server in a file only its owner can read"""
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get(CACHE_ENV) or os.path.join(
+            os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "gitops-argocd", "sessions.json")
+        self.lock = threading.Lock()
+
+    def _read(self):
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return {}
+        with os.fdopen(fd) as f:
+            info = os.fstat(f.fileno())
+            # A file others can read (or that someone else owns) is not trusted
+            if info.st_mode & 0o077 or info.st_uid != os.getuid():
+                return {}
+            try:
+                data = json.load(f)
+            except ValueError:
+                return {}
+        return data if isinstance(data, dict) else {}
+
+    def _write(self, data):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # mkstemp creates the file with mode 0600; the rename makes the update atomic
+        fd, temporary = tempfile.mkstemp(prefix=".sessions-", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+            os.replace(temporary, self.path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def load(self, server):
+        """A cached token for server that is not about to expire, or None"""
+        with self.lock:
+            token = (self._read().get(server) or {}).get("token")
+        return token if token_valid(token) else None
+
+    def store(self, server, token):
+        with self.lock:
+            data = self._read()
+            data[server] = {"token": token, "expires": token_expiry(token)}
+            self._write(data)
+
+    def clear(self, server):
+        with self.lock:
+            data = self._read()
+            if data.pop(server, None) is not None:
+                self._write(data)
+
+
+class ArgoCDSession:
+    """ArgoCD API client with a pooled connection and a cached, self-refreshing session token"""
+
+    def __init__(self, server=None, token=None, password=None, username="admin", cache=None, insecure=None,
+                 maxsize=8, timeout=30):
+        self.server = server_url(server or os.environ.get(SERVER_ENV) or DEFAULT_SERVER)
+        parsed = urllib.parse.urlsplit(self.server)
+        if insecure is None:
+            insecure = (os.environ.get(INSECURE_ENV, "").lower() in ("1", "true", "yes")
+                        or parsed.hostname in ("localhost", "127.0.0.1", "::1"))
+        context = None
+        if parsed.scheme == "https":
+            context = ssl.create_default_context()
+            if insecure:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+        self.pool = ConnectionPool(self.server, context, maxsize=maxsize, timeout=timeout)
+        # Shares the rate limiter, coalescing and retries of the Kubernetes client, as API group "argocd"
+        self.calls = get_call_layer()
+        self.username = username
+        # password may be a callable, so the admin secret is only read when a login is needed
+        self.password = password
+        self.cache = cache if cache is not None else TokenCache()
+        self.fixed_token = token or os.environ.get(TOKEN_ENV)
+        self.token = self.fixed_token
+        self.logins = 0
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+        self._login_lock = threading.Lock()
+
+    # -- transport -------------------------------------------------------------
+
+    def _send(self, method, path, body=None, token=None, timeout=None):
+        """Send one request and return the decoded JSON response"""
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Accept": "application/json", "User-Agent": "gitops-argocd-scripts"}
+        if payload is not None:
+            headers["Content-Type"] = "application/json"
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+
+        def send():
+            with self._count_lock:
+                self.request_count += 1
+            with tracing.span(operation_name(method, path), "api", request_bytes=len(payload or b"")) as span:
+                response, data = self.pool.fetch(method, path, body=payload, headers=headers, timeout=timeout)
+                span.set(http_status=response.status, response_bytes=len(data))
+                if response.status >= 400:
+                    raise self._error(response.status, response.reason, data, response.getheader("Retry-After"))
+            return data
+
+        # Only reads sent with the same token are coalesced
+        data = self.calls.call(method, path, send, group="argocd", key=(path, token))
+        return json.loads(data) if data else {}
+
+    @staticmethod
+    def _error(status, reason, data, retry_after=None):
+        """ArgoCDError from an error response (grpc-gateway bodies carry error/message)"""
+        try:
+            decoded = json.loads(data)
+            message = decoded.get("message") or decoded.get("error") or ""
+        except ValueError:
+            decoded = None
+            message = data.decode("utf-8", "replace").strip()
+        return ArgoCDError(status, reason, message, decoded, retry_after)
+
+    # -- session ---------------------------------------------------------------
+
+    def login(self, force=False):
+        """
+        A usable session token: ARGOCD_AUTH_TOKEN, the current or cached one,
+        or a new one from a login. force skips the current and cached tokens.
+        """
+        with self._login_lock:
+            if self.fixed_token:
+                return self.fixed_token
+            if not force:
+                if token_valid(self.token):
+                    return self.token
+                self.token = self.cache.load(self.server)
+                if self.token:
+                    return self.token
+            password = self.password() if callable(self.password) else self.password
+            if password is None:
+                password = admin_password()
+            if not password:
+                raise ArgoCDError(401, "Unauthorized", f"no password to log in to {self.server} "
+                                                       f"(set {TOKEN_ENV} or create {ADMIN_SECRET})")
+            with tracing.span("argocd login", "api"):
+                reply = self._send("POST", "/api/v1/session", {"username": self.username, "password": password})
+            self.token = reply.get("token")
+            if not self.token:
+                raise ArgoCDError(500, "Internal", "login succeeded without a session token")
+            self.logins += 1
+            self.cache.store(self.server, self.token)
+            return self.token
+
+    def request(self, method, path, body=None, timeout=None):
+        """Authenticated request; a 401 logs in again once and retries"""
+        token = self.login()
+        try:
+            return self._send(method, path, body, token, timeout)
+        except ArgoCDError as e:
+            if e.status != 401 or self.fixed_token:
+                raise
+        # The token was revoked or expired early: drop it and log in again
+        with self._login_lock:
+            self.cache.clear(self.server)
+            self.token = None
+        return self._send(method, path, body, self.login(force=True), timeout)
+
+    # -- applications ----------------------------------------------------------
+
+    @staticmethod
+    def _application_path(name, action=""):
+        return f"/api/v1/applications/{urllib.parse.quote(name, safe='')}{action}"
+
+    def get_application(self, name):
+        """The Application object, or None if it does not exist"""
+        try:
+            return self.request("GET", self._application_path(name))
+        except ArgoCDError as e:
+            if e.status in (403, 404):
+                # ArgoCD answers 403 rather than 404 for applications the user cannot see
+                return None
+            raise
+
+    def patch_application(self, name, patch, patch_type="merge"):
+        """Patch an Application (argocd app set); patch is a merge or JSON patch object"""
+        return self.request("PATCH", self._application_path(name),
+                            {"name": name, "patch": json.dumps(patch), "patchType": patch_type})
+
+    def sync(self, name, revision=None, prune=False):
+        """Start a sync operation (argocd app sync without waiting)"""
+        body = {"name": name, "prune": prune}
+        if revision:
+            body["revision"] = revision
+        return self.request("POST", self._application_path(name, "/sync"), body)
+
+    def rollback(self, name, history_id, prune=False):
+        """Roll back to a deployment history entry (argocd app rollback without waiting)"""
+        return self.request("POST", self._application_path(name, "/rollback"),
+                            {"name": name, "id": int(history_id), "prune": prune})
+
+    def watch_application(self, name, timeout):
+        """Yield the Application every time it changes, until timeout seconds have passed"""
+        token = self.login()
+        path = f"/api/v1/stream/applications?{urllib.parse.urlencode({'name': name})}"
+        headers = {"Accept": "application/json", "Authorization": f"Bearer {token}",
+                   "User-Agent": "gitops-argocd-scripts"}
+
+        def open_stream():
+            with self._count_lock:
+                self.request_count += 1
+            conn, response = self.pool.open("GET", path, headers=headers, timeout=max(0.1, timeout))
+            if response.status >= 400:
+                data = response.read()
+                conn.close()
+                raise self._error(response.status, response.reason, data, response.getheader("Retry-After"))
+            return conn, response
+
+        start = time.perf_counter()
+        conn, response = self.calls.call("GET", path, open_stream, group="argocd", coalesce=False)
+        events = 0
+        try:
+            while True:
+                try:
+                    line = response.readline()
+                except socket.timeout:
+                    # TimeoutError from 3.10 on; before that an OSError subclass of its own
+                    return
+                if not line:
+                    return
+                line = line.strip()
+                if line:
+                    events += 1
+                    application = (json.loads(line).get("result") or {}).get("application")
+                    if application:
+                        yield application
+        finally:
+            tracing.record("WATCH argocd applications", "api", start, time.perf_counter() - start, events=events)
+            # A stream is never reused for another request
+            conn.close()
+
+    def wait_for_application(self, name, timeout=300, health_only=False, until=None):
+        """
+        Wait until an Application is Healthy (and Synced unless health_only,
+        like argocd app wait --health). until(app), if given, must also hold,
+        e.g. that a requested rollback shows up in the history. Returns a
+        result dict with outcome (READY, DEGRADED or TIMEOUT), sync, health
+        and elapsed, which is also recorded in the latency history.
+        """
+        start = time.monotonic()
+        deadline = start + timeout
+
+        def result(outcome, app):
+            sync_status, health_status = application_status(app or {})
+            elapsed = time.monotonic() - start
+            latency_history.record_application(app or name, "sync", elapsed, outcome)
+            return {"outcome": outcome, "sync": sync_status, "health": health_status, "elapsed": elapsed}
+
+        def outcome(app):
+            if not health_only:
+                return application_outcome(app)
+            operation = (app.get("status") or {}).get("operationState") or {}
+            if operation.get("phase") in ("Running", "Terminating"):
+                return None
+            health_status = application_status(app)[1]
+            if health_status == "Degraded":
+                return DEGRADED
+            return READY if health_status == "Healthy" else None
+
+        app = None
+        with tracing.span("sync wait", app=name):
+            while time.monotonic() < deadline:
+                for app in self.watch_application(name, deadline - time.monotonic()):
+                    if until is not None and not until(app):
+                        continue
+                    state = outcome(app)
+                    if state:
+                        return result(state, app)
+        return result(TIMEOUT, app)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the process-wide shared ArgoCD session, creating it on first use"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = ArgoCDSession()
+        return _session
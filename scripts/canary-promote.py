@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Progressive Canary Promotion Script
+
+This script promotes a canary deployment step by step. At every step of
+the schedule it splits the replicas between the canary and stable
+deployments, scales both at once, waits for them to be ready and then
+analyzes the canary's error rate and latency from a Prometheus metrics
+endpoint. The canary advances to the next step when the metrics pass and
+is rolled back to 0% as soon as they fail.
+"""
+
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from canary_analysis import CanaryAnalysis, MetricsError, evaluate, scrape
+from cutover import ObjectWatcher, parse_waves, scale_deployment
+from k8s_client import ApiError, KubeConfigError, deployment_ready, get_client
+from tracing import span
+
+# ANSI color codes
+GREEN = '\033[0;32m'
+RED = '\033[0;31m'
+YELLOW = '\033[0;33m'
+BLUE = '\033[0;34m'
+NC = '\033[0m'  # No Color
+
+def print_color(color, message):
+    """Print colored message"""
+    print(f"{color}{message}{NC}")
+
+def replica_split(total, weight):
+    """
+    (canary, stable) replicas for a canary weight in percent.
+    
+    The canary gets the nearest whole share of total. Between 0% and 100%
+    both sides keep at least one replica, which needs one extra replica
+    only when total is 1.
+    """
+    if weight <= 0:
+        return 0, total
+    if weight >= 100:
+        return total, 0
+    total = max(total, 2)
+    canary = min(total - 1, max(1, int(total * weight / 100 + 0.5)))
+    return canary, total - canary
+
+def transition(current, target, max_surge):
+    """Intermediate splits from current to target that move at most max_surge replicas at a time"""
+    canary, stable = current
+    splits = []
+    while (canary, stable) != tuple(target):
+        canary += max(-max_surge, min(max_surge, target[0] - canary))
+        stable += max(-max_surge, min(max_surge, target[1] - stable))
+        splits.append((canary, stable))
+    return splits
+
+class CanaryController:
+    """Scales a canary/stable pair and waits for both from one Deployment watch"""
+    
+    def __init__(self, client, namespace, canary, stable, max_surge=1, timeout=300):
+        self.client = client
+        self.namespace = namespace
+        self.canary = canary
+        self.stable = stable
+        self.max_surge = max_surge
+        self.timeout = timeout
+        self.watcher = ObjectWatcher(client, "deployments", namespace)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+    
+    def start(self):
+        self.watcher.start()
+        for name in (self.canary, self.stable):
+            if self.watcher.get(name) is None:
+                raise ApiError(404, "NotFound", f'deployment "{name}" not found in namespace {self.namespace}')
+        return self
+    
+    def stop(self):
+        self.watcher.stop()
+        self.executor.shutdown()
+    
+    def current(self):
+        """Current (canary, stable) replicas"""
+        return tuple(self.watcher.get(name)["spec"].get("replicas", 0) for name in (self.canary, self.stable))
+    
+    def scale(self, target):
+        """Move to a (canary, stable) split, scaling both deployments concurrently in max_surge steps"""
+        for split in transition(self.current(), target, self.max_surge):
+            with span("scale", canary=split[0], stable=split[1]):
+                futures = [self.executor.submit(scale_deployment, self.client, self.namespace, name, replicas)
+                           for name, replicas in zip((self.canary, self.stable), split)]
+                for future in futures:
+                    future.result()
+            with span("canary readiness"):
+                ready = self.watcher.wait_for(lambda deployments: all(
+                    name in deployments and deployments[name]["spec"].get("replicas") == replicas
+                    and deployment_ready(deployments[name])
+                    for name, replicas in zip((self.canary, self.stable), split)), self.timeout)
+            if not ready:
+                raise TimeoutError(f"{self.canary}/{self.stable} did not reach {split[0]}/{split[1]} ready "
+                                   f"replicas within {self.timeout}s")
+
+def analyze_step(analysis, metrics_url, duration, interval, thresholds):
+    """Scrape the metrics for one step; returns (passed, reason) and fails fast on a bad canary"""
+    with span("analysis"):
+        analysis.observe(scrape(metrics_url), baseline=True)
+        analysis.reset()
+        deadline = time.monotonic() + duration
+        while True:
+            time.sleep(max(0.0, min(interval, deadline - time.monotonic())))
+            analysis.observe(scrape(metrics_url))
+            final = time.monotonic() >= deadline
+            verdict, reason = evaluate(analysis, final=final, **thresholds)
+            if verdict == "fail":
+                return False, reason
+            if final:
+                if verdict == "wait":
+                    return False, f"not enough traffic to decide ({reason})"
+                return True, reason
+
+def roll_back(controller, total, start):
+    """Move all replicas back to stable"""
+    print_color(YELLOW, ">> Rolling back: all traffic to stable...")
+    controller.scale(replica_split(total, 0))
+    print_color(RED, f"Canary rolled back after {time.monotonic() - start:.1f}s.")
+
+def run_schedule(controller, total, steps, analysis, metrics_url, duration, interval, thresholds):
+    """
+    Walk the step schedule; rolls the canary back on the first failed
+    analysis, and on an error (a scale that times out, unreadable metrics)
+    before re-raising it.
+    """
+    start = time.monotonic()
+    for weight in steps:
+        split = replica_split(total, weight)
+        print_color(BLUE, f"--- Step {weight:g}%: {split[0]} canary / {split[1]} stable replica(s) ---")
+        try:
+            controller.scale(split)
+            if weight >= 100:
+                break
+            print_color(YELLOW, f">> Analyzing canary metrics for {duration:g}s...")
+            passed, reason = analyze_step(analysis, metrics_url, duration, interval, thresholds)
+        except (ApiError, OSError, MetricsError) as e:
+            print_color(RED, f"❌ Canary step {weight:g}% failed: {e}")
+            try:
+                roll_back(controller, total, start)
+            except (ApiError, OSError) as rollback_error:
+                print_color(RED, f"Rollback failed too: {rollback_error}")
+            raise
+        if not passed:
+            print_color(RED, f"❌ Canary failed at {weight:g}%: {reason}")
+            roll_back(controller, total, start)
+            return False
+        print_color(GREEN, f"✅ Step {weight:g}% passed: {reason}")
+    print_color(GREEN, f"✅ Canary deployment is now receiving 100% of traffic. Migration complete in "
+                       f"{time.monotonic() - start:.1f}s!")
+    return True
+
+def main(argv=None):
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Progressively promote a canary deployment')
+    parser.add_argument('weight', nargs='?', type=float, help='Only set this canary weight in percent, without analysis')
+    parser.add_argument('--namespace', default='canary', help='Namespace of the deployments')
+    parser.add_argument('--canary', default='nginx-canary', help='Canary deployment')
+    parser.add_argument('--stable', default='nginx-stable', help='Stable deployment')
+    parser.add_argument('--total-replicas', type=int, help='Replicas shared by canary and stable (default: their current sum)')
+    parser.add_argument('--max-surge', type=int, help='Replicas moved between deployments at a time (default: 25%% of the total)')
+    parser.add_argument('--steps', default='10,25,50,100', help='Canary weights in percent (default: 10,25,50,100)')
+    parser.add_argument('--metrics-url', default='http://127.0.0.1:9090/metrics', help='Prometheus text endpoint with the request metrics')
+    parser.add_argument('--step-duration', type=float, default=60, help='Seconds of metrics analyzed per step')
+    parser.add_argument('--scrape-interval', type=float, default=5, help='Seconds between scrapes')
+    parser.add_argument('--min-requests', type=int, default=100, help='Canary requests needed per step to decide')
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help='Highest canary error rate (0.01 = 1%%)')
+    parser.add_argument('--max-error-rate-increase', type=float, default=0.005, help='Highest canary error rate above stable')
+    parser.add_argument('--max-latency-ms', type=float, help='Highest canary p99 latency in milliseconds')
+    parser.add_argument('--max-latency-ratio', type=float, default=1.5, help='Highest canary/stable p99 latency ratio')
+    parser.add_argument('--requests-metric', default='http_requests_total', help='Request counter with code and deployment labels')
+    parser.add_argument('--latency-metric', default='http_request_duration_seconds', help='Latency histogram with a deployment label')
+    parser.add_argument('--variant-label', default='deployment', help='Label holding the deployment name')
+    parser.add_argument('--timeout', type=int, default=300, help='Seconds to wait for the deployments at each step')
+    
+    args = parser.parse_args(argv)
+    if args.max_surge is not None and args.max_surge < 1:
+        parser.error("--max-surge must be at least 1")
+    if args.total_replicas is not None and args.total_replicas < 1:
+        parser.error("--total-replicas must be at least 1")
+    try:
+        steps = [args.weight] if args.weight is not None else parse_waves(args.steps)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    try:
+        client = get_client()
+    except KubeConfigError as e:
+        print_color(RED, f"Cannot connect to Kubernetes: {e}")
+        return 1
+    
+    print_color(BLUE, f"===== Promoting Canary Deployment {args.canary} in {args.namespace} =====")
+    controller = None
+    try:
+        # The current replicas come from the controller's watch, not from separate reads
+        controller = CanaryController(client, args.namespace, args.canary, args.stable, timeout=args.timeout).start()
+        total = args.total_replicas if args.total_replicas is not None else sum(controller.current())
+        if total < 1:
+            print_color(RED, f"Error: {args.canary} and {args.stable} are both scaled to zero; "
+                             f"pass --total-replicas to set the replicas to split.")
+            return 1
+        controller.max_surge = args.max_surge if args.max_surge is not None else max(1, -(-total // 4))
+    
+        # Single weight, like canary-promote.sh
+        if args.weight is not None:
+            split = replica_split(total, args.weight)
+            print_color(YELLOW, f">> Setting canary replicas to {split[0]} and stable replicas to {split[1]}...")
+            controller.scale(split)
+            print_color(GREEN, f"✅ Canary deployment is now receiving approximately "
+                               f"{split[0] * 100 // sum(split)}% of traffic.")
+            return 0
+    
+        analysis = CanaryAnalysis(args.canary, args.stable, args.requests_metric, args.latency_metric,
+                                  args.variant_label)
+        thresholds = {
+            "min_requests": args.min_requests,
+            "max_error_rate": args.max_error_rate,
+            "max_error_rate_increase": args.max_error_rate_increase,
+            "max_latency": args.max_latency_ms / 1000.0 if args.max_latency_ms else None,
+            "max_latency_ratio": args.max_latency_ratio,
+        }
+        promoted = run_schedule(controller, total, steps, analysis, args.metrics_url, args.step_duration,
+                                args.scrape_interval, thresholds)
+    except (ApiError, OSError, MetricsError) as e:
+        print_color(RED, f"Canary promotion failed: {e}")
+        return 1
+    finally:
+        if controller:
+            controller.stop()
+    
+    return 0 if promoted else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Canary Metric Analysis
+
+Reads request, error and latency samples from a Prometheus text endpoint
+(the exposition format served on /metrics) and compares a canary
+deployment to its stable counterpart. Counters are cumulative, so every
+scrape is turned into per-series deltas. Latencies come from histogram
+buckets and are fed into a streaming quantile sketch (QuantileSketch,
+DDSketch-style logarithmic bins with bounded relative error), so the
+memory used by an analysis does not grow with traffic or step length.
+
+The expected metrics are a request counter with a status code label and a
+latency histogram, both labelled with the deployment that served the
+request, e.g.:
+
+  http_requests_total{deployment="nginx-canary",code="200"} 1027
+  http_request_duration_seconds_bucket{deployment="nginx-canary",le="0.05"} 980
+"""
+
+import math
+import re
+import urllib.request
+
+# One sample line: name, optional {labels}, value and optional timestamp
+SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)(?:\s+\S+)?$')
+LABEL_RE = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*"((?:[^"\\]|\\.)*)"\s*,?')
+
+# One-sided z-score above which a higher canary error rate is not put down to chance (p < 0.01)
+SIGNIFICANT_Z = 2.33
+
+
+class MetricsError(Exception):
+    """Raised when the metrics endpoint cannot be read or parsed"""
+
+
+def _unescape(value):
+    return value.replace('\\"', '"').replace("\\n", "\n").replace("\\\\", "\\")
+
+
+def parse_prometheus_text(lines):
+    """Yield (name, labels, value) for every sample in Prometheus text lines"""
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        match = SAMPLE_RE.match(line)
+        if not match:
+            raise MetricsError(f"invalid sample line: {line}")
+        name, label_text, value = match.groups()
+        labels = {}
+        if label_text:
+            position = 0
+            while position < len(label_text):
+                label = LABEL_RE.match(label_text, position)
+                if not label:
+                    raise MetricsError(f"invalid labels in: {line}")
+                labels[label.group(1)] = _unescape(label.group(2))
+                position = label.end()
+        try:
+            yield name, labels, float(value)
+        except ValueError:
+            raise MetricsError(f"invalid sample value in: {line}") from None
+
+
+def scrape(url, timeout=10):
+    """Fetch a metrics endpoint and yield its samples without holding the whole body"""
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            lines = (raw.decode("utf-8") for raw in response)
+            yield from parse_prometheus_text(lines)
+    except OSError as e:
+        raise MetricsError(f"cannot scrape {url}: {e}") from None
+
+
+class QuantileSketch:
+    """
+    Streaming quantile sketch with relative accuracy (DDSketch-style).
+
+    Positive values fall into logarithmic bins whose width keeps every
+    quantile estimate within relative_accuracy of a true sample value.
+    When more than max_bins are in use the lowest bins are merged, which
+    only affects the lowest quantiles, so memory stays constant.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048, min_value=1e-9):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.min_value = min_value
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def add(self, value, count=1):
+        """Add value count times"""
+        if count <= 0:
+            return
+        self.count += count
+        self.total += value * count
+        self.max = value if self.max is None else max(self.max, value)
+        if value <= self.min_value:
+            self.zero_count += count
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self):
+        """Merge the lowest bins into one to get back under max_bins"""
+        ordered = sorted(self.bins)
+        excess = len(ordered) - self.max_bins + 1
+        merged = sum(self.bins.pop(index) for index in ordered[:excess])
+        target = ordered[excess]
+        self.bins[target] += merged
+
+    def merge(self, other):
+        """Add every sample of another sketch with the same accuracy"""
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        while len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def quantile(self, q):
+        """Estimated q-quantile (0 <= q <= 1), or None when the sketch is empty"""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                # The bin midpoint (in relative terms) is within the accuracy of every value in it
+                return min(2 * self.gamma ** index / (self.gamma + 1), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class VariantStats:
+    """Requests, errors and a latency sketch of one deployment over an analysis window"""
+
+    def __init__(self, relative_accuracy=0.01):
+        self.requests = 0.0
+        self.errors = 0.0
+        self.latency = QuantileSketch(relative_accuracy)
+
+    @property
+    def error_rate(self):
+        return self.errors / self.requests if self.requests else 0.0
+
+
+class CanaryAnalysis:
+    """
+    Turns successive scrapes into per-window canary and stable statistics.
+
+    Only the last cumulative value of every series is kept between scrapes;
+    a value lower than the previous one is treated as a counter reset.
+    """
+
+    def __init__(self, canary, stable, requests_metric="http_requests_total",
+                 latency_metric="http_request_duration_seconds", variant_label="deployment",
+                 code_label="code", error_codes=r"5..", relative_accuracy=0.01):
+        self.variants = {canary: "canary", stable: "stable"}
+        self.requests_metric = requests_metric
+        self.bucket_metric = latency_metric + "_bucket"
+        self.variant_label = variant_label
+        self.code_label = code_label
+        self.error_codes = re.compile(error_codes)
+        self.relative_accuracy = relative_accuracy
+        self._last = {}
+        self.canary = self.stable = None
+        self.reset()
+
+    def reset(self):
+        """Start a new analysis window (previous counter values are kept for the deltas)"""
+        self.canary = VariantStats(self.relative_accuracy)
+        self.stable = VariantStats(self.relative_accuracy)
+
+    def _delta(self, key, value):
+        previous = self._last.get(key)
+        self._last[key] = value
+        if previous is None:
+            return None
+        return value - previous if value >= previous else value
+
+    def observe(self, samples, baseline=False):
+        """
+        Account one scrape. With baseline=True the counters are only
+        recorded, e.g. for the first scrape after traffic shifted.
+        """
+        buckets = {}
+        for name, labels, value in samples:
+            role = self.variants.get(labels.get(self.variant_label))
+            if role is None or name not in (self.requests_metric, self.bucket_metric):
+                continue
+            key = (name, tuple(sorted(labels.items())))
+            delta = self._delta(key, value)
+            if delta is None or baseline:
+                continue
+            stats = self.canary if role == "canary" else self.stable
+            if name == self.requests_metric:
+                stats.requests += delta
+                if self.error_codes.fullmatch(labels.get(self.code_label, "")):
+                    stats.errors += delta
+            else:
+                series = tuple(sorted((k, v) for k, v in labels.items() if k != "le"))
+                bound = float(labels.get("le", "inf"))
+                buckets.setdefault((role, series), []).append((bound, delta))
+        for (role, _), cumulative in buckets.items():
+            sketch = (self.canary if role == "canary" else self.stable).latency
+            lower, below = 0.0, 0.0
+            for bound, count in sorted(cumulative):
+                in_bucket = count - below
+                if in_bucket > 0:
+                    # Values of the open +Inf bucket are counted at the last finite bound
+                    value = lower if math.isinf(bound) else (lower + bound) / 2
+                    sketch.add(value, in_bucket)
+                if not math.isinf(bound):
+                    lower = bound
+                below = max(below, count)
+
+
+def error_rate_z_score(canary, stable):
+    """Two-proportion z-score of the canary error rate over the stable one"""
+    pooled = (canary.errors + stable.errors) / (canary.requests + stable.requests)
+    deviation = math.sqrt(pooled * (1 - pooled) * (1 / canary.requests + 1 / stable.requests))
+    if deviation == 0:
+        return math.inf if canary.error_rate > stable.error_rate else 0.0
+    return (canary.error_rate - stable.error_rate) / deviation
+
+
+def exceeds_rate(stats, limit):
+    """One-sample z-score of an error rate over a fixed limit"""
+    if limit <= 0 or limit >= 1:
+        return math.inf if stats.error_rate > limit else 0.0
+    return (stats.error_rate - limit) / math.sqrt(limit * (1 - limit) / stats.requests)
+
+
+def evaluate(analysis, min_requests=100, max_error_rate=0.01, max_error_rate_increase=0.005, max_latency=None,
+             max_latency_ratio=1.5, quantile=0.99, final=True):
+    """
+    Judge the current analysis window.
+
+    Returns (verdict, reason) where verdict is "pass", "fail" or "wait"
+    (not enough canary requests to decide yet). With final=False, the
+    window is still open and only a statistically significant error-rate
+    breach fails, so a single early error does not abort the canary. The
+    closing evaluation (final=True) also applies the plain error-rate and
+    latency limits. A canary error rate above stable's always has to be
+    significant.
+    """
+    canary, stable = analysis.canary, analysis.stable
+    if canary.requests < min_requests:
+        return "wait", f"{canary.requests:.0f}/{min_requests} canary requests"
+    if canary.error_rate > max_error_rate and (final or exceeds_rate(canary, max_error_rate) > SIGNIFICANT_Z):
+        return "fail", f"canary error rate {canary.error_rate:.2%} above {max_error_rate:.2%}"
+    if (stable.requests >= min_requests and canary.error_rate > stable.error_rate + max_error_rate_increase
+            and error_rate_z_score(canary, stable) > SIGNIFICANT_Z):
+        return "fail", (f"canary error rate {canary.error_rate:.2%} exceeds stable "
+                        f"{stable.error_rate:.2%} by more than {max_error_rate_increase:.2%}")
+    canary_latency = canary.latency.quantile(quantile)
+    label = f"p{quantile * 100:g}"
+    latency = f", {label} {canary_latency * 1000:.1f}ms" if canary_latency is not None else ""
+    if not final:
+        return "wait", f"{canary.requests:.0f} canary requests, {canary.error_rate:.2%} errors{latency}"
+    stable_latency = stable.latency.quantile(quantile) if stable.requests >= min_requests else None
+    if canary_latency is not None and max_latency is not None and canary_latency > max_latency:
+        return "fail", f"canary {label} {canary_latency * 1000:.1f}ms above {max_latency * 1000:.1f}ms"
+    if canary_latency is not None and stable_latency and canary_latency > stable_latency * max_latency_ratio:
+        return "fail", (f"canary {label} {canary_latency * 1000:.1f}ms is more than {max_latency_ratio:g}x "
+                        f"stable {stable_latency * 1000:.1f}ms")
+    return "pass", f"{canary.requests:.0f} canary requests, {canary.error_rate:.2%} errors{latency}"
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Change Detection
+
+Maps the files changed in the working tree, or in a commit range, to the
+ArgoCD Applications they affect, so a pipeline only refreshes, waits for
+and verifies those. A changed file affects:
+
+- environments/<env>/helm-values/<app>-values.yaml: the Application <app>-<env>
+- environments/<env>/<app>-app.yaml: the Application <app>-<env>
+- base/<app>-app.yaml: the Application <app>-<env> of every environment
+- the Applications whose spec.source.path contains it, or whose Helm
+  valueFiles name it (e.g. manifests/** deployed as a directory source)
+- any other file under environments/<env>/: every Application of <env>
+
+The GitOps tree may live below the repository root (gitops-solution/ in
+the scripts' working directory), so the patterns are matched against the
+end of each path.
+"""
+
+import os
+import re
+import subprocess
+
+import tracing
+
+VALUES_FILE_RE = re.compile(r"(?:^|/)environments/([^/]+)/helm-values/([^/]+)-values\.ya?ml$")
+ENVIRONMENT_APP_RE = re.compile(r"(?:^|/)environments/([^/]+)/([^/]+)-app\.ya?ml$")
+BASE_APP_RE = re.compile(r"(?:^|/)base/([^/]+)-app\.ya?ml$")
+ENVIRONMENT_FILE_RE = re.compile(r"(?:^|/)environments/([^/]+)/")
+
+
+class ChangeDetectionError(Exception):
+    """Raised when the changed files cannot be read from git"""
+
+
+def _git(args, cwd=None):
+    with tracing.span(f"git {args[0]}", "exec") as span:
+        try:
+            result = subprocess.run(["git"] + args, cwd=cwd, check=True, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise ChangeDetectionError("git is not installed") from None
+        except subprocess.CalledProcessError as e:
+            raise ChangeDetectionError(e.stderr.decode("utf-8", "replace").strip()
+                                       or f"git {args[0]} exited with {e.returncode}") from None
+        span.set(exit_code=result.returncode, response_bytes=len(result.stdout))
+    return result.stdout.decode("utf-8", "surrogateescape")
+
+
+def changed_files(revision_range=None, cwd=None):
+    """
+    Paths, relative to the repository root, changed in revision_range (any
+    git diff argument, e.g. origin/main...HEAD) or, without one, in the
+    working tree: staged, unstaged and untracked files. Renames count as a
+    deletion plus an addition, so both paths are reported.
+    """
+    if revision_range:
+        output = _git(["diff", "--name-only", "-z", "--no-renames", revision_range, "--"], cwd)
+        return sorted(path for path in output.split("\0") if path)
+    # Porcelain paths are relative to the repository root, whatever the working directory
+    output = _git(["status", "--porcelain", "-z", "--no-renames", "--untracked-files=all"], cwd)
+    return sorted(entry[3:] for entry in output.split("\0") if len(entry) > 3)
+
+
+def _source_paths(app):
+    """(directory paths, values file paths) an Application reads from its Git sources"""
+    spec = app.get("spec") or {}
+    sources = ([spec["source"]] if spec.get("source") else []) + list(spec.get("sources") or [])
+    directories = set()
+    files = set()
+    for source in sources:
+        path = (source.get("path") or "").strip("/")
+        if path and path != ".":
+            directories.add(path)
+        for value_file in (source.get("helm") or {}).get("valueFiles") or []:
+            if value_file.startswith("$"):
+                # $ref/path/in/other/source.yaml
+                value_file = value_file.partition("/")[2]
+            else:
+                value_file = os.path.join(path, value_file)
+            value_file = os.path.normpath(value_file).strip("/")
+            if value_file and value_file != ".":
+                files.add(value_file)
+    return directories, files
+
+
+def affected_applications(paths, apps):
+    """
+    Map changed paths to the names of the Applications (from apps, the
+    discovered objects) they affect. Returns {path: sorted names}; a path
+    that affects none of them maps to [].
+    """
+    names = [app["metadata"]["name"] for app in apps]
+    known = set(names)
+    sources = {app["metadata"]["name"]: _source_paths(app) for app in apps}
+    affected = {}
+    for path in paths:
+        matches = set()
+        app_file = VALUES_FILE_RE.search(path) or ENVIRONMENT_APP_RE.search(path)
+        base_file = BASE_APP_RE.search(path)
+        environment_file = ENVIRONMENT_FILE_RE.search(path)
+        if app_file:
+            matches.add(f"{app_file.group(2)}-{app_file.group(1)}")
+        elif base_file:
+            matches.update(name for name in names if name.rpartition("-")[0] == base_file.group(1))
+        elif environment_file:
+            matches.update(name for name in names if name.rpartition("-")[2] == environment_file.group(1))
+        padded = f"/{path}"
+        for name, (directories, files) in sources.items():
+            if any(f"/{directory}/" in padded for directory in directories) or any(
+                    padded.endswith(f"/{value_file}") for value_file in files):
+                matches.add(name)
+        affected[path] = sorted(matches & known)
+    return affected
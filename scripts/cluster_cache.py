@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Cluster Cache
+
+An informer-style, in-memory cache of Kubernetes objects. Each kind is
+listed once (in pages) and then kept current by one watch stream resumed
+from the list's resourceVersion; an expired resourceVersion (410) triggers
+a relist. Objects are indexed by namespace and by the
+app.kubernetes.io/instance label, so lookups such as "the Deployments of
+app1-dev" are answered from memory instead of with one API call per
+application and kind.
+
+One-shot scripts can build the cache with watch=False, which takes a
+single list per kind and no watch.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from k8s_client import INSTANCE_LABEL, ApiError, resource_path
+
+
+def namespace_index(obj):
+    return [obj["metadata"].get("namespace") or ""]
+
+
+def instance_index(obj):
+    """(namespace, instance) for objects carrying the app.kubernetes.io/instance label"""
+    metadata = obj["metadata"]
+    instance = (metadata.get("labels") or {}).get(INSTANCE_LABEL)
+    return [(metadata.get("namespace") or "", instance)] if instance else []
+
+
+DEFAULT_INDEXERS = {"namespace": namespace_index, "instance": instance_index}
+
+
+def object_key(obj):
+    """Default cache key: (namespace, name)"""
+    return (obj["metadata"].get("namespace") or "", obj["metadata"]["name"])
+
+
+class Informer:
+    """
+    Keeps the objects of one kind current from a single list + watch.
+
+    namespace limits the informer to one namespace (None watches all of
+    them). transform(obj) is applied before an object is stored, key(obj)
+    names it in objects, and indexers map an index name to a function
+    returning the index values of an object; indexes are computed from the
+    untransformed object.
+    """
+
+    def __init__(self, client, kind, namespace=None, transform=None, key=object_key, indexers=None,
+                 label_selector=None):
+        self.client = client
+        self.kind = kind
+        self.namespace = namespace
+        self.transform = transform or (lambda obj: obj)
+        self.key = key
+        self.indexers = DEFAULT_INDEXERS if indexers is None else indexers
+        self.label_selector = label_selector
+        self.objects = {}
+        self.indexes = {name: {} for name in self.indexers}
+        self._index_values = {}
+        self.resource_version = None
+        self.condition = threading.Condition()
+        self.error = None
+        self._stopped = False
+        self._thread = None
+        self._synced = threading.Event()
+        # Ends the open watch stream early; set while a watch is open
+        self._cancel = None
+
+    # -- lifecycle -------------------------------------------------------------
+
+    def start(self, timeout=30, watch=True):
+        """
+        List the kind, then (with watch) keep following it on a background
+        thread. Raises TimeoutError when the first list takes longer than
+        timeout seconds, rather than returning an empty cache.
+        """
+        if not watch:
+            self._relist()
+            return self
+        self._thread = threading.Thread(target=self._run, name=f"informer-{self.kind}-{self.namespace or 'all'}",
+                                        daemon=True)
+        self._thread.start()
+        if not self._synced.wait(timeout):
+            self.stop()
+            raise TimeoutError(f"listing {self.kind} in {self.namespace or 'all namespaces'} took more than {timeout}s")
+        if self.error:
+            raise self.error
+        return self
+
+    def stop(self):
+        """Stop following the kind; an open watch stream is closed right away"""
+        with self.condition:
+            self._stopped = True
+            cancel = self._cancel
+            self.condition.notify_all()
+        if cancel is not None:
+            cancel()
+
+    def _watching(self, cancel):
+        with self.condition:
+            self._cancel = cancel
+            stopped = self._stopped
+        if stopped:
+            cancel()
+
+    @property
+    def synced(self):
+        return self._synced.is_set()
+
+    # -- store -----------------------------------------------------------------
+
+    def _add_to_indexes(self, key, obj):
+        values = {name: indexer(obj) for name, indexer in self.indexers.items()}
+        self._index_values[key] = values
+        for name, index_values in values.items():
+            for value in index_values:
+                self.indexes[name].setdefault(value, set()).add(key)
+
+    def _remove_from_indexes(self, key):
+        for name, index_values in self._index_values.pop(key, {}).items():
+            for value in index_values:
+                keys = self.indexes[name].get(value)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.indexes[name][value]
+
+    def _update(self, obj, deleted=False):
+        key = self.key(obj)
+        with self.condition:
+            self._remove_from_indexes(key)
+            if deleted:
+                self.objects.pop(key, None)
+            else:
+                self.objects[key] = self.transform(obj)
+                self._add_to_indexes(key, obj)
+            self.condition.notify_all()
+
+    def _relist(self):
+        collection = resource_path(self.kind, self.namespace)
+        metadata = {}
+        objects = {}
+        index_values = {}
+        indexes = {name: {} for name in self.indexers}
+        for obj in self.client.iter_list(collection, label_selector=self.label_selector, list_metadata=metadata):
+            key = self.key(obj)
+            objects[key] = self.transform(obj)
+            values = index_values[key] = {name: indexer(obj) for name, indexer in self.indexers.items()}
+            for name, entries in values.items():
+                for value in entries:
+                    indexes[name].setdefault(value, set()).add(key)
+        with self.condition:
+            self.objects, self.indexes, self._index_values = objects, indexes, index_values
+            self.resource_version = metadata.get("resourceVersion")
+            self.condition.notify_all()
+        self._synced.set()
+
+    def _run(self):
+        collection = resource_path(self.kind, self.namespace)
+        try:
+            self._relist()
+            while not self._stopped:
+                try:
+                    for event in self.client.watch(collection, resource_version=self.resource_version,
+                                                   timeout_seconds=60, label_selector=self.label_selector,
+                                                   on_open=self._watching):
+                        obj = event.get("object") or {}
+                        if event.get("type") == "ERROR":
+                            if obj.get("code") == 410:
+                                self._relist()
+                                break
+                            raise ApiError(obj.get("code", 500), obj.get("reason", "Error"), obj.get("message", ""))
+                        self.resource_version = obj.get("metadata", {}).get("resourceVersion", self.resource_version)
+                        if event.get("type") in ("ADDED", "MODIFIED"):
+                            self._update(obj)
+                        elif event.get("type") == "DELETED":
+                            self._update(obj, deleted=True)
+                        if self._stopped:
+                            break
+                except ApiError as e:
+                    if e.status != 410:
+                        raise
+                    self._relist()
+                finally:
+                    with self.condition:
+                        self._cancel = None
+        except Exception as e:  # surfaced to waiters
+            if self._stopped:
+                return
+            with self.condition:
+                self.error = e
+                self.condition.notify_all()
+            self._synced.set()
+
+    # -- lookups ---------------------------------------------------------------
+
+    def get(self, key, default=None):
+        """Current (transformed) object by key"""
+        with self.condition:
+            return self.objects.get(key, default)
+
+    def by_index(self, name, value):
+        """Objects whose index values include value, sorted by key"""
+        with self.condition:
+            return [self.objects[key] for key in sorted(self.indexes[name].get(value, ()))]
+
+    def wait_for(self, predicate, timeout):
+        """Wait until predicate(objects by key) is true; returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                if self.error:
+                    raise self.error
+                if predicate(self.objects):
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopped:
+                    return False
+                self.condition.wait(remaining)
+
+
+class ClusterCache:
+    """
+    Informers for several kinds, started together and queried by namespace
+    and instance. transforms maps a kind to the function that reduces its
+    objects before they are stored (e.g. a Deployment to its readiness).
+    """
+
+    def __init__(self, client, kinds, namespace=None, watch=True, transforms=None):
+        self.watch = watch
+        transforms = transforms or {}
+        self.informers = {kind: Informer(client, kind, namespace, transforms.get(kind))
+                          for kind in dict.fromkeys(kinds)}
+
+    def start(self, timeout=30):
+        """List every kind concurrently (and start the watches); returns self"""
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.informers)) as executor:
+                for future in [executor.submit(informer.start, timeout, self.watch)
+                               for informer in self.informers.values()]:
+                    future.result()
+        except BaseException:
+            self.stop()
+            raise
+        return self
+
+    def stop(self):
+        for informer in self.informers.values():
+            informer.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def informer(self, kind):
+        try:
+            return self.informers[kind]
+        except KeyError:
+            raise ValueError(f"{kind} is not cached") from None
+
+    def get(self, kind, namespace, name):
+        """One object, or None"""
+        return self.informer(kind).get((namespace or "", name))
+
+    def by_namespace(self, kind, namespace):
+        """Every cached object of a kind in a namespace"""
+        return self.informer(kind).by_index("namespace", namespace)
+
+    def by_instance(self, kind, namespace, instance):
+        """Objects of a kind in a namespace labelled app.kubernetes.io/instance=instance"""
+        return self.informer(kind).by_index("instance", (namespace or "", instance))
+
+    def wait_for(self, kind, predicate, timeout):
+        """Wait until predicate(objects by (namespace, name)) is true for one kind"""
+        return self.informer(kind).wait_for(predicate, timeout)
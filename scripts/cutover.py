@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Blue-Green Cutover Engine
+
+Moves traffic from an application's blue Deployment to its green one by
+watching the Endpoints of the `<app>-bg-preview` and `<app>-bg-active`
+Services instead of sleeping:
+
+1. green is scaled up and the preview Service is pointed at it
+2. as soon as the preview Endpoints hold enough ready green addresses, the
+   active Service is switched to green
+3. the cutover completes when the active Endpoints serve enough green
+   addresses; its latency is recorded
+4. blue is drained progressively: every time a blue address is observed
+   leaving the Endpoints, blue is scaled down to the number still in use
+
+Endpoints of a namespace are followed with one list + watch stream
+(EndpointsWatcher, a cluster_cache.Informer over Endpoints), so several
+cutovers in the same namespace share it.
+plan_waves() splits a fleet into cumulative percentage waves for
+promoting many applications at once.
+"""
+
+import math
+import time
+
+import latency_history
+from cluster_cache import Informer
+from k8s_client import ApiError, resource_path
+from tracing import span, traced
+
+
+class CutoverError(Exception):
+    """Raised when a cutover gate is not met in time"""
+
+
+def ready_addresses(endpoints):
+    """Set of ready IPs in an Endpoints object (notReadyAddresses are ignored)"""
+    addresses = set()
+    for subset in (endpoints or {}).get("subsets") or []:
+        for address in subset.get("addresses") or []:
+            addresses.add(address.get("ip"))
+    return addresses
+
+
+class ObjectWatcher(Informer):
+    """Keeps a namespace's objects of one kind current from a single list + watch, keyed by name"""
+
+    def __init__(self, client, kind, namespace, transform=None):
+        super().__init__(client, kind, namespace, transform, key=lambda obj: obj["metadata"]["name"], indexers={})
+
+
+class EndpointsWatcher(ObjectWatcher):
+    """Keeps the ready addresses of a namespace's Endpoints current from a single watch"""
+
+    def __init__(self, client, namespace):
+        super().__init__(client, "endpoints", namespace, ready_addresses)
+
+    def get(self, name, default=None):
+        """Current ready addresses of an Endpoints object"""
+        with self.condition:
+            return set(self.objects.get(name, ()))
+
+
+@traced("scale deployment")
+def scale_deployment(client, namespace, name, replicas):
+    """Scale a deployment through its scale subresource"""
+    client.patch(resource_path("deployments", namespace, name, "scale"), {"spec": {"replicas": replicas}})
+
+
+@traced("service switch")
+def set_service_version(client, namespace, name, version):
+    """Point a service selector at the given deployment version"""
+    client.patch(resource_path("services", namespace, name), {"spec": {"selector": {"version": version}}})
+
+
+def _current(client, cache, kind, namespace, name):
+    """An object from the cache when one is given, else from the API server"""
+    if cache is None:
+        return client.get(resource_path(kind, namespace, name))
+    obj = cache.get(kind, namespace, name)
+    if obj is None:
+        raise ApiError(404, "NotFound", f'{kind} "{name}" not found in namespace {namespace}')
+    return obj
+
+
+def cutover(client, watcher, app_name, namespace, replicas=3, ready_threshold=None, ready_timeout=600,
+            cutover_timeout=120, confirm=None, log=None, cache=None):
+    """
+    Promote green to active for one application.
+
+    watcher is a started EndpointsWatcher for namespace. ready_threshold is
+    the number of ready green addresses required before traffic is switched
+    (defaults to replicas). confirm, if given, is called after green is
+    ready and before the switch; returning False aborts. log(message) reports
+    progress. cache, a started ClusterCache of services and deployments,
+    replaces the initial reads of the active Service and blue Deployment.
+    Returns a dict of timings in seconds (green_ready, cutover,
+    drain, total), with skipped set when the active Service already selects
+    green; raises CutoverError when a gate times out. Each phase is also
+    recorded in the latency history, with the namespace as environment.
+    """
+    log = log or (lambda message: None)
+    threshold = min(ready_threshold or replicas, replicas)
+    active, preview = f"{app_name}-bg-active", f"{app_name}-bg-preview"
+    blue, green = f"{app_name}-blue", f"{app_name}-green"
+    start = time.monotonic()
+
+    selector = _current(client, cache, "services", namespace, active)["spec"].get("selector") or {}
+    if selector.get("version") == "green":
+        log(f"{active} already serves green, nothing to promote")
+        return {"green_ready": 0.0, "cutover": 0.0, "drain": 0.0, "total": time.monotonic() - start,
+                "skipped": True}
+    blue_replicas = _current(client, cache, "deployments", namespace, blue)["spec"].get("replicas", 0)
+    blue_addresses = watcher.get(active)
+
+    def failed(phase, phase_start, message, outcome="timeout"):
+        latency_history.record(app_name, namespace, phase, time.monotonic() - phase_start, outcome)
+        latency_history.record(app_name, namespace, "promotion", time.monotonic() - start, "failed")
+        return CutoverError(message)
+
+    # Bring green up behind the preview service
+    log(f"Scaling {green} to {replicas} replicas and pointing {preview} at it...")
+    scale_deployment(client, namespace, green, replicas)
+    set_service_version(client, namespace, preview, "green")
+
+    log(f"Waiting for {threshold} ready green endpoint(s) on {preview}...")
+    with span("green readiness", app=app_name):
+        ready = watcher.wait_for(lambda eps: len(eps.get(preview, set()) - blue_addresses) >= threshold,
+                                 ready_timeout)
+    if not ready:
+        raise failed("green readiness", start,
+                     f"{green} did not reach {threshold} ready endpoint(s) within {ready_timeout}s")
+    green_ready = time.monotonic() - start
+    latency_history.record(app_name, namespace, "green readiness", green_ready)
+
+    if confirm is not None and not confirm():
+        latency_history.record(app_name, namespace, "promotion", time.monotonic() - start, "aborted")
+        raise CutoverError("Promotion aborted before switching traffic")
+
+    # Switch traffic and measure until the active endpoints serve green
+    log(f"Switching {active} to green...")
+    switched = time.monotonic()
+    with span("cutover", app=app_name):
+        set_service_version(client, namespace, active, "green")
+        green_addresses = lambda eps: eps.get(preview, set()) - blue_addresses  # noqa: E731
+        served = watcher.wait_for(lambda eps: len(eps.get(active, set()) & green_addresses(eps)) >= threshold,
+                                  cutover_timeout)
+    if not served:
+        raise failed("cutover", switched,
+                     f"{active} did not serve {threshold} green endpoint(s) within {cutover_timeout}s")
+    cutover_latency = time.monotonic() - switched
+    latency_history.record(app_name, namespace, "cutover", cutover_latency)
+    log(f"Traffic on {active} moved to green in {cutover_latency:.2f}s")
+
+    # Drain blue as its addresses are observed leaving the service endpoints
+    drained = time.monotonic()
+    with span("drain", app=app_name):
+        deadline = drained + cutover_timeout
+        while blue_replicas > 0:
+            still_served = len(blue_addresses & (watcher.get(active) | watcher.get(preview)))
+            if still_served < blue_replicas:
+                log(f"{blue_replicas - still_served} blue endpoint(s) drained, scaling {blue} to {still_served}")
+                blue_replicas = still_served
+                scale_deployment(client, namespace, blue, blue_replicas)
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not watcher.wait_for(
+                    lambda eps: len(blue_addresses & (eps.get(active, set()) | eps.get(preview, set())))
+                    < still_served, remaining):
+                raise failed("drain", drained,
+                             f"{still_served} blue endpoint(s) still receive traffic after {cutover_timeout}s; "
+                             f"{blue} left at {blue_replicas} replicas")
+    timings = {
+        "green_ready": green_ready,
+        "cutover": cutover_latency,
+        "drain": time.monotonic() - drained,
+        "total": time.monotonic() - start,
+        "skipped": False,
+    }
+    latency_history.record(app_name, namespace, "drain", timings["drain"])
+    latency_history.record(app_name, namespace, "promotion", timings["total"])
+    return timings
+
+
+def parse_waves(text):
+    """Parse comma-separated cumulative wave percentages (e.g. 5,25,100)"""
+    try:
+        waves = [float(part) for part in text.split(",") if part.strip()]
+    except ValueError:
+        raise ValueError(f"invalid percentage list '{text}': expected comma-separated percentages") from None
+    if not waves or any(b <= a for a, b in zip(waves, waves[1:])) or waves[0] <= 0 or waves[-1] > 100:
+        raise ValueError(f"invalid percentage list '{text}': percentages must increase from above 0 up to 100")
+    if waves[-1] != 100:
+        waves.append(100.0)
+    return waves
+
+
+def plan_waves(items, percentages):
+    """
+    Split items into waves covering the given cumulative percentages.
+
+    Each wave holds at least one item and empty waves are dropped, so
+    5,25,100 over 10 items gives waves of 1, 2 and 7.
+    """
+    waves = []
+    done = 0
+    for percentage in percentages:
+        end = min(len(items), max(done + 1, math.ceil(len(items) * percentage / 100)))
+        if end > done:
+            waves.append(items[done:end])
+            done = end
+    return waves
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Effective Values
+
+Works out, without a cluster, the Helm parameters each Application gets
+from the GitOps tree. The layers are applied in this order, each one
+overriding the one before:
+
+1. base/<app>-app.yaml: the template's parameters, minus the placeholders
+   (REPLICA_COUNT, IMAGE_TAG, ...) that each environment fills in
+2. environments/<env>/<app>-app.yaml: the Application's own parameters
+3. environments/<env>/helm-values/<values>-values.yaml: the values file,
+   flattened and merged the way modify-and-test-helm.py applies it
+
+<values> is <app> unless a mapping says otherwise (nginx=app1). Every
+(application, environment) result is cached under the SHA-256 of its
+inputs in $GITOPS_RENDER_CACHE (default ~/.cache/gitops-argocd/
+effective-values/), so a repeat run reads and hashes the files but parses
+only those that changed. GITOPS_RENDER_CACHE=off turns the cache off.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from app_patch import helm_parameters, merge_parameters
+from helm_values import ValuesDocument, ValuesError
+
+CACHE_ENV = "GITOPS_RENDER_CACHE"
+DISABLED = ("off", "none", "0", "false", "no")
+# Part of every cache key: bump it when the rendered result changes shape
+RENDER_VERSION = 1
+
+ENVIRONMENT_ORDER = ("dev", "staging", "production")
+LAYERS = ("base", "application", "values")
+PLACEHOLDER_RE = re.compile(r"^[A-Z][A-Z0-9]*(_[A-Z0-9]+)+$")
+APP_FILE_RE = re.compile(r"^(.+)-app\.ya?ml$")
+VALUES_FILE_RE = re.compile(r"^(.+)-values\.ya?ml$")
+# Row of the chart version in compare_environments()
+CHART_VERSION = "(chart version)"
+
+
+class RenderError(Exception):
+    """Raised when an input file cannot be read or parsed"""
+
+
+def find_root(candidates=None):
+    """The GitOps tree: the first candidate with an environments/ directory, or None"""
+    if candidates is None:
+        candidates = ["gitops-solution", ".", os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+    for candidate in candidates:
+        if os.path.isdir(os.path.join(candidate, "environments")):
+            return candidate
+    return None
+
+
+def environment_order(environment):
+    """Sort key that puts dev, staging and production first, in promotion order"""
+    if environment in ENVIRONMENT_ORDER:
+        return (0, ENVIRONMENT_ORDER.index(environment), environment)
+    return (1, 0, environment)
+
+
+def _matching(directory, pattern):
+    try:
+        names = sorted(os.listdir(directory))
+    except (FileNotFoundError, NotADirectoryError):
+        return {}
+    matches = {}
+    for name in names:
+        match = pattern.match(name)
+        if match:
+            matches[match.group(1)] = os.path.join(directory, name)
+    return matches
+
+
+def discover(root, values_for=None):
+    """
+    The (app, environment) pairs of the tree and their input files.
+
+    An app exists in an environment when it has an Application file or a
+    values file there. values_for maps an app to the values file it reads
+    ({"nginx": "app1"}); a values file claimed that way is not an app of
+    its own. Returns {(app, environment): {layer: path}}.
+    """
+    values_for = values_for or {}
+    claimed = set(values_for.values())
+    bases = _matching(os.path.join(root, "base"), APP_FILE_RE)
+    environments_dir = os.path.join(root, "environments")
+    try:
+        environments = sorted((name for name in os.listdir(environments_dir)
+                               if os.path.isdir(os.path.join(environments_dir, name))), key=environment_order)
+    except FileNotFoundError:
+        raise RenderError(f"No environments/ directory in {root}") from None
+    pairs = {}
+    for environment in environments:
+        applications = _matching(os.path.join(environments_dir, environment), APP_FILE_RE)
+        values = _matching(os.path.join(environments_dir, environment, "helm-values"), VALUES_FILE_RE)
+        apps = set(applications) | {name for name in values if name not in claimed}
+        for app in sorted(apps):
+            inputs = {}
+            if app in bases:
+                inputs["base"] = bases[app]
+            if app in applications:
+                inputs["application"] = applications[app]
+            values_name = values_for.get(app, app)
+            if values_name in values:
+                inputs["values"] = values[values_name]
+            pairs[(app, environment)] = inputs
+    return pairs
+
+
+def _parameter_value(value):
+    # Unquoted YAML scalars come back typed; ArgoCD stores every value as a string
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _source(document):
+    spec = (document or {}).get("spec") or {}
+    return spec.get("source") or {}
+
+
+def _application_parameters(document, layer):
+    parameters = []
+    for parameter in (_source(document).get("helm") or {}).get("parameters") or []:
+        if not isinstance(parameter, dict) or "name" not in parameter:
+            continue
+        rendered = {"name": str(parameter["name"]), "value": _parameter_value(parameter.get("value"))}
+        if parameter.get("forceString"):
+            rendered["forceString"] = True
+        rendered["source"] = layer
+        parameters.append(rendered)
+    return parameters
+
+
+def render(app, environment, contents):
+    """
+    Merge the layers of one app in one environment. contents maps a layer
+    to the text of its file. Returns the effective Application name, chart,
+    chart version and parameters (each with the layer it comes from), and
+    the placeholders no layer filled in.
+    """
+    documents = {}
+    for layer in LAYERS:
+        if layer in contents:
+            try:
+                documents[layer] = ValuesDocument(contents[layer]).to_python() or {}
+            except ValuesError as e:
+                raise RenderError(f"{layer} file of {app}-{environment}: {e}") from None
+            if not isinstance(documents[layer], dict):
+                raise RenderError(f"{layer} file of {app}-{environment} is not a mapping")
+
+    parameters = []
+    placeholders = set()
+    if "base" in documents:
+        for parameter in _application_parameters(documents["base"], "base"):
+            if PLACEHOLDER_RE.match(parameter["value"]):
+                placeholders.add(parameter["name"])
+            else:
+                parameters.append(parameter)
+    if "application" in documents:
+        parameters = merge_parameters(parameters, _application_parameters(documents["application"], "application"))
+    if "values" in documents:
+        overrides = [dict(parameter, source="values") for parameter in helm_parameters(documents["values"])]
+        parameters = merge_parameters(parameters, overrides)
+
+    source = {}
+    for layer in ("base", "application"):
+        for key in ("chart", "repoURL", "targetRevision"):
+            value = _source(documents.get(layer)).get(key)
+            if value is not None and not PLACEHOLDER_RE.match(str(value)):
+                source[key] = str(value)
+    name = ((documents.get("application") or {}).get("metadata") or {}).get("name") or f"{app}-{environment}"
+    return {
+        "application": name,
+        "app": app,
+        "environment": environment,
+        "chart": source.get("chart"),
+        "repoURL": source.get("repoURL"),
+        "targetRevision": source.get("targetRevision"),
+        "parameters": parameters,
+        "unset": sorted(placeholders - {parameter["name"] for parameter in parameters}),
+    }
+
+
+def cache_key(app, environment, contents):
+    """SHA-256 of everything a rendered result depends on"""
+    digest = hashlib.sha256(f"{RENDER_VERSION}\0{app}\0{environment}".encode("utf-8"))
+    for layer in LAYERS:
+        if layer in contents:
+            data = contents[layer].encode("utf-8")
+            digest.update(f"\0{layer}\0{len(data)}\0".encode("utf-8"))
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """Rendered results stored by the content hash of their inputs"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(
+            os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "gitops-argocd", "effective-values")
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """The cached result, or None"""
+        try:
+            with open(self._path(key), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, result):
+        """Store a result; a cache that cannot be written only costs the next run a render"""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temporary = tempfile.mkstemp(prefix=".render-", dir=os.path.dirname(path))
+            with os.fdopen(fd, "w") as f:
+                json.dump(result, f)
+            os.replace(temporary, path)
+        except OSError:
+            pass
+
+
+def default_cache():
+    """The cache configured by $GITOPS_RENDER_CACHE, or None when it is off"""
+    value = (os.environ.get(CACHE_ENV) or "").strip()
+    if value.lower() in DISABLED:
+        return None
+    return RenderCache(value or None)
+
+
+def effective_values(pairs, cache=None):
+    """
+    Render the (app, environment) pairs found by discover(). Returns
+    ({(app, environment): result}, number of results read from the cache).
+    """
+    texts = {}
+    results = {}
+    hits = 0
+    for (app, environment), inputs in pairs.items():
+        contents = {}
+        for layer, path in inputs.items():
+            # The base file is shared by every environment of an app: read it once
+            if path not in texts:
+                try:
+                    with open(path, "r") as f:
+                        texts[path] = f.read()
+                except OSError as e:
+                    raise RenderError(f"Cannot read {path}: {e}") from None
+            contents[layer] = texts[path]
+        key = cache_key(app, environment, contents)
+        result = cache.get(key) if cache is not None else None
+        if result is None:
+            result = render(app, environment, contents)
+            if cache is not None:
+                cache.put(key, result)
+        else:
+            hits += 1
+        result["inputs"] = dict(inputs)
+        results[(app, environment)] = result
+    return results, hits
+
+
+def compare_environments(results):
+    """
+    Line up the effective parameters of each app across its environments.
+    Returns {app: (environments, rows)} where each row is (parameter,
+    {environment: value or None}, drifted); the chart version, when known,
+    comes first.
+    """
+    by_app = {}
+    for (app, environment), result in results.items():
+        by_app.setdefault(app, {})[environment] = result
+    comparison = {}
+    for app, per_environment in sorted(by_app.items()):
+        environments = sorted(per_environment, key=environment_order)
+        names = []
+        values = {}
+        for environment in environments:
+            result = per_environment[environment]
+            values.setdefault(CHART_VERSION, {})[environment] = result.get("targetRevision")
+            for parameter in result["parameters"]:
+                if parameter["name"] not in values:
+                    names.append(parameter["name"])
+                values.setdefault(parameter["name"], {})[environment] = parameter["value"]
+        if any(values[CHART_VERSION].values()):
+            names.insert(0, CHART_VERSION)
+        rows = []
+        for name in names:
+            row = {environment: values[name].get(environment) for environment in environments}
+            rows.append((name, row, len(set(row.values())) > 1))
+        comparison[app] = (environments, rows)
+    return comparison
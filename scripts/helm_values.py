@@ -0,0 +1,761 @@
+#!/usr/bin/env python3
+"""
+Helm Values Engine
+
+Round-trip, comment-preserving editor for Helm values files. A document is
+cut into one section per top-level key; a section is parsed on first use
+into a tree of line/column references with every key path indexed, so
+lookups are dictionary hits and setting an existing scalar rewrites only
+the characters of that value. Structural edits (new keys, deletes, new
+collections) re-parse just the section they touch. Comments, key order,
+quoting and formatting of untouched regions are kept byte for byte.
+
+Paths are dotted keys with optional list indexes, e.g. `image.tag`,
+`ingress.hosts[0].name` or `podAnnotations.prometheus\\.io/scrape` (a
+backslash escapes a literal dot).
+
+Block-style YAML (mappings, sequences, block scalars and single-line flow
+collections) is supported, which covers values files. PyYAML is not
+required; it is only used, when installed, to decode flow collections and
+block scalars.
+"""
+
+import json
+import re
+
+try:
+    import yaml
+    HAS_YAML = True
+except ImportError:
+    HAS_YAML = False
+
+_INT_RE = re.compile(r"^[-+]?(0|[1-9][0-9_]*)$")
+_HEX_RE = re.compile(r"^0x[0-9a-fA-F_]+$")
+_FLOAT_RE = re.compile(r"^[-+]?(\.[0-9]+|[0-9][0-9_]*(\.[0-9_]*)?)([eE][-+]?[0-9]+)?$")
+_BOOL_VALUES = {
+    "true": True, "True": True, "TRUE": True, "yes": True, "Yes": True, "YES": True,
+    "on": True, "On": True, "ON": True,
+    "false": False, "False": False, "FALSE": False, "no": False, "No": False, "NO": False,
+    "off": False, "Off": False, "OFF": False,
+}
+_NULL_VALUES = {"", "~", "null", "Null", "NULL"}
+_SPECIAL_START = set("-?:,[]{}#&*!|>'\"%@`")
+_BLOCK_INDICATOR_RE = re.compile(r"^[|>][-+0-9]*$")
+
+
+class ValuesError(Exception):
+    """Raised for unparseable documents and invalid edits"""
+
+
+# -- paths ---------------------------------------------------------------------
+
+def parse_path(path):
+    """Split a dotted/indexed key path into a tuple of keys and list indexes"""
+    if isinstance(path, tuple):
+        return path
+    parts = []
+    current = ""
+    i = 0
+    while i < len(path):
+        char = path[i]
+        if char == "\\" and i + 1 < len(path):
+            current += path[i + 1]
+            i += 2
+            continue
+        if char == ".":
+            if current:
+                parts.append(current)
+            current = ""
+        elif char == "[":
+            close = path.find("]", i)
+            if close == -1:
+                raise ValuesError(f"Unclosed '[' in path: {path}")
+            if current:
+                parts.append(current)
+            current = ""
+            index = path[i + 1:close]
+            if not index.isdigit():
+                raise ValuesError(f"Invalid list index '{index}' in path: {path}")
+            parts.append(int(index))
+            i = close
+        else:
+            current += char
+        i += 1
+    if current:
+        parts.append(current)
+    if not parts:
+        raise ValuesError("Empty key path")
+    return tuple(parts)
+
+
+def format_path(parts):
+    """Join a path tuple back into its dotted string form"""
+    out = ""
+    for part in parts:
+        if isinstance(part, int):
+            out += f"[{part}]"
+        else:
+            escaped = part.replace("\\", "\\\\").replace(".", "\\.")
+            out += f".{escaped}" if out else escaped
+    return out
+
+
+# -- scalars -------------------------------------------------------------------
+
+def parse_scalar(raw):
+    """Convert the source text of a YAML scalar to a Python value"""
+    text = raw.strip()
+    if text in _NULL_VALUES:
+        return None
+    if text[0] == "'" and text[-1] == "'" and len(text) > 1:
+        return text[1:-1].replace("''", "'")
+    if text[0] == '"' and text[-1] == '"' and len(text) > 1:
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text[1:-1]
+    if text[0] in "[{":
+        try:
+            return json.loads(text)
+        except ValueError:
+            if HAS_YAML:
+                try:
+                    return yaml.safe_load(text)
+                except yaml.YAMLError as e:
+                    raise ValuesError(f"Invalid flow collection {text!r}: {getattr(e, 'problem', None) or e}") from None
+            return text
+    if text in _BOOL_VALUES:
+        return _BOOL_VALUES[text]
+    if _INT_RE.match(text):
+        return int(text.replace("_", ""))
+    if _HEX_RE.match(text):
+        return int(text[2:].replace("_", ""), 16)
+    if _FLOAT_RE.match(text) and any(c.isdigit() for c in text):
+        return float(text.replace("_", ""))
+    if text.lower() in (".inf", "+.inf"):
+        return float("inf")
+    if text.lower() == "-.inf":
+        return float("-inf")
+    if text.lower() == ".nan":
+        return float("nan")
+    return text
+
+
+def format_scalar(value):
+    """Render a Python scalar as YAML source text that reads back as the same value"""
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, float) and value != value:
+        return ".nan"
+    if isinstance(value, float) and value in (float("inf"), float("-inf")):
+        return ".inf" if value > 0 else "-.inf"
+    if isinstance(value, float):
+        text = repr(value)
+        # YAML 1.1 readers only accept exponents on numbers with a dot
+        return text.replace("e", ".0e", 1) if "e" in text and "." not in text else text
+    if isinstance(value, int):
+        return repr(value)
+    text = str(value)
+    if any(c in text for c in "\n\r\t") or any(ord(c) < 32 for c in text):
+        return json.dumps(text)
+    needs_quotes = (
+        text == "" or text != text.strip() or text[0] in _SPECIAL_START
+        or ": " in text or " #" in text or text.endswith(":")
+        or not isinstance(parse_scalar(text), str) or parse_scalar(text) != text
+    )
+    if needs_quotes:
+        return "'" + text.replace("'", "''") + "'"
+    return text
+
+
+def _strip_comment(text):
+    """Return text with any trailing comment removed (quote aware)"""
+    quote = None
+    for i, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"" and (i == 0 or text[i - 1] in " \t:[{,-"):
+            quote = char
+        elif char == "#" and (i == 0 or text[i - 1] in " \t"):
+            return text[:i].rstrip()
+    return text.rstrip()
+
+
+def _split_key(text):
+    """Split 'key: rest' into (key, offset of rest) or return None if not a mapping entry"""
+    if not text or text[0] in "[{" or text.startswith("- ") or text == "-":
+        return None
+    if text[0] in "'\"":
+        quote = text[0]
+        i = 1
+        while i < len(text):
+            if text[i] == quote:
+                if quote == "'" and i + 1 < len(text) and text[i + 1] == "'":
+                    i += 2
+                    continue
+                break
+            if text[i] == "\\" and quote == '"':
+                i += 1
+            i += 1
+        rest = text[i + 1:]
+        if not (rest.startswith(":") and (len(rest) == 1 or rest[1] in " \t")):
+            return None
+        return parse_scalar(text[:i + 1]), i + 2
+    i = 0
+    while True:
+        i = text.find(":", i)
+        if i == -1:
+            return None
+        if i + 1 == len(text) or text[i + 1] in " \t":
+            key = text[:i].rstrip()
+            return (key, i + 1) if key else None
+        i += 1
+
+
+# -- document tree -------------------------------------------------------------
+
+class Node:
+    """A parsed value: mapping, sequence, single-line scalar, multi-line block or null"""
+
+    __slots__ = ("kind", "col", "entries", "line", "start", "end", "last_line")
+
+    def __init__(self, kind, col=0, line=-1, start=0, end=0, last_line=-1):
+        self.kind = kind
+        self.col = col
+        self.entries = {} if kind == "map" else [] if kind == "seq" else None
+        self.line = line
+        self.start = start
+        self.end = end
+        self.last_line = last_line
+
+
+class Entry:
+    """A mapping key or sequence item together with its value"""
+
+    __slots__ = ("key", "line", "col", "value", "parent")
+
+    def __init__(self, key, line, col, value, parent):
+        self.key = key
+        self.line = line
+        self.col = col
+        self.value = value
+        self.parent = parent
+
+    @property
+    def last_line(self):
+        """Last source line occupied by this entry"""
+        return max(self.line, self.value.last_line)
+
+
+class _Row:
+    """A content line (or the part of a line after a '- ' marker)"""
+
+    __slots__ = ("line", "col", "text", "block_end")
+
+    def __init__(self, line, col, text):
+        self.line = line
+        self.col = col
+        self.text = text
+        self.block_end = None
+
+
+class _Section:
+    """One top-level key of a document with the comments above it, parsed on first use"""
+
+    def __init__(self, document, lines):
+        self.document = document
+        self.lines = lines
+        self.modified = False
+        self._root = None
+        self._index = None
+
+    def _line_number(self, line):
+        """1-based line number in the whole document, for error messages"""
+        return self.document._first_line(self) + line + 1
+
+    # -- parsing ---------------------------------------------------------------
+
+    def _rows(self):
+        """Turn source lines into content rows, splitting '- ' markers and skipping block scalars"""
+        rows = []
+        lines = self.lines
+        i = 0
+        while i < len(lines):
+            raw = lines[i]
+            stripped = raw.lstrip(" ")
+            if not stripped or stripped.startswith("#") or stripped.strip() in ("---", "..."):
+                i += 1
+                continue
+            if "\t" in raw[:len(raw) - len(stripped)]:
+                raise ValuesError(f"Tab indentation is not allowed (line {self._line_number(i)})")
+            col = len(raw) - len(stripped)
+            text = _strip_comment(stripped)
+            # '- ' markers become their own rows so sequence items parse like any node
+            while text == "-" or text.startswith("- "):
+                rows.append(_Row(i, col, "-"))
+                rest = text[1:]
+                if not rest.strip():
+                    text = ""
+                    break
+                offset = len(rest) - len(rest.lstrip(" "))
+                col += 1 + offset
+                text = rest.lstrip(" ")
+            if not text:
+                i += 1
+                continue
+            row = _Row(i, col, text)
+            rows.append(row)
+            # Block scalar: the following more-indented (or blank) lines are opaque content
+            split = _split_key(text)
+            value_text = text[split[1]:].strip() if split else text
+            if _BLOCK_INDICATOR_RE.match(value_text):
+                j = i + 1
+                last = i
+                while j < len(lines):
+                    candidate = lines[j]
+                    if candidate.strip() and len(candidate) - len(candidate.lstrip(" ")) <= (
+                            col if split else col - 2):
+                        break
+                    if candidate.strip():
+                        last = j
+                    j += 1
+                row.block_end = last
+                i = last + 1
+                continue
+            i += 1
+        return rows
+
+    def _parse(self):
+        """Parse the section into a tree and build its key-path index"""
+        self._pos = 0
+        self._row_list = self._rows()
+        if not self._row_list:
+            self._root = Node("map", col=0)
+        else:
+            self._root = self._parse_node(self._row_list[0].col)
+            if self._pos < len(self._row_list):
+                row = self._row_list[self._pos]
+                raise ValuesError(f"Unexpected content at line {self._line_number(row.line)}: {self.lines[row.line].strip()}")
+        if self._root.kind != "map":
+            raise ValuesError("The top level of a values file must be a mapping")
+        del self._row_list
+        self._index = {}
+        self._build_index(self._root, ())
+
+    def _parse_node(self, col):
+        rows = self._row_list
+        row = rows[self._pos]
+        if row.text == "-":
+            return self._parse_seq(row.col)
+        if _split_key(row.text) is not None:
+            return self._parse_map(row.col)
+        return self._parse_scalar_row(row, row.col - 1)
+
+    def _parse_scalar_row(self, row, parent_col, start=None):
+        """Parse a value that starts on a row: inline scalar, flow collection or block scalar"""
+        rows = self._row_list
+        raw = self.lines[row.line]
+        text_start = row.col if start is None else start
+        value_text = _strip_comment(raw[text_start:]).strip()
+        value_start = raw.index(value_text, text_start) if value_text else text_start
+        self._pos += 1
+        if row.block_end is not None:
+            return Node("block", line=row.line, start=value_start, end=len(raw), last_line=row.block_end)
+        last_line = row.line
+        # Plain scalars and flow collections may continue on more-indented lines
+        while self._pos < len(rows) and rows[self._pos].col > parent_col and rows[self._pos].line > row.line \
+                and rows[self._pos].text != "-" and _split_key(rows[self._pos].text) is None:
+            last_line = rows[self._pos].line
+            self._pos += 1
+        if last_line != row.line:
+            return Node("block", line=row.line, start=value_start, end=len(raw), last_line=last_line)
+        return Node("scalar", line=row.line, start=value_start, end=value_start + len(value_text),
+                    last_line=row.line)
+
+    def _parse_map(self, col):
+        rows = self._row_list
+        node = Node("map", col=col)
+        node.line = rows[self._pos].line
+        while self._pos < len(rows):
+            row = rows[self._pos]
+            if row.col != col or row.text == "-":
+                if row.col > col:
+                    raise ValuesError(f"Bad indentation at line {self._line_number(row.line)}: {self.lines[row.line].strip()}")
+                break
+            split = _split_key(row.text)
+            if split is None:
+                raise ValuesError(f"Expected a key at line {self._line_number(row.line)}: {self.lines[row.line].strip()}")
+            key, offset = split
+            key = str(key) if not isinstance(key, str) else key
+            if key in node.entries:
+                raise ValuesError(f"Duplicate key '{key}' at line {self._line_number(row.line)}")
+            if row.text[offset:].strip():
+                value = self._parse_scalar_row(row, col, start=row.col + offset)
+            else:
+                self._pos += 1
+                nxt = rows[self._pos] if self._pos < len(rows) else None
+                if nxt is not None and (nxt.col > col or (nxt.col == col and nxt.text == "-")):
+                    value = self._parse_node(nxt.col)
+                else:
+                    value = Node("null", line=row.line, start=len(self.lines[row.line]),
+                                 end=len(self.lines[row.line]), last_line=row.line)
+            node.entries[key] = Entry(key, row.line, col, value, node)
+            node.last_line = max(node.last_line, node.entries[key].last_line)
+        return node
+
+    def _parse_seq(self, col):
+        rows = self._row_list
+        node = Node("seq", col=col)
+        node.line = rows[self._pos].line
+        while self._pos < len(rows):
+            row = rows[self._pos]
+            if row.col != col or row.text != "-":
+                break
+            self._pos += 1
+            nxt = rows[self._pos] if self._pos < len(rows) else None
+            if nxt is not None and nxt.col > col:
+                value = self._parse_node(nxt.col)
+            else:
+                value = Node("null", line=row.line, start=len(self.lines[row.line]),
+                             end=len(self.lines[row.line]), last_line=row.line)
+            entry = Entry(len(node.entries), row.line, col, value, node)
+            node.entries.append(entry)
+            node.last_line = max(node.last_line, entry.last_line)
+        return node
+
+    def _build_index(self, node, prefix):
+        items = node.entries.items() if node.kind == "map" else enumerate(node.entries or [])
+        for key, entry in items:
+            path = prefix + (key,)
+            self._index[path] = entry
+            if entry.value.kind in ("map", "seq"):
+                self._build_index(entry.value, path)
+
+    def _ensure_index(self):
+        if self._index is None:
+            self._parse()
+
+    # -- queries ---------------------------------------------------------------
+
+    def __contains__(self, parts):
+        self._ensure_index()
+        return parts in self._index
+
+    def paths(self):
+        self._ensure_index()
+        return list(self._index)
+
+    def get(self, parts, default=None):
+        self._ensure_index()
+        entry = self._index.get(parts)
+        if entry is None:
+            return default
+        return self._to_python(entry.value)
+
+    def to_python(self):
+        self._ensure_index()
+        return self._to_python(self._root)
+
+    def _to_python(self, node):
+        if node.kind == "null":
+            return None
+        if node.kind == "scalar":
+            return parse_scalar(self.lines[node.line][node.start:node.end])
+        if node.kind == "map":
+            return {key: self._to_python(entry.value) for key, entry in node.entries.items()}
+        if node.kind == "seq":
+            return [self._to_python(entry.value) for entry in node.entries]
+        # Multi-line block: decode with PyYAML when available
+        text = "\n".join([self.lines[node.line][node.start:]] + self.lines[node.line + 1:node.last_line + 1])
+        if HAS_YAML:
+            return yaml.safe_load("value: " + text.replace("\n", "\n  ") + "\n")["value"]
+        return text
+
+    # -- edits -----------------------------------------------------------------
+
+    def _replace_lines(self, first, last, new_lines):
+        """Replace section lines first..last (inclusive); the section is parsed again on next use"""
+        self.lines[first:last + 1] = new_lines
+        self._index = None
+        self._root = None
+        self.modified = True
+
+    def set(self, parts, value):
+        self._ensure_index()
+        entry = self._index.get(parts)
+        # Empty collections are written inline as {} / []
+        is_scalar = not (isinstance(value, (dict, list)) and value)
+
+        if entry is not None:
+            node = entry.value
+            if is_scalar and node.kind == "scalar":
+                # Fast path: rewrite just the value characters on one line
+                raw = self.lines[node.line]
+                text = _format_inline(value)
+                if raw[node.start:node.end] != text:
+                    self.lines[node.line] = raw[:node.start] + text + raw[node.end:]
+                    node.end = node.start + len(text)
+                    self.modified = True
+                return
+            # Replace the whole value of the entry
+            head = self._entry_head(entry)
+            child_col = self._child_col(entry, value)
+            if is_scalar:
+                new_lines = [f"{head} {_format_inline(value)}"]
+            else:
+                new_lines = [head] + _render_block(value, child_col)
+            self._replace_lines(entry.line, entry.last_line, new_lines)
+            return
+
+        # Find the deepest existing ancestor
+        depth = len(parts) - 1
+        while depth > 0 and parts[:depth] not in self._index:
+            depth -= 1
+        parent_entry = self._index.get(parts[:depth]) if depth else None
+        parent = parent_entry.value if parent_entry else self._root
+        missing = parts[depth:]
+
+        empty_flow = parent.kind == "scalar" and self.lines[parent.line][parent.start:parent.end] in ("{}", "[]")
+        if parent.kind in ("scalar", "block") and not empty_flow:
+            raise ValuesError(f"Cannot set {format_path(parts)}: {format_path(parts[:depth])} is not a mapping or list")
+        if parent.kind == "null" or empty_flow:
+            # key: (null) or key: {}  ->  key:\n  child: value
+            child_col = self._child_col(parent_entry, _nest(missing, value))
+            head = self._entry_head(parent_entry)
+            self._replace_lines(parent_entry.line, parent_entry.line,
+                                [head] + _render_block(_nest(missing, value), child_col))
+            return
+        if isinstance(missing[0], int):
+            if parent.kind != "seq" or missing[0] != len(parent.entries):
+                raise ValuesError(f"Cannot set {format_path(parts)}: list index out of range")
+        elif parent.kind != "map":
+            raise ValuesError(f"Cannot set {format_path(parts)}: {format_path(parts[:depth])} is a list")
+
+        if parent.entries:
+            col = parent.col
+            insert_at = parent.last_line + 1
+        else:
+            col = 0
+            insert_at = len(self.lines)
+        new_lines = _render_block(_nest(missing, value), col)
+        self._replace_lines(insert_at, insert_at - 1, new_lines)
+
+    def delete(self, parts):
+        self._ensure_index()
+        entry = self._index.get(parts)
+        if entry is None:
+            return False
+        parent = entry.parent
+        raw = self.lines[entry.line]
+        marker_col = len(raw) - len(raw.lstrip(" "))
+        # '- key: value' or '- - item': outer '- ' markers precede the entry on its line
+        shares_marker_line = entry.col > marker_col and raw.lstrip(" ").startswith("-")
+        siblings = list(parent.entries.values()) if parent.kind == "map" else parent.entries
+        if len(parent.entries) == 1 and parts[:-1]:
+            # Removing the last child leaves an empty collection, not a null
+            self.set(parts[:-1], {} if parent.kind == "map" else [])
+            return True
+        if shares_marker_line and len(siblings) > 1 and siblings[0] is entry:
+            # First child on the marker line: move the outer markers onto the next sibling
+            following = siblings[1]
+            next_raw = self.lines[following.line]
+            self.lines[following.line] = raw[:entry.col] + next_raw[entry.col:]
+            self._replace_lines(entry.line, following.line - 1, [])
+        elif shares_marker_line and len(siblings) == 1:
+            self._replace_lines(entry.line, entry.last_line, [raw[:marker_col] + "-"])
+        else:
+            self._replace_lines(entry.line, entry.last_line, [])
+        return True
+
+    def _entry_head(self, entry):
+        """Source text of an entry's line up to where its value begins"""
+        raw = self.lines[entry.line]
+        node = entry.value
+        if node.kind in ("scalar", "block"):
+            return raw[:node.start].rstrip()
+        if node.kind in ("map", "seq") and node.line == entry.line:
+            # '- key: value' or '- - item': the value starts on the marker line
+            return raw[:node.col].rstrip()
+        return _strip_comment(raw)
+
+    def _child_col(self, entry, value=None):
+        """Indentation for new children of an entry"""
+        node = entry.value
+        if node.kind in ("map", "seq") and node.entries:
+            # Keep the existing indentation, including un-indented lists under a key
+            if node.col > entry.col or (node.kind == "seq" and isinstance(value, list)):
+                return node.col
+        return entry.col + 2
+
+
+class ValuesDocument:
+    """A Helm values file that can be queried and edited in place"""
+
+    def __init__(self, text=""):
+        self.trailing_newline = text.endswith("\n") or text == ""
+        lines = text.split("\n")
+        if self.trailing_newline and text:
+            lines.pop()
+        if lines == [""]:
+            lines = []
+        self._modified = False
+        self._sections = []
+        self._by_key = {}
+        self._split(lines)
+
+    @property
+    def modified(self):
+        """True once any edit changed the source"""
+        return self._modified or any(section.modified for section in self._sections)
+
+    def _split(self, lines):
+        """Cut the source at top-level keys; comments above a key belong to its section"""
+        start = 0
+        last_content = -1
+        key = None
+        for i, raw in enumerate(lines):
+            stripped = raw.strip()
+            if not stripped or stripped.startswith("#") or stripped in ("---", "..."):
+                continue
+            split = None
+            if raw[0] not in " \t" and not (raw == "-" or raw.startswith("- ")):
+                split = _split_key(_strip_comment(raw))
+            if split is not None:
+                if key is not None:
+                    self._add_section(key, lines[start:last_content + 1])
+                    start = last_content + 1
+                key = str(split[0])
+                if key in self._by_key:
+                    raise ValuesError(f"Duplicate key '{key}' at line {i + 1}")
+                self._by_key[key] = None
+            last_content = i
+        if lines:
+            self._add_section(key, lines[start:])
+
+    def _add_section(self, key, lines):
+        section = _Section(self, lines)
+        self._sections.append(section)
+        if key is not None:
+            self._by_key[key] = section
+        return section
+
+    def _first_line(self, section):
+        """Index of a section's first line in the whole document"""
+        line = 0
+        for other in self._sections:
+            if other is section:
+                return line
+            line += len(other.lines)
+        return line
+
+    # -- loading and saving ----------------------------------------------------
+
+    @classmethod
+    def load(cls, path):
+        """Read and parse a values file"""
+        with open(path, "r") as f:
+            return cls(f.read())
+
+    def to_text(self):
+        """Return the document source"""
+        text = "\n".join(line for section in self._sections for line in section.lines)
+        has_lines = any(section.lines for section in self._sections)
+        return text + "\n" if has_lines and self.trailing_newline else text
+
+    def save(self, path):
+        """Write the document to path"""
+        with open(path, "w") as f:
+            f.write(self.to_text())
+
+    # -- queries ---------------------------------------------------------------
+
+    def __contains__(self, path):
+        parts = parse_path(path)
+        section = self._by_key.get(parts[0])
+        return section is not None and parts in section
+
+    def paths(self):
+        """Return every indexed key path"""
+        return [path for section in self._sections for path in section.paths()]
+
+    def get(self, path, default=None):
+        """Return the Python value at path, or default if it is not set"""
+        parts = parse_path(path)
+        section = self._by_key.get(parts[0])
+        return section.get(parts, default) if section is not None else default
+
+    def to_python(self):
+        """Return the whole document as plain Python objects"""
+        values = {}
+        for section in self._sections:
+            values.update(section.to_python())
+        return values
+
+    # -- edits -----------------------------------------------------------------
+
+    def set(self, path, value):
+        """Set the value at path, creating missing parent mappings"""
+        parts = parse_path(path)
+        section = self._by_key.get(parts[0])
+        if section is not None:
+            section.set(parts, value)
+            return
+        if isinstance(parts[0], int):
+            raise ValuesError(f"Cannot set {format_path(parts)}: the top level is a mapping")
+        # A new top-level key becomes a new section at the end of the file
+        self._add_section(parts[0], _render_block(_nest(parts, value), 0))
+        self._modified = True
+
+    def delete(self, path):
+        """Remove the entry at path; returns False if it was not set"""
+        parts = parse_path(path)
+        section = self._by_key.get(parts[0])
+        if section is None or not section.delete(parts):
+            return False
+        if len(parts) == 1:
+            # The section keeps the comments that were above the key
+            del self._by_key[parts[0]]
+        return True
+
+
+def _nest(parts, value):
+    """Build the nested structure for a missing key path"""
+    for part in reversed(parts):
+        value = [value] if isinstance(part, int) else {part: value}
+    return value
+
+
+def _format_inline(value):
+    """Render a scalar or an empty collection on one line"""
+    if isinstance(value, dict):
+        return "{}"
+    if isinstance(value, list):
+        return "[]"
+    return format_scalar(value)
+
+
+def _render_block(value, col):
+    """Render a dict or list as block YAML lines indented by col"""
+    pad = " " * col
+    lines = []
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if isinstance(item, (dict, list)) and item:
+                lines.append(f"{pad}{format_scalar(key)}:")
+                lines.extend(_render_block(item, col + 2))
+            else:
+                lines.append(f"{pad}{format_scalar(key)}: {_format_inline(item)}")
+    else:
+        for item in value:
+            if isinstance(item, (dict, list)) and item:
+                nested = _render_block(item, col + 2)
+                nested[0] = f"{pad}- {nested[0][col + 2:]}"
+                lines.extend(nested)
+            else:
+                lines.append(f"{pad}- {_format_inline(item)}")
+    return lines
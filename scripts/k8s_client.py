@@ -0,0 +1,839 @@
+#!/usr/bin/env python3
+"""
+Kubernetes API Client
+
+Shared in-process client for the ArgoCD helper scripts. It talks to the
+Kubernetes API server directly over a pool of keep-alive HTTP connections,
+so a script fetches a whole object once instead of starting a shell and a
+fresh kubectl process for every field it needs.
+
+Connection settings are resolved once per process, in this order:
+
+1. KUBE_API_SERVER (and optionally KUBE_TOKEN, KUBE_CA_FILE,
+   KUBE_INSECURE_SKIP_TLS_VERIFY) environment variables
+2. The in-cluster service account
+3. The current kubeconfig context (read with a single
+   `kubectl config view --minify --raw -o json`)
+
+Large collections can be read with iter_list(), which pages through them
+with limit/continue and decodes each page incrementally, yielding one
+object at a time, so memory does not grow with the size of a namespace.
+
+Every request goes through the call layer of api_calls.py: a rate limit
+per API group, one request for identical reads in flight and retries
+with jittered backoff.
+"""
+
+import base64
+import codecs
+import http.client
+import json
+import os
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import tracing
+from api_calls import get_call_layer
+
+ARGOCD_NAMESPACE = "argocd"
+
+# API prefix for each resource kind used by the scripts
+API_PREFIXES = {
+    "applications": "/apis/argoproj.io/v1alpha1",
+    "appprojects": "/apis/argoproj.io/v1alpha1",
+    "deployments": "/apis/apps/v1",
+    "services": "/api/v1",
+    "endpoints": "/api/v1",
+    "pods": "/api/v1",
+    "configmaps": "/api/v1",
+    "secrets": "/api/v1",
+    "namespaces": "/api/v1",
+    "ingresses": "/apis/networking.k8s.io/v1",
+    "horizontalpodautoscalers": "/apis/autoscaling/v2",
+}
+
+# Cluster-scoped kinds are addressed without a namespace segment
+CLUSTER_SCOPED = {"namespaces"}
+
+# Resource kinds checked for each environment
+ENVIRONMENT_RESOURCE_KINDS = {
+    "dev": ["deployments", "services", "configmaps"],
+    "staging": ["deployments", "services", "configmaps", "ingresses"],
+    "production": ["deployments", "services", "configmaps", "ingresses", "horizontalpodautoscalers"],
+}
+DEFAULT_RESOURCE_KINDS = ["deployments", "services"]
+
+# Kind names as they appear in an Application's status.resources
+KIND_NAMES = {
+    "applications": "Application",
+    "deployments": "Deployment",
+    "services": "Service",
+    "endpoints": "Endpoints",
+    "pods": "Pod",
+    "configmaps": "ConfigMap",
+    "secrets": "Secret",
+    "namespaces": "Namespace",
+    "ingresses": "Ingress",
+    "horizontalpodautoscalers": "HorizontalPodAutoscaler",
+}
+
+PATCH_CONTENT_TYPES = {
+    "merge": "application/merge-patch+json",
+    "json": "application/json-patch+json",
+    "strategic": "application/strategic-merge-patch+json",
+}
+
+# Objects per page when paging through a collection with iter_list()
+LIST_PAGE_SIZE = 500
+# Bytes read from the socket at a time while decoding a streamed list
+STREAM_CHUNK_SIZE = 64 * 1024
+
+INSTANCE_LABEL = "app.kubernetes.io/instance"
+REFRESH_ANNOTATION = "argocd.argoproj.io/refresh"
+
+
+class KubeConfigError(Exception):
+    """Raised when no usable cluster connection settings can be found"""
+
+
+class ApiError(Exception):
+    """Raised when the API server answers with a non-2xx status"""
+
+    def __init__(self, status, reason, message="", body=None, retry_after=None):
+        super().__init__(f"{status} {reason}: {message}" if message else f"{status} {reason}")
+        self.status = status
+        self.reason = reason
+        self.message = message
+        self.body = body
+        # Retry-After header of a 429 or 503 answer
+        self.retry_after = retry_after
+
+
+def operation_name(method, path):
+    """Low-cardinality name for a request, e.g. 'GET deployments', 'LIST pods' or 'PATCH deployments/scale'"""
+    parts = path.split("?", 1)[0].strip("/").split("/")
+    for i in range(len(parts) - 1, -1, -1):
+        if parts[i] in API_PREFIXES:
+            if len(parts) == i + 1 and method == "GET":
+                method = "LIST"
+            subresource = f"/{parts[i + 2]}" if len(parts) > i + 2 else ""
+            return f"{method} {parts[i]}{subresource}"
+    return f"{method} {path.split('?', 1)[0]}"
+
+
+def resource_path(kind, namespace=None, name=None, subresource=None):
+    """Build the API path for a resource kind, optionally namespaced and named"""
+    try:
+        path = API_PREFIXES[kind]
+    except KeyError:
+        raise ValueError(f"Unsupported resource kind: {kind}")
+    if namespace and kind not in CLUSTER_SCOPED:
+        path += f"/namespaces/{namespace}"
+    path += f"/{kind}"
+    if name:
+        path += f"/{name}"
+        if subresource:
+            path += f"/{subresource}"
+    return path
+
+
+def iter_list_items(read, metadata, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Incrementally decode a List response and yield its items one at a time.
+
+    read(n) returns up to n bytes (b"" at the end). Top-level fields other
+    than items (kind, apiVersion, metadata) are stored in the metadata
+    dict as they are decoded. Only the item being decoded is held in
+    memory, not the whole body.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    state = {"buffer": "", "pos": 0, "eof": False}
+
+    def fill():
+        if state["eof"]:
+            raise ValueError("truncated JSON list response")
+        data = read(chunk_size)
+        if not data:
+            state["eof"] = True
+            state["buffer"] += text_decoder.decode(b"", final=True)
+            return
+        # Drop what has been consumed before growing the buffer
+        state["buffer"] = state["buffer"][state["pos"]:] + text_decoder.decode(data)
+        state["pos"] = 0
+
+    def peek():
+        """Next non-whitespace character, reading more as needed"""
+        while True:
+            buffer, pos = state["buffer"], state["pos"]
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            state["pos"] = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if state["eof"]:
+                return ""
+            fill()
+
+    def expect(char):
+        if peek() != char:
+            raise ValueError(f"expected '{char}' in JSON list response")
+        state["pos"] += 1
+
+    def value():
+        """Decode the next complete JSON value"""
+        peek()
+        while True:
+            try:
+                decoded, end = decoder.raw_decode(state["buffer"], state["pos"])
+            except ValueError:
+                fill()
+                continue
+            # A number is only complete once a delimiter follows it (1.5 may be the start of 1.5e3)
+            if not state["eof"] and (end == len(state["buffer"]) or state["buffer"][end] not in ",]} \t\r\n"):
+                fill()
+                continue
+            state["pos"] = end
+            return decoded
+
+    expect("{")
+    if peek() == "}":
+        return
+    while True:
+        key = value()
+        expect(":")
+        if key == "items" and peek() == "[":
+            expect("[")
+            if peek() == "]":
+                state["pos"] += 1
+            else:
+                while True:
+                    yield value()
+                    if peek() == ",":
+                        state["pos"] += 1
+                        continue
+                    expect("]")
+                    break
+        else:
+            metadata[key] = value()
+        if peek() == ",":
+            state["pos"] += 1
+            continue
+        expect("}")
+        return
+
+
+class ClusterConfig:
+    """Resolved API server address and credentials"""
+
+    def __init__(self, server, token=None, ssl_context=None, basic_auth=None):
+        self.server = server.rstrip("/")
+        self.token = token
+        self.ssl_context = ssl_context
+        self.basic_auth = basic_auth
+
+    def auth_headers(self):
+        """Return the authorization headers for this config"""
+        if self.token:
+            return {"Authorization": f"Bearer {self.token}"}
+        if self.basic_auth:
+            encoded = base64.b64encode(self.basic_auth.encode("utf-8")).decode("ascii")
+            return {"Authorization": f"Basic {encoded}"}
+        return {}
+
+
+def _make_ssl_context(ca_file=None, ca_data=None, insecure=False, cert_data=None, key_data=None,
+                      cert_file=None, key_file=None):
+    """Build an SSL context from kubeconfig-style certificate settings"""
+    context = ssl.create_default_context()
+    if insecure:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    elif ca_file or ca_data:
+        context.load_verify_locations(cafile=ca_file, cadata=ca_data)
+    if cert_file:
+        context.load_cert_chain(cert_file, key_file)
+    elif cert_data:
+        # ssl can only load client certificates from files, so write them to
+        # private temporary files and remove them right after loading
+        paths = []
+        try:
+            for data in (cert_data, key_data):
+                fd, path = tempfile.mkstemp(prefix="k8s-client-", suffix=".pem")
+                paths.append(path)
+                with os.fdopen(fd, "w") as f:
+                    f.write(data)
+            context.load_cert_chain(paths[0], paths[1])
+        finally:
+            for path in paths:
+                os.unlink(path)
+    return context
+
+
+def _decode_data(value):
+    """Decode a base64 *-data field from kubeconfig"""
+    return base64.b64decode(value).decode("utf-8") if value else None
+
+
+def _run_exec_plugin(exec_config):
+    """Run a kubeconfig exec credential plugin once and return its status"""
+    env = dict(os.environ)
+    for item in exec_config.get("env") or []:
+        env[item["name"]] = item["value"]
+    with tracing.span(f"{os.path.basename(exec_config['command'])} (credential plugin)", "exec") as span:
+        result = subprocess.run(
+            [exec_config["command"]] + list(exec_config.get("args") or []),
+            env=env, check=True, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        span.set(exit_code=result.returncode, response_bytes=len(result.stdout))
+    return json.loads(result.stdout).get("status", {})
+
+
+def _config_from_env():
+    """Read connection settings from KUBE_* environment variables"""
+    server = os.environ.get("KUBE_API_SERVER")
+    if not server:
+        return None
+    context = None
+    if server.startswith("https://"):
+        context = _make_ssl_context(
+            ca_file=os.environ.get("KUBE_CA_FILE"),
+            insecure=os.environ.get("KUBE_INSECURE_SKIP_TLS_VERIFY", "").lower() in ("1", "true", "yes"),
+        )
+    return ClusterConfig(server, token=os.environ.get("KUBE_TOKEN"), ssl_context=context)
+
+
+def _config_from_service_account():
+    """Read connection settings from the in-cluster service account"""
+    host = os.environ.get("KUBERNETES_SERVICE_HOST")
+    sa_dir = "/var/run/secrets/kubernetes.io/serviceaccount"
+    if not host or not os.path.exists(f"{sa_dir}/token"):
+        return None
+    port = os.environ.get("KUBERNETES_SERVICE_PORT", "443")
+    if ":" in host:
+        host = f"[{host}]"
+    with open(f"{sa_dir}/token") as f:
+        token = f.read().strip()
+    context = _make_ssl_context(ca_file=f"{sa_dir}/ca.crt")
+    return ClusterConfig(f"https://{host}:{port}", token=token, ssl_context=context)
+
+
+def _config_from_kubeconfig():
+    """Read connection settings for the current kubeconfig context"""
+    try:
+        with tracing.span("kubectl config view", "exec") as span:
+            result = subprocess.run(
+                ["kubectl", "config", "view", "--minify", "--raw", "-o", "json"],
+                check=True, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            span.set(exit_code=result.returncode, response_bytes=len(result.stdout))
+    except FileNotFoundError:
+        raise KubeConfigError("kubectl is not installed and KUBE_API_SERVER is not set")
+    except subprocess.CalledProcessError as e:
+        raise KubeConfigError(f"Could not read kubeconfig: {e.stderr.strip()}")
+
+    kubeconfig = json.loads(result.stdout)
+    try:
+        cluster = kubeconfig["clusters"][0]["cluster"]
+    except (KeyError, IndexError):
+        raise KubeConfigError("The current kubeconfig context has no cluster")
+    users = kubeconfig.get("users") or [{}]
+    user = users[0].get("user") or {}
+
+    if user.get("exec"):
+        try:
+            user = dict(user, **_run_exec_plugin(user["exec"]))
+        except (OSError, subprocess.CalledProcessError, ValueError) as e:
+            raise KubeConfigError(f"Credential plugin failed: {e}")
+
+    server = cluster["server"]
+    context = None
+    if server.startswith("https://"):
+        context = _make_ssl_context(
+            ca_file=cluster.get("certificate-authority"),
+            ca_data=_decode_data(cluster.get("certificate-authority-data")),
+            insecure=cluster.get("insecure-skip-tls-verify", False),
+            cert_file=user.get("client-certificate"),
+            key_file=user.get("client-key"),
+            cert_data=_decode_data(user.get("client-certificate-data")) or user.get("clientCertificateData"),
+            key_data=_decode_data(user.get("client-key-data")) or user.get("clientKeyData"),
+        )
+
+    token = user.get("token")
+    if not token and user.get("tokenFile"):
+        with open(user["tokenFile"]) as f:
+            token = f.read().strip()
+    basic_auth = None
+    if user.get("username") and user.get("password"):
+        basic_auth = f"{user['username']}:{user['password']}"
+    return ClusterConfig(server, token=token, ssl_context=context, basic_auth=basic_auth)
+
+
+def load_config():
+    """Resolve the cluster connection settings"""
+    for loader in (_config_from_env, _config_from_service_account, _config_from_kubeconfig):
+        config = loader()
+        if config is not None:
+            return config
+    raise KubeConfigError("No Kubernetes connection settings found")
+
+
+class ConnectionPool:
+    """Thread-safe pool of keep-alive HTTP(S) connections to a single host"""
+
+    # Errors that mean a reused keep-alive connection was closed by the server
+    STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                    BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+
+    def __init__(self, base_url, ssl_context=None, maxsize=16, timeout=30):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.base_path = parsed.path.rstrip("/")
+        self.ssl_context = ssl_context
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.connections_opened = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _new_connection(self, timeout):
+        """Open a new connection to the server"""
+        with self._lock:
+            self.connections_opened += 1
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=timeout, context=self.ssl_context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def _checkout(self, timeout):
+        """Take an idle connection or open a new one"""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            return self._new_connection(timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def release(self, conn):
+        """Return a connection whose response has been fully read"""
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def open(self, method, path, body=None, headers=None, timeout=None):
+        """Send a request and return (connection, response) with the body unread"""
+        timeout = self.timeout if timeout is None else timeout
+        conn, reused = self._checkout(timeout)
+        try:
+            conn.request(method, self.base_path + path, body=body, headers=headers or {})
+            return conn, conn.getresponse()
+        except self.STALE_ERRORS:
+            conn.close()
+            if not reused:
+                raise
+        except Exception:
+            conn.close()
+            raise
+        # The server dropped an idle keep-alive connection: retry once on a fresh one
+        conn = self._new_connection(timeout)
+        try:
+            conn.request(method, self.base_path + path, body=body, headers=headers or {})
+            return conn, conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+
+    def fetch(self, method, path, body=None, headers=None, timeout=None):
+        """Send a request and return (response, body bytes); the response's headers stay readable"""
+        conn, response = self.open(method, path, body=body, headers=headers, timeout=timeout)
+        try:
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self.release(conn)
+        return response, data
+
+    def request(self, method, path, body=None, headers=None, timeout=None):
+        """Send a request and return (status, reason, body bytes)"""
+        response, data = self.fetch(method, path, body=body, headers=headers, timeout=timeout)
+        return response.status, response.reason, data
+
+
+class KubeClient:
+    """Minimal Kubernetes REST client sharing one connection pool"""
+
+    def __init__(self, config=None, maxsize=16, timeout=30, calls=None):
+        self.config = config or load_config()
+        self.pool = ConnectionPool(self.config.server, self.config.ssl_context, maxsize=maxsize, timeout=timeout)
+        # Rate limiting, coalescing of identical reads and retries (api_calls.py)
+        self.calls = calls or get_call_layer()
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+        # Seconds get_cached() results are reused; 0 (one-shot scripts) always fetches
+        self.cache_ttl = 0
+        self._cached = {}
+
+    def _headers(self, content_type=None):
+        """Build request headers"""
+        headers = {"Accept": "application/json", "User-Agent": "gitops-argocd-scripts"}
+        headers.update(self.config.auth_headers())
+        if content_type:
+            headers["Content-Type"] = content_type
+        return headers
+
+    @staticmethod
+    def _query(params):
+        """Encode query parameters, dropping empty ones"""
+        params = {k: v for k, v in (params or {}).items() if v not in (None, "")}
+        return "?" + urllib.parse.urlencode(params) if params else ""
+
+    def _count_request(self):
+        """Count an API request"""
+        with self._count_lock:
+            self.request_count += 1
+
+    @staticmethod
+    def _check_status(status, reason, data, retry_after=None):
+        """Raise ApiError for a non-2xx response"""
+        if status < 400:
+            return
+        message = ""
+        decoded = None
+        try:
+            decoded = json.loads(data)
+            message = decoded.get("message", "")
+        except ValueError:
+            message = data.decode("utf-8", "replace").strip()
+        raise ApiError(status, reason, message, decoded, retry_after)
+
+    def _open(self, method, query, timeout=None):
+        """Open a streamed GET; an error answer is read and raised as ApiError"""
+        self._count_request()
+        conn, response = self.pool.open(method, query, headers=self._headers(), timeout=timeout)
+        if response.status >= 400:
+            try:
+                data = response.read()
+            except Exception:
+                conn.close()
+                raise
+            self.pool.release(conn)
+            self._check_status(response.status, response.reason, data, response.getheader("Retry-After"))
+        return conn, response
+
+    def request(self, method, path, params=None, body=None, content_type=None, timeout=None):
+        """Send an API request and return the decoded JSON response"""
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode("utf-8")
+            content_type = content_type or "application/json"
+        query = path + self._query(params)
+
+        def send():
+            self._count_request()
+            with tracing.span(operation_name(method, path), "api", request_bytes=len(payload or b"")) as span:
+                response, data = self.pool.fetch(method, query, body=payload, headers=self._headers(content_type),
+                                                 timeout=timeout)
+                span.set(http_status=response.status, response_bytes=len(data))
+                self._check_status(response.status, response.reason, data, response.getheader("Retry-After"))
+            return data
+
+        # Identical reads share one response, but every caller decodes its own copy
+        data = self.calls.call(method, query, send)
+        return json.loads(data) if data else {}
+
+    def watch(self, path, resource_version=None, timeout_seconds=60, label_selector=None, field_selector=None,
+              on_open=None):
+        """
+        Open a watch stream on a collection and yield its events as they
+        arrive. on_open, if given, is called with a function that ends the
+        stream from another thread (the generator then simply returns).
+        """
+        params = {
+            "watch": "1",
+            "resourceVersion": resource_version,
+            "timeoutSeconds": max(1, int(timeout_seconds)),
+            "allowWatchBookmarks": "true",
+            "labelSelector": label_selector,
+            "fieldSelector": field_selector,
+        }
+        query = path + self._query(params)
+        start = time.perf_counter()
+        try:
+            # The server ends the stream after timeoutSeconds; allow some slack on the socket
+            conn, response = self.calls.call("GET", query, lambda: self._open("GET", query, timeout_seconds + 30),
+                                             coalesce=False)
+        except ApiError as e:
+            tracing.record(operation_name("WATCH", path), "api", start, time.perf_counter() - start, "error",
+                           http_status=e.status)
+            raise
+        finished = False
+        events = 0
+        received = 0
+        state = {"cancelled": False, "done": False}
+        state_lock = threading.Lock()
+
+        def cancel():
+            with state_lock:
+                if state["done"] or state["cancelled"]:
+                    return
+                state["cancelled"] = True
+                if conn.sock is not None:
+                    try:
+                        # Wakes up the blocked read; close() would leave the socket open for the response
+                        conn.sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+        if on_open is not None:
+            on_open(cancel)
+        try:
+            while True:
+                try:
+                    line = response.readline()
+                except (OSError, http.client.HTTPException):
+                    if state["cancelled"]:
+                        return
+                    raise
+                if not line:
+                    finished = not state["cancelled"]
+                    return
+                received += len(line)
+                line = line.strip()
+                if line:
+                    events += 1
+                    yield json.loads(line)
+        finally:
+            tracing.record(operation_name("WATCH", path), "api", start, time.perf_counter() - start,
+                           http_status=response.status, events=events, response_bytes=received)
+            with state_lock:
+                state["done"] = True
+                reusable = finished and not state["cancelled"] and not response.will_close
+            # A stream abandoned half-way cannot be reused for another request
+            if reusable:
+                self.pool.release(conn)
+            else:
+                conn.close()
+
+    def get(self, path, params=None):
+        """GET an object"""
+        return self.request("GET", path, params=params)
+
+    def get_or_none(self, path, params=None):
+        """GET an object, returning None if it does not exist"""
+        try:
+            return self.get(path, params=params)
+        except ApiError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def get_cached(self, path):
+        """
+        get_or_none() for objects that rarely change, such as the ArgoCD
+        namespace and admin secret. A result is reused for cache_ttl
+        seconds, which the long-running agent sets.
+        """
+        if self.cache_ttl <= 0:
+            return self.get_or_none(path)
+        now = time.monotonic()
+        with self._count_lock:
+            entry = self._cached.get(path)
+        if entry and now - entry[0] < self.cache_ttl:
+            return entry[1]
+        obj = self.get_or_none(path)
+        with self._count_lock:
+            self._cached[path] = (now, obj)
+        return obj
+
+    def list(self, path, label_selector=None, field_selector=None, **params):
+        """List a collection"""
+        params.update(labelSelector=label_selector, fieldSelector=field_selector)
+        return self.get(path, params=params)
+
+    def iter_list(self, path, label_selector=None, field_selector=None, page_size=LIST_PAGE_SIZE, list_metadata=None,
+                  **params):
+        """
+        Yield every object of a collection, page by page.
+
+        Each page is requested with limit/continue and decoded as it
+        arrives, so the first objects are available before the list is
+        complete and memory stays flat however large the collection is.
+        list_metadata, if given, is filled with the first page's list
+        metadata (its resourceVersion is the snapshot every page belongs to).
+        """
+        params.update(labelSelector=label_selector, fieldSelector=field_selector, limit=page_size)
+        while True:
+            query = path + self._query(params)
+            metadata = {}
+            items = 0
+            with tracing.span(operation_name("GET", path), "api", paged=True) as span:
+                try:
+                    conn, response = self.calls.call("GET", query, lambda: self._open("GET", query), coalesce=False)
+                except ApiError as e:
+                    span.set(http_status=e.status)
+                    raise
+                received = [0]
+
+                def read(size):
+                    data = response.read(size)
+                    received[0] += len(data)
+                    return data
+
+                finished = False
+                try:
+                    for item in iter_list_items(read, metadata):
+                        items += 1
+                        yield item
+                    response.read()
+                    finished = True
+                finally:
+                    span.set(http_status=response.status, items=items, response_bytes=received[0])
+                    # A page abandoned half-way cannot be reused for another request
+                    if finished and not response.will_close:
+                        self.pool.release(conn)
+                    else:
+                        conn.close()
+            if list_metadata is not None and not list_metadata:
+                list_metadata.update(metadata.get("metadata") or {})
+            token = (metadata.get("metadata") or {}).get("continue")
+            if not token:
+                return
+            params["continue"] = token
+
+    def patch(self, path, body, patch_type="merge"):
+        """PATCH an object with a merge, JSON or strategic-merge patch"""
+        return self.request("PATCH", path, body=body, content_type=PATCH_CONTENT_TYPES[patch_type])
+
+    def stats(self):
+        """Per-API-group request, queueing, coalescing and retry counters of the call layer"""
+        return self.calls.stats()
+
+    def close(self):
+        """Close pooled connections"""
+        self.pool.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide shared client, creating it on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = KubeClient()
+        return _client
+
+
+def get_application(client, app_name, namespace=ARGOCD_NAMESPACE):
+    """Fetch an ArgoCD Application, or None if it does not exist"""
+    return client.get_or_none(resource_path("applications", namespace, app_name))
+
+
+def application_status(app):
+    """Return (sync status, health status) of an Application object"""
+    status = app.get("status") or {}
+    return (status.get("sync") or {}).get("status"), (status.get("health") or {}).get("status")
+
+
+def application_resources(app, kinds=None):
+    """Return the managed resources recorded in an Application's status"""
+    resources = (app.get("status") or {}).get("resources") or []
+    if kinds is None:
+        return resources
+    wanted = {KIND_NAMES[kind] for kind in kinds}
+    return [r for r in resources if r.get("kind") in wanted]
+
+
+def deployment_ready(deployment):
+    """Check whether a Deployment has finished rolling out"""
+    spec = deployment.get("spec") or {}
+    status = deployment.get("status") or {}
+    replicas = spec.get("replicas", 1)
+    if status.get("observedGeneration", 0) < deployment.get("metadata", {}).get("generation", 0):
+        return False
+    return (status.get("updatedReplicas", 0) >= replicas
+            and status.get("readyReplicas", 0) >= replicas
+            and status.get("replicas", 0) <= replicas)
+
+
+def pod_ready(pod):
+    """Check whether a pod is Running with a Ready condition of True and not being deleted"""
+    status = pod.get("status") or {}
+    if status.get("phase") != "Running" or pod.get("metadata", {}).get("deletionTimestamp"):
+        return False
+    return any(condition.get("type") == "Ready" and condition.get("status") == "True"
+               for condition in status.get("conditions") or [])
+
+
+def ready_address_count(endpoints):
+    """Number of ready addresses in an Endpoints object"""
+    return sum(len(subset.get("addresses") or []) for subset in endpoints.get("subsets") or [])
+
+
+def resource_summary(kind, obj):
+    """
+    Structured summary of a live resource: kind, name, namespace, status
+    text and ready (True/False, or None for kinds without readiness)
+    """
+    if kind == "deployments":
+        ready = deployment_ready(obj)
+    elif kind == "pods":
+        ready = pod_ready(obj)
+    elif kind == "endpoints":
+        ready = ready_address_count(obj) > 0
+    else:
+        ready = None
+    metadata = obj.get("metadata") or {}
+    return {
+        "kind": KIND_NAMES.get(kind, kind),
+        "name": metadata.get("name", ""),
+        "namespace": metadata.get("namespace", ""),
+        "status": summarize_resource(kind, obj),
+        "ready": ready,
+    }
+
+
+def summarize_resource(kind, obj):
+    """Return a short status column for a live resource"""
+    spec = obj.get("spec") or {}
+    status = obj.get("status") or {}
+    if kind == "deployments":
+        return f"{status.get('readyReplicas', 0)}/{spec.get('replicas', 0)} ready"
+    if kind == "services":
+        return f"{spec.get('type', 'ClusterIP')} {spec.get('clusterIP', '')}".strip()
+    if kind == "configmaps":
+        return f"{len(obj.get('data') or {})} keys"
+    if kind == "ingresses":
+        hosts = [rule.get("host", "*") for rule in spec.get("rules") or []]
+        return ",".join(hosts) or "*"
+    if kind == "horizontalpodautoscalers":
+        return (f"{spec.get('minReplicas', 1)}-{spec.get('maxReplicas', '?')} replicas, "
+                f"current {status.get('currentReplicas', 0)}")
+    if kind == "pods":
+        return status.get("phase", "Unknown")
+    if kind == "endpoints":
+        return f"{ready_address_count(obj)} ready addresses"
+    return ""
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Latency Report Script
+
+This script reports how long deployments take, from the timings the sync
+waiter, the blue-green cutover and the verification steps record in the
+latency history (latency_history.py). It prints p50/p95/p99 per
+application, environment and phase over one or more time windows, and
+flags the phases of the newest window that got slower than a baseline:
+the window before it, or a baseline saved earlier with --save-baseline.
+"""
+
+import sys
+import json
+import time
+import argparse
+
+from latency_history import (DB_ENV, QUANTILES, LatencyHistory, find_regressions, parse_duration, recorder,
+                             summarize)
+
+# ANSI color codes
+GREEN = '\033[0;32m'
+RED = '\033[0;31m'
+YELLOW = '\033[0;33m'
+BLUE = '\033[0;34m'
+NC = '\033[0m'  # No Color
+
+COLUMNS = ["app", "environment", "phase", "period", "count", "failures"] + list(QUANTILES)
+
+def print_color(color, message):
+    """Print colored message"""
+    print(f"{color}{message}{NC}")
+
+def report_periods(window, periods, now=None):
+    """(start, end) epoch ranges of the last periods windows, oldest first"""
+    now = time.time() if now is None else now
+    return [(now - (index + 1) * window, now - index * window) for index in reversed(range(periods))]
+
+def load_baseline(path):
+    """Summaries saved with --save-baseline, keyed by (app, environment, phase)"""
+    with open(path, "r") as f:
+        document = json.load(f)
+    return {(entry["app"], entry["environment"], entry["phase"]): entry for entry in document.get("phases", [])}
+
+def save_baseline(path, summaries, period):
+    """Save the summaries of the newest period as a baseline"""
+    phases = []
+    for (app, environment, phase), summary in sorted(summaries.items()):
+        phases.append(dict(app=app, environment=environment, phase=phase, **summary))
+    with open(path, "w") as f:
+        json.dump({"start": period[0], "end": period[1], "phases": phases}, f, indent=2)
+
+def format_seconds(value):
+    """A quantile for the table"""
+    return "-" if value is None else f"{value:.2f}s"
+
+def print_report(rows, output):
+    """Print the report rows as a table or JSON"""
+    if output == "json":
+        print(json.dumps(rows, indent=2))
+        return
+    if not rows:
+        print("No timings recorded in this window.")
+        return
+    table = [[column.upper() if column != "environment" else "ENV" for column in COLUMNS] + ["REGRESSION"]]
+    for row in rows:
+        table.append([row["app"], row["environment"], row["phase"], row["period"], str(row["count"]),
+                      str(row["failures"])] + [format_seconds(row[name]) for name in QUANTILES]
+                     + [row["regression"] or ""])
+    widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+    for index, row in enumerate(table):
+        line = "   ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+        print(f"{RED}{line}{NC}" if index and rows[index - 1]["regression"] else line)
+
+def latency_report(history, window=7 * 86400, periods=1, baseline_window=28 * 86400, baseline=None,
+                   filters=None, quantile="p95", threshold=0.2, min_delta=1.0, min_samples=5):
+    """
+    Summarize the timings of the last periods windows (newest last) and
+    compare the newest one to the baseline: the summaries given, or those
+    of the baseline_window before the newest window. Returns (rows, newest
+    period summaries keyed by (app, environment, phase), regressions).
+    """
+    filters = filters or {}
+    ranges = report_periods(window, periods)
+    summaries = summarize(history.timings(since=ranges[0][0], **filters), ranges)
+    newest = {key[:3]: summary for key, summary in summaries.items() if key[3] == len(ranges) - 1}
+    
+    if baseline is None:
+        start = ranges[-1][0]
+        summarized = summarize(history.timings(since=start - baseline_window, until=start, **filters))
+        baseline = {key[:3]: summary for key, summary in summarized.items()}
+    regressions = find_regressions(newest, baseline, quantile, threshold, min_delta, min_samples)
+    
+    rows = []
+    for (app, environment, phase, index), summary in sorted(summaries.items()):
+        regression = regressions.get((app, environment, phase)) if index == len(ranges) - 1 else None
+        period = time.strftime("%Y-%m-%d %H:%M", time.localtime(ranges[index][0]))
+        rows.append(dict(app=app, environment=environment, phase=phase, period=period, regression=regression,
+                         **summary))
+    return rows, newest, regressions
+
+def main(argv=None):
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Report deployment latency percentiles and regressions')
+    parser.add_argument('--db', help='Latency history database (default: $GITOPS_LATENCY_DB or '
+                                     '~/.local/state/gitops-argocd/latency.db)')
+    parser.add_argument('--app', help='Only this application (e.g., app1)')
+    parser.add_argument('--environment', help='Only this environment (e.g., dev)')
+    parser.add_argument('--phase', help='Only this phase (e.g., sync, verify, cutover)')
+    parser.add_argument('--window', default='7d', help='Length of a report window (e.g., 12h, 7d)')
+    parser.add_argument('--periods', type=int, default=1, help='Number of windows to show, newest last')
+    parser.add_argument('--baseline-window', default='28d', help='Window before the newest one to compare it to')
+    parser.add_argument('--baseline', help='Compare to a baseline saved with --save-baseline instead')
+    parser.add_argument('--save-baseline', metavar='FILE', help='Save the newest window as a baseline')
+    parser.add_argument('--quantile', choices=list(QUANTILES), default='p95', help='Quantile compared to the baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative growth that is a regression')
+    parser.add_argument('--min-delta', type=float, default=1.0, help='Seconds of growth that is a regression')
+    parser.add_argument('--min-samples', type=int, default=5, help='Completed runs needed on both sides')
+    parser.add_argument('--output', choices=['table', 'json'], default='table', help='Report format')
+    
+    args = parser.parse_args(argv)
+    if args.periods < 1:
+        parser.error("--periods must be at least 1")
+    try:
+        window = parse_duration(args.window)
+        baseline_window = parse_duration(args.baseline_window)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    path = args.db or (recorder.history.path if recorder.enabled else None)
+    if not path:
+        print_color(RED, f"Error: Latency history is turned off ({DB_ENV}); pass --db.")
+        return 1
+    history = LatencyHistory(path)
+    filters = {"app": args.app, "environment": args.environment, "phase": args.phase}
+    
+    try:
+        baseline = load_baseline(args.baseline) if args.baseline else None
+        rows, newest, regressions = latency_report(
+            history, window, args.periods, baseline_window, baseline, filters,
+            args.quantile, args.threshold, args.min_delta, args.min_samples
+        )
+        if args.save_baseline:
+            save_baseline(args.save_baseline, newest, report_periods(window, 1)[0])
+    except (OSError, ValueError, KeyError) as e:
+        print_color(RED, f"Error: {e}")
+        return 1
+    except Exception as e:  # sqlite3.Error, imported lazily by latency_history
+        print_color(RED, f"Cannot read the latency history in {path}: {e}")
+        return 1
+    
+    if args.output == "table":
+        print_color(BLUE, f"===== Deployment latency, last {args.periods} x {args.window} =====")
+    print_report(rows, args.output)
+    if args.output == "table":
+        if args.save_baseline:
+            print_color(GREEN, f"Saved the newest window as a baseline in {args.save_baseline}.")
+        if regressions:
+            print_color(RED, f"{len(regressions)} phase(s) regressed ({args.quantile} vs. baseline).")
+        else:
+            print_color(GREEN, "No latency regressions.")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
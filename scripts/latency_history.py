@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Deployment Latency History
+
+Keeps a record of how long deployments take. The sync waiter, the
+blue-green cutover and the verification steps record one timing each:
+application, environment, phase, duration and outcome. Timings are
+buffered in memory and appended to a local SQLite database in one
+transaction when the process exits (or when flush() is called), so
+recording adds nothing to the paths being timed.
+
+The database is $GITOPS_LATENCY_DB (default
+~/.local/state/gitops-argocd/latency.db); GITOPS_LATENCY_DB=off turns
+recording off. Several processes may write to it at once.
+
+The read side summarizes timings per (application, environment, phase)
+and period with the streaming quantile sketch from canary_analysis.py, so
+a long history is reduced in constant memory. A period whose quantile
+grew by more than a threshold over the baseline is a regression.
+"""
+
+import atexit
+import os
+import sys
+import threading
+import time
+
+DB_ENV = "GITOPS_LATENCY_DB"
+DISABLED = ("off", "none", "0", "false", "no")
+SCHEMA_VERSION = 1
+
+# Outcomes counted as a completed deployment; the others are failures
+SUCCESS = ("ok", "ready", "pass")
+QUANTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS timings (
+    id INTEGER PRIMARY KEY,
+    recorded_at REAL NOT NULL,
+    app TEXT NOT NULL,
+    environment TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    duration REAL NOT NULL,
+    outcome TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timings_recorded_at ON timings (recorded_at);
+"""
+
+
+def default_path():
+    return os.path.join(os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"),
+                        "gitops-argocd", "latency.db")
+
+
+def application_labels(app):
+    """
+    (app, environment) for an Application object or name. The environment
+    is the destination namespace when known, else the last -suffix of the
+    name; a name ending in -<environment> is shortened to the app
+    (app1-dev -> app1, dev).
+    """
+    if isinstance(app, dict):
+        name = app["metadata"]["name"]
+        environment = ((app.get("spec") or {}).get("destination") or {}).get("namespace")
+    else:
+        name, environment = app, None
+    prefix, _, suffix = name.rpartition("-")
+    environment = environment or (suffix if prefix else "")
+    if prefix and suffix == environment:
+        return prefix, environment
+    return name, environment
+
+
+class LatencyHistory:
+    """The SQLite store of timings"""
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+
+    def connect(self):
+        # Imported here: most runs only record, and only write once at exit
+        import sqlite3
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        if connection.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            # WAL lets reports read while pipelines append
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        return connection
+
+    def append(self, rows):
+        """Append (recorded_at, app, environment, phase, duration, outcome) rows in one transaction"""
+        connection = self.connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT INTO timings (recorded_at, app, environment, phase, duration, outcome) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        finally:
+            connection.close()
+
+    def timings(self, since=None, until=None, app=None, environment=None, phase=None):
+        """Yield (recorded_at, app, environment, phase, duration, outcome) rows, oldest first"""
+        if not os.path.exists(self.path):
+            return
+        conditions, parameters = [], []
+        for column, operator, value in (("recorded_at", ">=", since), ("recorded_at", "<", until),
+                                        ("app", "=", app), ("environment", "=", environment),
+                                        ("phase", "=", phase)):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                parameters.append(value)
+        query = "SELECT recorded_at, app, environment, phase, duration, outcome FROM timings"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        connection = self.connect()
+        try:
+            yield from connection.execute(query + " ORDER BY recorded_at", parameters)
+        finally:
+            connection.close()
+
+
+class Recorder:
+    """Buffers timings and appends them to the history at exit"""
+
+    def __init__(self):
+        self.history = None
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def configure(self, path):
+        """Record into the database at path (None turns recording off)"""
+        was_enabled = self.history is not None
+        self.history = LatencyHistory(path) if path else None
+        if self.history is not None and not was_enabled:
+            atexit.register(self.flush)
+
+    @property
+    def enabled(self):
+        return self.history is not None
+
+    def record(self, app, environment, phase, duration, outcome="ok"):
+        """Buffer one timing in seconds"""
+        if self.history is None:
+            return
+        with self.lock:
+            self.pending.append((time.time(), app, environment or "", phase, float(duration), outcome))
+
+    def record_application(self, app, phase, duration, outcome="ok"):
+        """Buffer a timing for an Application object or name"""
+        if self.history is None:
+            return
+        name, environment = application_labels(app)
+        self.record(name, environment, phase, duration, outcome)
+
+    def flush(self):
+        """Write the buffered timings; never fails the script that recorded them"""
+        with self.lock:
+            rows, self.pending = self.pending, []
+        if not rows or self.history is None:
+            return
+        try:
+            self.history.append(rows)
+        except Exception as e:  # sqlite3.Error or OSError: the deployment itself went fine
+            print(f"Failed to record deployment latencies in {self.history.path}: {e}", file=sys.stderr)
+
+
+def parse_duration(text):
+    """Seconds in '90', '90s', '30m', '12h', '7d' or '2w'"""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    text = str(text).strip().lower()
+    try:
+        if text and text[-1] in units:
+            return float(text[:-1]) * units[text[-1]]
+        return float(text)
+    except ValueError:
+        raise ValueError(f"invalid duration: {text!r} (use e.g. 90s, 30m, 12h, 7d)") from None
+
+
+class PhaseStats:
+    """Count, failures and a latency sketch of the completed runs of one phase"""
+
+    def __init__(self):
+        # Imported here so that recording scripts do not load the metrics code
+        from canary_analysis import QuantileSketch
+
+        self.count = 0
+        self.failures = 0
+        self.latency = QuantileSketch()
+
+    def add(self, duration, outcome):
+        self.count += 1
+        if outcome in SUCCESS:
+            self.latency.add(duration)
+        else:
+            self.failures += 1
+
+    def summary(self):
+        result = {"count": self.count, "failures": self.failures}
+        for name, q in QUANTILES.items():
+            result[name] = self.latency.quantile(q)
+        return result
+
+
+def summarize(timings, periods=None):
+    """
+    Summarize timings per (app, environment, phase, period index).
+
+    periods is a list of (start, end) epoch ranges; without it everything
+    falls into period 0. Returns {key: summary dict}.
+    """
+    stats = {}
+    for recorded_at, app, environment, phase, duration, outcome in timings:
+        index = 0
+        if periods is not None:
+            index = next((number for number, (start, end) in enumerate(periods) if start <= recorded_at < end), None)
+            if index is None:
+                continue
+        stats.setdefault((app, environment, phase, index), PhaseStats()).add(duration, outcome)
+    return {key: value.summary() for key, value in stats.items()}
+
+
+def find_regressions(current, baseline, quantile="p95", threshold=0.2, min_delta=1.0, min_samples=5):
+    """
+    Compare (app, environment, phase) summaries to a baseline. A phase
+    regresses when its quantile grew by more than threshold (relative) and
+    min_delta seconds (absolute), with at least min_samples completed runs
+    on both sides. Returns {key: message}.
+    """
+    regressions = {}
+    for key, summary in current.items():
+        before = baseline.get(key)
+        if not before or summary[quantile] is None or before.get(quantile) is None:
+            continue
+        if summary["count"] - summary["failures"] < min_samples or before["count"] - before["failures"] < min_samples:
+            continue
+        if summary[quantile] > before[quantile] * (1 + threshold) and summary[quantile] - before[quantile] > min_delta:
+            regressions[key] = f"{quantile} {before[quantile]:.2f}s -> {summary[quantile]:.2f}s"
+    return regressions
+
+
+def _configured_path():
+    value = (os.environ.get(DB_ENV) or "").strip()
+    if value.lower() in DISABLED:
+        return None
+    return value or default_path()
+
+
+recorder = Recorder()
+recorder.configure(_configured_path())
+
+record = recorder.record
+record_application = recorder.record_application
+flush = recorder.flush
@@ -3,27 +3,41 @@
 Modify and Test Helm Charts with ArgoCD
 
 This script modifies a Helm chart value and tests the changes using ArgoCD.
-It updates the values file, applies the changes to ArgoCD, and verifies the deployment.
+It checks the edits against the chart's values schema, updates the values file,
+applies the changes to ArgoCD, and verifies the deployment.
 """
 
-import subprocess
 import sys
 import os
 import json
-import base64
 import time
-import tempfile
-import re
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
-# Try to import yaml, but don't require it
+import latency_history
+from argocd_session import admin_password, mask
+from cluster_cache import ClusterCache
+from k8s_client import (
+    ARGOCD_NAMESPACE, DEFAULT_RESOURCE_KINDS, ENVIRONMENT_RESOURCE_KINDS, INSTANCE_LABEL, KIND_NAMES,
+    ApiError, KubeConfigError, get_application, get_client, resource_path, resource_summary
+)
+from app_patch import apply_parameters, helm_parameters
+from app_waiter import DEGRADED, MISSING, READY, wait_for_applications
+from helm_values import ValuesDocument, ValuesError, format_path, parse_path, parse_scalar
+from snapshots import SnapshotStore
+from tracing import span, traced
+from values_schema import SchemaError, ValidationError, find_schema, load_schema
+
+# PyYAML is only needed for change manifests that are a top-level YAML list
 try:
     import yaml
     HAS_YAML = True
 except ImportError:
     HAS_YAML = False
-    print("PyYAML not installed. Simple text-based YAML processing will be used.")
-    print("For better YAML handling, install PyYAML: pip install pyyaml")
+
+ENVIRONMENTS = ['dev', 'staging', 'production']
+# Width of the NAME column when live resources are streamed
+LIVE_NAME_WIDTH = 40
 
 # ANSI color codes
 GREEN = '\033[0;32m'
@@ -35,65 +49,131 @@ def print_color(color, message):
     """Print colored message"""
     print(f"{color}{message}{NC}")
 
-def run_command(command, capture_output=True, check=True):
-    """Run a shell command and return the output"""
+@traced("prerequisites")
+def check_prerequisites(full_app_names):
+    """Check the cluster, ArgoCD and the applications; returns the Application objects by name"""
+    # Check if the cluster connection settings can be loaded
     try:
-        result = subprocess.run(
-            command,
-            shell=True,
-            check=check,
-            text=True,
-            stdout=subprocess.PIPE if capture_output else None,
-            stderr=subprocess.PIPE if capture_output else None
-        )
-        return result.stdout.strip() if capture_output else None
-    except subprocess.CalledProcessError as e:
-        if capture_output:
-            print_color(RED, f"Command failed: {command}")
-            print_color(RED, f"Error: {e.stderr}")
-        return None
-
-def check_prerequisites(app_name, environment):
-    """Check if kubectl and ArgoCD are installed and application exists"""
-    # Check if kubectl is installed
-    if run_command("which kubectl", check=False) is None:
-        print_color(RED, "kubectl is not installed. Please install it first.")
+        client = get_client()
+    except KubeConfigError as e:
+        print_color(RED, f"Cannot connect to Kubernetes: {e}")
         sys.exit(1)
     
-    # Check if ArgoCD is installed
-    if run_command("kubectl get namespace argocd", check=False) is None:
-        print_color(RED, "ArgoCD namespace not found. Please install ArgoCD first.")
+    try:
+        # Check if ArgoCD is installed
+        if client.get_cached(resource_path("namespaces", name=ARGOCD_NAMESPACE)) is None:
+            print_color(RED, "ArgoCD namespace not found. Please install ArgoCD first.")
+            sys.exit(1)
+    
+        # Check if the applications exist in ArgoCD (one list call for a batch)
+        if len(full_app_names) == 1:
+            apps = [get_application(client, name) for name in full_app_names]
+        else:
+            apps = client.list(resource_path("applications", ARGOCD_NAMESPACE))["items"]
+        existing = {app["metadata"]["name"]: app for app in apps if app is not None}
+    except (ApiError, OSError) as e:
+        print_color(RED, f"Failed to query the Kubernetes API: {e}")
         sys.exit(1)
     
-    # Check if application exists in ArgoCD
-    full_app_name = f"{app_name}-{environment}"
-    if run_command(f"kubectl get application {full_app_name} -n argocd", check=False) is None:
-        print_color(RED, f"Application {full_app_name} does not exist in ArgoCD.")
+    missing = [name for name in full_app_names if name not in existing]
+    for name in missing:
+        print_color(RED, f"Application {name} does not exist in ArgoCD.")
+    if missing:
         sys.exit(1)
+    return existing
 
+@traced("password fetch")
 def get_argocd_password():
     """Get ArgoCD admin password"""
     print_color(YELLOW, "Getting ArgoCD admin password...")
-    password_base64 = run_command(
-        "kubectl -n argocd get secret argocd-initial-admin-secret -o jsonpath=\"{.data.password}\""
-    )
-    if password_base64:
-        password = base64.b64decode(password_base64).decode('utf-8')
-        print_color(GREEN, f"ArgoCD admin password retrieved: {password}")
+    password = admin_password()
+    if password:
+        # Never echo the secret itself: logs and CI output outlive the terminal
+        print_color(GREEN, f"ArgoCD admin password retrieved: {mask(password)}")
         print_color(YELLOW, "To access ArgoCD UI, run:")
         print("kubectl port-forward svc/argocd-server -n argocd 8080:443")
-        print(f"Then access ArgoCD at https://localhost:8080 with username: admin, password: {password}")
+        print("Then access ArgoCD at https://localhost:8080 with username: admin and the password from:")
+        print("kubectl -n argocd get secret argocd-initial-admin-secret -o jsonpath='{.data.password}' | base64 -d")
         return password
     else:
         print_color(RED, "Failed to get ArgoCD admin password.")
         return None
 
-def modify_helm_values(app_name, environment, key, value):
-    """Modify Helm values file"""
-    global HAS_YAML
-    
-    helm_dir = f"gitops-solution/environments/{environment}/helm-values"
-    values_file = f"{helm_dir}/{app_name}-values.yaml"
+def values_file_path(app_name, environment):
+    """The Helm values file of an application in an environment"""
+    return f"gitops-solution/environments/{environment}/helm-values/{app_name}-values.yaml"
+
+def values_schema(app, schema_path=None):
+    """The compiled values schema for an Application: schema_path, or the one of its chart if there is one"""
+    if schema_path is None:
+        source = ((app or {}).get("spec") or {}).get("source") or {}
+        schema_path = find_schema(source.get("chart") or os.path.basename((source.get("path") or "").rstrip("/")))
+        if schema_path is None:
+            return None
+    return load_schema(schema_path)
+
+@traced("schema validation")
+def validate_changes(groups, apps, schema_path=None, raw=False):
+    """
+    Check each (key, value) edit against the values schema of its
+    application and convert the value to the declared type ('4' becomes 4
+    for an integer). Exits before anything is written or patched when an
+    edit is rejected. raw values are command-line text, read like YAML
+    where no schema applies. Returns the checked changes per (app, environment).
+    """
+    checked = {}
+    errors = []
+    sources = set()
+    for (app_name, environment), changes in groups.items():
+        try:
+            schema = values_schema(apps.get(f"{app_name}-{environment}"), schema_path)
+        except SchemaError as e:
+            print_color(RED, f"Invalid values schema: {e}")
+            sys.exit(1)
+        if schema is None:
+            checked[(app_name, environment)] = [(key, parse_scalar(value) if raw else value) for key, value in changes]
+            continue
+        sources.add(schema.source)
+        checked[(app_name, environment)] = []
+        for key, value in changes:
+            try:
+                checked[(app_name, environment)].append((key, schema.check(key, value, raw)))
+            except ValidationError as e:
+                errors.append(f"{app_name}-{environment}: {e}")
+    
+    for error in errors:
+        print_color(RED, f"Rejected {error}")
+    if errors:
+        print_color(RED, f"{len(errors)} edit(s) rejected by the values schema. Nothing was changed.")
+        sys.exit(1)
+    if sources:
+        print_color(GREEN, f"Edits match the values schema ({', '.join(sorted(sources))}).")
+    return checked
+
+@traced("snapshot")
+def take_snapshots(apps, targets, store):
+    """
+    Record the Helm spec and values file of each (app, environment) before
+    they change; returns the snapshots by full application name. Exits when
+    a snapshot cannot be written, since the change could not be undone.
+    """
+    snapshots = {}
+    try:
+        for app_name, environment in targets:
+            full_app_name = f"{app_name}-{environment}"
+            snapshots[full_app_name] = store.save(apps[full_app_name], "modify-and-test-helm",
+                                                  values_file_path(app_name, environment))
+    except (OSError, ValueError) as e:
+        print_color(RED, f"Cannot save a snapshot in {store.directory}: {e}")
+        print_color(YELLOW, "Use --no-snapshot to change the application without one.")
+        sys.exit(1)
+    return snapshots
+
+@traced("values edit")
+def modify_helm_values(app_name, environment, changes, show=True):
+    """Apply a list of (key, value) changes to a Helm values file in one rewrite"""
+    values_file = values_file_path(app_name, environment)
+    helm_dir = os.path.dirname(values_file)
     
     # Create directory if it doesn't exist
     if not os.path.exists(helm_dir):
@@ -107,229 +187,329 @@ def modify_helm_values(app_name, environment, key, value):
         print_color(YELLOW, "Creating empty values file...")
         open(values_file, 'a').close()
     
-    # Get current value if it exists
-    print_color(YELLOW, f"Checking current value for {key}...")
-    current_value = "not set"
-    
+    # Parse the file once; comments, key order and formatting are preserved
     try:
-        with open(values_file, 'r') as f:
-            for line in f:
-                if line.strip().startswith(f"{key}:"):
-                    current_value = line.strip().split(':', 1)[1].strip()
-                    break
-    except Exception as e:
-        print_color(RED, f"Error reading values file: {e}")
-    
-    print_color(GREEN, f"Current value: {current_value}")
-    
-    # Modify the value in the values file
-    print_color(YELLOW, f"Modifying {key} to {value} in {values_file}...")
+        document = ValuesDocument.load(values_file)
+    except (OSError, ValuesError) as e:
+        print_color(RED, f"Error reading values file {values_file}: {e}")
+        sys.exit(1)
     
-    if HAS_YAML:
-        # Use PyYAML for better YAML handling
+    current_values = {}
+    for key, value in changes:
         try:
-            # Load existing values
-            values = {}
-            if os.path.getsize(values_file) > 0:
-                with open(values_file, 'r') as f:
-                    values = yaml.safe_load(f) or {}
-            
-            # Update the value
-            keys = key.split('.')
-            if len(keys) == 1:
-                values[key] = value
-            else:
-                # Handle nested keys
-                current = values
-                for k in keys[:-1]:
-                    if k not in current:
-                        current[k] = {}
-                    current = current[k]
-                current[keys[-1]] = value
-            
-            # Write back to file
-            with open(values_file, 'w') as f:
-                yaml.dump(values, f, default_flow_style=False)
-        
-        except Exception as e:
-            print_color(RED, f"Error modifying values file with PyYAML: {e}")
-            print_color(YELLOW, "Falling back to simple text processing...")
-            HAS_YAML = False
-    
-    if not HAS_YAML:
-        # Simple text-based processing
-        try:
-            with open(values_file, 'r') as f:
-                content = f.read()
-            
-            # Check if key exists
-            key_exists = False
-            new_content = []
-            
-            for line in content.splitlines():
-                if line.strip().startswith(f"{key}:"):
-                    new_content.append(f"{key}: {value}")
-                    key_exists = True
-                else:
-                    new_content.append(line)
-            
-            # Add key if it doesn't exist
-            if not key_exists:
-                new_content.append(f"{key}: {value}")
-            
-            # Write back to file
-            with open(values_file, 'w') as f:
-                f.write('\n'.join(new_content))
-                if not new_content[-1].endswith('\n'):
-                    f.write('\n')
-        
-        except Exception as e:
-            print_color(RED, f"Error modifying values file: {e}")
+            path = parse_path(key)
+            # Older files stored nested keys as a literal top-level 'image.tag: x'
+            if len(path) > 1 and path not in document and (key,) in document:
+                legacy = document.get((key,))
+                document.delete((key,))
+                document.set(path, legacy)
+                print_color(YELLOW, f"Converted top-level key '{key}' to a nested {format_path(path[:-1])} mapping")
+            current_values[key] = document.get(path, "not set")
+            if show:
+                print_color(GREEN, f"Current value of {key}: {current_values[key]}")
+                print_color(YELLOW, f"Modifying {key} to {value} in {values_file}...")
+            document.set(path, value)
+        except ValuesError as e:
+            print_color(RED, f"Error modifying {key} in {values_file}: {e}")
             sys.exit(1)
     
+    if document.modified:
+        document.save(values_file)
+    
     # Show the changes
-    print_color(GREEN, f"Changes made to {values_file}:")
-    with open(values_file, 'r') as f:
-        print(f.read())
+    if show:
+        print_color(GREEN, f"Changes made to {values_file}:")
+        print(document.to_text())
     
-    return current_value, values_file
+    return current_values, document.to_python()
 
-def update_argocd_application(app_name, environment, key, value, values_file):
-    """Update ArgoCD application with new values"""
+@traced("patch")
+def update_argocd_application(app_name, environment, values, app=None):
+    """
+    Patch only the changed Helm parameters of an application and refresh it
+    in the same request. Returns the changed parameter names, or None when
+    the patch failed.
+    """
     full_app_name = f"{app_name}-{environment}"
     
-    print_color(YELLOW, "Updating ArgoCD application to use our values...")
-    
-    # Read the values file content
-    with open(values_file, 'r') as f:
-        values_content = f.read()
-    
-    # Create a temporary JSON file for the patch
-    with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-        # Create the patch with both parameters and values
-        patch = {
-            "spec": {
-                "source": {
-                    "helm": {
-                        "parameters": [],
-                        "values": values_content
-                    }
-                }
-            }
-        }
-        
-        # Add all values as parameters too for better compatibility
-        with open(values_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    try:
-                        k, v = line.split(':', 1)
-                        patch["spec"]["source"]["helm"]["parameters"].append({
-                            "name": k.strip(),
-                            "value": v.strip()
-                        })
-                    except ValueError:
-                        # Skip lines that don't have a colon
-                        pass
-        
-        json.dump(patch, temp_file, indent=2)
-        temp_file_path = temp_file.name
-    
-    run_command(f"kubectl patch application {full_app_name} -n argocd --type merge --patch-file {temp_file_path}")
-    os.unlink(temp_file_path)
-    
-    print_color(GREEN, "ArgoCD application updated to use our values.")
+    print_color(YELLOW, f"Updating ArgoCD application {full_app_name} to use our values...")
+    try:
+        changed = apply_parameters(get_client(), full_app_name, helm_parameters(values), app=app)
+    except (ApiError, OSError, ValueError) as e:
+        print_color(RED, f"Failed to update application {full_app_name}: {e}")
+        return None
+    if changed:
+        print_color(GREEN, f"Updated {len(changed)} parameter(s) and refreshed. ArgoCD will automatically sync the changes.")
+    else:
+        print_color(GREEN, "Application parameters already match the values file. No patch or refresh needed.")
+    return changed
 
-def refresh_and_wait_for_sync(app_name, environment):
-    """Refresh the application in ArgoCD and wait for sync to complete"""
-    full_app_name = f"{app_name}-{environment}"
+@traced("sync wait")
+def wait_for_sync(full_app_names, timeout=150, show_progress=True):
+    """Wait until all applications are synced and healthy, reporting each outcome"""
+    print_color(YELLOW, f"Waiting for sync to complete for {len(full_app_names)} application(s)...")
     
-    # Refresh the application in ArgoCD
-    print_color(YELLOW, f"Refreshing application {full_app_name} in ArgoCD...")
-    run_command(f"kubectl patch application {full_app_name} -n argocd --type merge -p '{{\"spec\":{{\"syncPolicy\":{{\"automated\":{{\"prune\":true,\"selfHeal\":true}}}}}}}}'")
-    print_color(GREEN, "Application refreshed. ArgoCD will automatically sync the changes.")
-    
-    # Wait for sync to complete
-    print_color(YELLOW, "Waiting for sync to complete...")
-    for i in range(30):
-        sync_status = run_command(f"kubectl get application {full_app_name} -n argocd -o jsonpath=\"{{.status.sync.status}}\"")
-        if sync_status == "Synced":
-            print_color(GREEN, "Application synced successfully.")
-            break
-        print_color(YELLOW, f"Current sync status: {sync_status}. Waiting...")
-        time.sleep(5)
-        if i == 29:
-            print_color(RED, "Timeout waiting for sync to complete.")
-            sys.exit(1)
+    def on_update(name, sync, health):
+        if show_progress:
+            print_color(YELLOW, f"{name}: current status {sync}/{health}. Waiting...")
     
-    # Check health status
-    print_color(YELLOW, "Checking health status...")
-    health_status = run_command(f"kubectl get application {full_app_name} -n argocd -o jsonpath=\"{{.status.health.status}}\"")
-    print_color(GREEN, f"Health Status: {health_status}")
+    # Wait for sync and health, driven by one watch on the Application collection
+    try:
+        results = wait_for_applications(get_client(), full_app_names, timeout=timeout, on_update=on_update)
+    except (ApiError, OSError) as e:
+        print_color(RED, f"Failed to watch applications: {e}")
+        return False
+    
+    success = True
+    for name in full_app_names:
+        result = results[name]
+        if result["outcome"] == READY:
+            print_color(GREEN, f"{name}: synced and {result['health']} in {result['elapsed']:.1f}s.")
+        elif result["outcome"] == DEGRADED:
+            print_color(RED, f"{name}: application is {result['health']}.")
+            success = False
+        elif result["outcome"] == MISSING:
+            print_color(RED, f"{name}: application no longer exists in ArgoCD.")
+            success = False
+        else:
+            print_color(RED, f"{name}: timeout waiting for sync (last status: {result['sync']}/{result['health']}).")
+            success = False
+    return success
+
+def print_live_resources(namespace, instance, kinds, cache=None):
+    """
+    Print one row per live resource labelled with an application instance.
+    
+    Without a cache the resources are streamed from one list per kind;
+    with one (holding resource summaries) they are looked up locally.
+    """
+    client = get_client()
+    # Rows are printed as the pages arrive, so the widths are fixed up front
+    widths = (max(len(KIND_NAMES[kind]) for kind in kinds), LIVE_NAME_WIDTH)
+    found = 0
+    for kind in kinds:
+        try:
+            if cache is not None:
+                summaries = cache.by_instance(kind, namespace, instance)
+            else:
+                summaries = (resource_summary(kind, item) for item in client.iter_list(
+                    resource_path(kind, namespace), label_selector=f"{INSTANCE_LABEL}={instance}"))
+            for summary in summaries:
+                if not found:
+                    print(f"{'KIND'.ljust(widths[0])}   {'NAME'.ljust(widths[1])}   STATUS")
+                found += 1
+                print(f"{summary['kind'].ljust(widths[0])}   {summary['name'].ljust(widths[1])}   {summary['status']}".rstrip())
+        except (ApiError, OSError, ValueError) as e:
+            print_color(RED, f"Failed to list {kind}: {e}")
+    if not found:
+        print("No resources found.")
+
+def verification_scope(environment):
+    """(namespace, kinds) holding the live resources of an environment"""
+    if environment in ENVIRONMENT_RESOURCE_KINDS:
+        return environment, ENVIRONMENT_RESOURCE_KINDS[environment]
+    return "default", DEFAULT_RESOURCE_KINDS
 
-def verify_changes(app_name, environment):
+def live_resource_cache(environments):
+    """One cluster-wide list per kind verified in the environments, kept as resource summaries"""
+    kinds = [kind for environment in environments for kind in verification_scope(environment)[1]]
+    transforms = {kind: (lambda obj, kind=kind: resource_summary(kind, obj)) for kind in kinds}
+    return ClusterCache(get_client(), kinds, watch=False, transforms=transforms).start()
+
+@traced("verify")
+def verify_changes(app_name, environment, cache=None):
     """Verify the changes in Kubernetes resources"""
     full_app_name = f"{app_name}-{environment}"
+    namespace, kinds = verification_scope(environment)
+    started = time.monotonic()
     
     print_color(YELLOW, "Verifying changes...")
     
-    resource_commands = {
-        'dev': f"kubectl get deployments,services,configmaps -n dev -l \"app.kubernetes.io/instance={full_app_name}\" -o wide",
-        'staging': f"kubectl get deployments,services,configmaps,ingress -n staging -l \"app.kubernetes.io/instance={full_app_name}\" -o wide",
-        'production': f"kubectl get deployments,services,configmaps,ingress,hpa -n production -l \"app.kubernetes.io/instance={full_app_name}\" -o wide"
-    }
-    
-    if environment in resource_commands:
+    if environment in ENVIRONMENT_RESOURCE_KINDS:
         print_color(YELLOW, f"Checking {environment} environment resources...")
-        run_command(resource_commands[environment], capture_output=False, check=False)
     else:
         print_color(YELLOW, f"Unknown environment: {environment}. Checking basic resources...")
-        run_command(f"kubectl get deployments,services -l \"app.kubernetes.io/instance={full_app_name}\" -o wide", 
-                   capture_output=False, check=False)
+    print_live_resources(namespace, full_app_name, kinds, cache)
+    latency_history.record(app_name, environment, "verify", time.monotonic() - started)
 
-def main():
+def load_change_manifest(path):
+    """Load a YAML or JSON change manifest and group its edits per Application"""
+    with open(path, 'r') as f:
+        content = f.read()
+    if path.endswith('.json'):
+        entries = json.loads(content)
+    elif HAS_YAML:
+        entries = yaml.safe_load(content)
+    else:
+        try:
+            entries = ValuesDocument(content).to_python()
+        except ValuesError as e:
+            raise ValueError(f"{e} (without PyYAML a YAML manifest must be a mapping with a 'changes' list)")
+    if isinstance(entries, dict):
+        entries = entries.get("changes")
+    if not isinstance(entries, list):
+        raise ValueError("Manifest must be a list of changes (or a mapping with a 'changes' list)")
+    
+    # Group edits per (app, environment), keeping the last value for a repeated key
+    groups = {}
+    for index, entry in enumerate(entries):
+        missing = [field for field in ("app", "environment", "key", "value") if field not in (entry or {})]
+        if missing:
+            raise ValueError(f"Change #{index + 1} is missing: {', '.join(missing)}")
+        if entry["environment"] not in ENVIRONMENTS:
+            raise ValueError(f"Change #{index + 1} has invalid environment: {entry['environment']}")
+        changes = groups.setdefault((str(entry["app"]), entry["environment"]), {})
+        changes[str(entry["key"])] = entry["value"]
+    return {target: list(changes.items()) for target, changes in groups.items()}
+
+def run_batch(groups, timeout=150, workers=16, store=None, schema_path=None):
+    """Apply grouped changes: one values rewrite and one minimal patch per app, then a single wait"""
+    full_app_names = [f"{app}-{env}" for app, env in groups]
+    apps = check_prerequisites(full_app_names)
+    groups = validate_changes(groups, apps, schema_path)
+    get_argocd_password()
+    snapshots = take_snapshots(apps, groups, store) if store is not None else {}
+    
+    # Rewrite each values file once
+    print_color(YELLOW, f"Applying {sum(len(c) for c in groups.values())} change(s) to {len(groups)} application(s)...")
+    old_values = {}
+    parameters = {}
+    for (app, env), changes in groups.items():
+        current_values, values = modify_helm_values(app, env, changes, show=False)
+        old_values[(app, env)] = current_values
+        parameters[f"{app}-{env}"] = helm_parameters(values)
+    
+    # Send one JSON patch per application with only its changed parameters, in parallel
+    def send(name):
+        try:
+            with span("patch", app=name):
+                return name, apply_parameters(get_client(), name, parameters[name], app=apps[name]), None
+        except (ApiError, OSError, ValueError) as e:
+            return name, None, e
+    
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        outcomes = list(executor.map(send, full_app_names))
+    failed = [(name, error) for name, _, error in outcomes if error]
+    for name, error in failed:
+        print_color(RED, f"Failed to update application {name}: {error}")
+    patched = [name for name, changed, _ in outcomes if changed]
+    unchanged = [name for name, changed, error in outcomes if not changed and not error]
+    print_color(GREEN, f"Updated {len(patched)} application(s); {len(unchanged)} already up to date.")
+    # Nothing to restore for applications that did not change
+    for name in unchanged:
+        if name in snapshots:
+            store.discard(snapshots.pop(name))
+    if snapshots:
+        print_color(YELLOW, f"Saved {len(snapshots)} snapshot(s); undo with ./restore-snapshot.py <application>")
+    
+    # Wait for every refreshed application at once
+    success = not failed
+    if patched and not wait_for_sync(patched, timeout, show_progress=len(patched) == 1):
+        success = False
+    
+    # Verify from one list per kind instead of one per application and kind
+    verified = [(app, env) for app, env in groups if f"{app}-{env}" in patched or f"{app}-{env}" in unchanged]
+    cache = None
+    if len(verified) > 1:
+        try:
+            with span("verify"):
+                cache = live_resource_cache({env for _, env in verified})
+        except (ApiError, OSError, ValueError) as e:
+            print_color(YELLOW, f"Failed to list live resources ({e}); listing them per application.")
+    for app, env in verified:
+        verify_changes(app, env, cache)
+    
+    # Print summary
+    print()
+    print_color(GREEN if success else RED, f"Batch modification completed for {len(groups)} application(s).")
+    for (app, env), changes in groups.items():
+        for key, value in changes:
+            print_color(YELLOW, f"{app}-{env}: {key}: {old_values[(app, env)][key]} -> {value}")
+    
+    return 0 if success else 1
+
+def main(argv=None):
     """Main function"""
     parser = argparse.ArgumentParser(description='Modify and test Helm charts with ArgoCD')
-    parser.add_argument('app_name', help='Application name (e.g., app1)')
-    parser.add_argument('environment', help='Environment (dev, staging, production)')
-    parser.add_argument('key', help='Helm value key to modify')
-    parser.add_argument('value', help='New value for the key')
+    parser.add_argument('app_name', nargs='?', help='Application name (e.g., app1)')
+    parser.add_argument('environment', nargs='?', help='Environment (dev, staging, production)')
+    parser.add_argument('key', nargs='?', help='Helm value key to modify')
+    parser.add_argument('value', nargs='?', help='New value for the key')
+    parser.add_argument('--batch', metavar='MANIFEST', help='YAML/JSON list of {app, environment, key, value} changes')
+    parser.add_argument('--timeout', type=int, default=150, help='Seconds to wait for sync and health')
+    parser.add_argument('--workers', type=int, default=16, help='Number of applications patched in parallel (batch mode)')
+    parser.add_argument('--no-snapshot', action='store_true', help='Do not save a snapshot to restore the previous values from')
+    parser.add_argument('--schema', metavar='FILE', help='Values schema (JSON) to check the edits against '
+                                                         '(default: schemas/<chart>-values.schema.json, if any)')
+    
+    args = parser.parse_args(argv)
+    store = None if args.no_snapshot else SnapshotStore()
+    
+    # Batch mode
+    if args.batch:
+        if args.app_name:
+            parser.error("positional arguments cannot be combined with --batch")
+        try:
+            groups = load_change_manifest(args.batch)
+        except (OSError, ValueError) as e:
+            print_color(RED, f"Invalid change manifest: {e}")
+            sys.exit(1)
+        return run_batch(groups, args.timeout, args.workers, store, args.schema)
     
-    args = parser.parse_args()
+    if not args.value:
+        parser.error("app_name, environment, key and value are required unless --batch is used")
     
     # Validate environment
-    if args.environment not in ['dev', 'staging', 'production']:
+    if args.environment not in ENVIRONMENTS:
         print_color(RED, "Invalid environment. Must be one of: dev, staging, production")
         sys.exit(1)
     
+    full_app_name = f"{args.app_name}-{args.environment}"
+    
     # Check prerequisites
-    check_prerequisites(args.app_name, args.environment)
+    apps = check_prerequisites([full_app_name])
+    
+    # Check the edit against the chart's values schema before anything is written
+    # The value is read like YAML, so '3' is a number and 'true' a boolean, unless the schema says otherwise
+    changes = validate_changes({(args.app_name, args.environment): [(args.key, args.value)]}, apps, args.schema,
+                               raw=True)[(args.app_name, args.environment)]
     
     # Get ArgoCD password
     get_argocd_password()
     
-    # Modify Helm values
-    current_value, values_file = modify_helm_values(args.app_name, args.environment, args.key, args.value)
+    # Record what is about to be overwritten
+    snapshot = None
+    if store is not None:
+        snapshot = take_snapshots(apps, [(args.app_name, args.environment)], store)[full_app_name]
     
-    # Update ArgoCD application
-    update_argocd_application(args.app_name, args.environment, args.key, args.value, values_file)
+    # Modify Helm values
+    current_values, values = modify_helm_values(args.app_name, args.environment, changes)
     
-    # Refresh and wait for sync
-    refresh_and_wait_for_sync(args.app_name, args.environment)
+    # Update only the changed parameters and refresh in the same patch
+    changed = update_argocd_application(args.app_name, args.environment, values, apps[full_app_name])
+    if changed is None:
+        sys.exit(1)
+    if snapshot is not None:
+        if changed:
+            print_color(YELLOW, f"Saved snapshot {snapshot['id']}; undo with ./restore-snapshot.py {full_app_name}")
+        else:
+            store.discard(snapshot)
+    
+    # Wait for sync and health
+    if not wait_for_sync([full_app_name], args.timeout):
+        sys.exit(1)
     
     # Verify changes
     verify_changes(args.app_name, args.environment)
     
     # Print summary
-    full_app_name = f"{args.app_name}-{args.environment}"
     print()
     print_color(GREEN, f"Modification and testing completed for {full_app_name}.")
     print_color(YELLOW, f"Key: {args.key}")
-    print_color(YELLOW, f"Old value: {current_value}")
+    print_color(YELLOW, f"Old value: {current_values[args.key]}")
     print_color(GREEN, f"New value: {args.value}")
     
     return 0
 
 if __name__ == "__main__":
-    sys.exit(main()) 
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
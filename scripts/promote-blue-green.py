@@ -3,13 +3,21 @@
 Blue-Green Deployment Promotion Script
 
 This script promotes the green deployment in a blue-green deployment setup.
-It scales up the green deployment, updates the services, and scales down the blue deployment.
+It scales up the green deployment, switches the services as soon as green's
+endpoints are ready, and drains the blue deployment as its endpoints go away.
+In fleet mode it promotes many applications in waves without prompting.
 """
 
-import subprocess
 import sys
 import time
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cluster_cache import ClusterCache
+from cutover import CutoverError, EndpointsWatcher, cutover, parse_waves, plan_waves
+from k8s_client import ApiError, KubeConfigError, get_client, resource_path
+from tracing import span
 
 # ANSI color codes
 GREEN = '\033[0;32m'
@@ -22,73 +30,228 @@ def print_color(color, message):
     """Print colored message"""
     print(f"{color}{message}{NC}")
 
-def run_command(command, capture_output=True, check=True):
-    """Run a shell command and return the output"""
-    try:
-        result = subprocess.run(
-            command,
-            shell=True,
-            check=check,
-            text=True,
-            stdout=subprocess.PIPE if capture_output else None,
-            stderr=subprocess.PIPE if capture_output else None
-        )
-        return result.stdout.strip() if capture_output else None
-    except subprocess.CalledProcessError as e:
-        if capture_output:
-            print_color(RED, f"Command failed: {command}")
-            print_color(RED, f"Error: {e.stderr}")
-        return None
+def confirm_promotion(app_name):
+    """Ask for manual verification of the green deployment"""
+    print_color(YELLOW, f">> Green deployment is now available for preview at {app_name}-bg-preview service.")
+    print_color(YELLOW, ">> Please verify the green deployment before proceeding.")
+    with span("manual confirmation"):
+        try:
+            input("Press Enter to continue with the promotion or Ctrl+C to abort...")
+        except EOFError:
+            print()
+            print_color(RED, "No input available to confirm the promotion; use --skip-confirmation to run unattended.")
+            return False
+    return True
 
-def promote_blue_green(app_name, namespace, replicas=3, skip_confirmation=False):
+def promote_blue_green(app_name, namespace, replicas=3, skip_confirmation=False, ready_threshold=None,
+                       timeout=600, cutover_timeout=120):
     """Promote the green deployment in a blue-green setup"""
     print_color(BLUE, f"===== Promoting Green Deployment for {app_name} in {namespace} =====")
     
-    # Scale up the green deployment
-    print_color(YELLOW, ">> Scaling up the green deployment...")
-    run_command(f"kubectl scale deployment {app_name}-green -n {namespace} --replicas={replicas}", capture_output=False)
+    client = get_client()
+    watcher = EndpointsWatcher(client, namespace).start()
+    try:
+        timings = cutover(
+            client, watcher, app_name, namespace, replicas=replicas, ready_threshold=ready_threshold,
+            ready_timeout=timeout, cutover_timeout=cutover_timeout,
+            confirm=None if skip_confirmation else lambda: confirm_promotion(app_name),
+            log=lambda message: print_color(YELLOW, f">> {message}")
+        )
+    except CutoverError as e:
+        print_color(RED, str(e))
+        return False
+    finally:
+        watcher.stop()
     
-    # Wait for the green deployment to be ready
-    print_color(YELLOW, ">> Waiting for the green deployment to be ready...")
-    run_command(f"kubectl rollout status deployment {app_name}-green -n {namespace}", capture_output=False)
+    if timings["skipped"]:
+        print_color(GREEN, f"✅ {app_name}-bg-active already serves the green deployment.")
+        return True
     
-    # Update the preview service to point to the green deployment
-    print_color(YELLOW, ">> Updating the preview service to point to the green deployment...")
-    run_command(f"kubectl patch service {app_name}-bg-preview -n {namespace} -p '{{\"spec\":{{\"selector\":{{\"version\":\"green\"}}}}}}'", capture_output=False)
+    print_color(GREEN, "✅ Green deployment promoted successfully!")
+    print_color(YELLOW, f"Green ready after {timings['green_ready']:.2f}s, traffic switched in "
+                        f"{timings['cutover']:.2f}s, blue drained in {timings['drain']:.2f}s "
+                        f"(total {timings['total']:.2f}s).")
+    return True
+
+def fleet_cache(namespace):
+    """Watched services and deployments of a namespace, shared by every cutover in it"""
+    return ClusterCache(get_client(), ["services", "deployments"], namespace).start()
+
+def discover_blue_green_apps(namespace, cache=None):
+    """Names of the applications in a namespace that have a <app>-bg-active service"""
+    if cache is not None:
+        services = cache.by_namespace("services", namespace)
+    else:
+        services = get_client().list(resource_path("services", namespace))["items"]
+    return sorted(svc["metadata"]["name"][:-len("-bg-active")] for svc in services
+                  if svc["metadata"]["name"].endswith("-bg-active"))
+
+def parse_fleet(apps, apps_file, namespace):
+    """(app, namespace) pairs from --apps and --apps-file; entries may be written as namespace/app"""
+    entries = [entry.strip() for entry in (apps or "").split(",")]
+    if apps_file:
+        with open(apps_file) as f:
+            entries += [line.split("#", 1)[0].strip() for line in f]
+    fleet = []
+    for entry in filter(None, entries):
+        entry_namespace, _, app_name = entry.rpartition("/")
+        if not (entry_namespace or namespace):
+            raise ValueError(f"no namespace for '{entry}': use namespace/app or --namespace")
+        if (app_name, entry_namespace or namespace) not in fleet:
+            fleet.append((app_name, entry_namespace or namespace))
+    return fleet
+
+def promote_fleet(fleet, waves, concurrency, replicas=3, ready_threshold=None, timeout=600, cutover_timeout=120,
+                  wave_interval=0, caches=None):
+    """
+    Promote (app, namespace) pairs wave by wave; stops at the first failed gate.
     
-    # Wait for manual verification
-    if not skip_confirmation:
-        print_color(YELLOW, f">> Green deployment is now available for preview at {app_name}-bg-preview service.")
-        print_color(YELLOW, ">> Please verify the green deployment before proceeding.")
-        input("Press Enter to continue with the promotion or Ctrl+C to abort...")
+    Every namespace gets one Endpoints watch and one cache of its services
+    and deployments (caches may already hold some), so a cutover reads
+    nothing from the API server before it starts changing objects.
+    """
+    plan = plan_waves(fleet, waves)
+    print_color(BLUE, f"===== Promoting {len(fleet)} Blue-Green Application(s) in {len(plan)} Wave(s) =====")
     
-    # Update the active service to point to the green deployment
-    print_color(YELLOW, ">> Updating the active service to point to the green deployment...")
-    run_command(f"kubectl patch service {app_name}-bg-active -n {namespace} -p '{{\"spec\":{{\"selector\":{{\"version\":\"green\"}}}}}}'", capture_output=False)
+    client = get_client()
+    watchers = {}
+    caches = dict(caches or {})
+    stop = threading.Event()
+    failures = []
+    promoted = 0
+    start = time.monotonic()
     
-    # Wait a bit to allow traffic to shift
-    print_color(YELLOW, ">> Waiting for traffic to shift to the green deployment...")
-    time.sleep(5)
+    def promote(app_name, namespace):
+        if stop.is_set():
+            return None
+        try:
+            return cutover(client, watchers[namespace], app_name, namespace, replicas=replicas,
+                           ready_threshold=ready_threshold, ready_timeout=timeout, cutover_timeout=cutover_timeout,
+                           cache=caches[namespace])
+        except (CutoverError, ApiError, OSError):
+            stop.set()
+            raise
     
-    # Scale down the blue deployment
-    print_color(YELLOW, ">> Scaling down the blue deployment...")
-    run_command(f"kubectl scale deployment {app_name}-blue -n {namespace} --replicas=0", capture_output=False)
+    try:
+        for namespace in sorted({namespace for _, namespace in fleet}):
+            watchers[namespace] = EndpointsWatcher(client, namespace).start()
+            if namespace not in caches:
+                caches[namespace] = fleet_cache(namespace)
+        for number, wave in enumerate(plan, 1):
+            workers = concurrency[min(number, len(concurrency)) - 1]
+            print_color(BLUE, f"--- Wave {number}/{len(plan)}: {len(wave)} application(s), {workers} at a time ---")
+            wave_start = time.monotonic()
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                futures = {executor.submit(promote, app_name, namespace): (app_name, namespace)
+                           for app_name, namespace in wave}
+                for future in as_completed(futures):
+                    app_name, namespace = futures[future]
+                    try:
+                        timings = future.result()
+                    except (CutoverError, ApiError, OSError) as e:
+                        failures.append((app_name, namespace, e))
+                        print_color(RED, f"❌ {namespace}/{app_name}: {e}")
+                        continue
+                    if timings is None:
+                        continue
+                    promoted += 1
+                    if timings["skipped"]:
+                        print_color(YELLOW, f"⏭  {namespace}/{app_name}: already serving green")
+                        continue
+                    print_color(GREEN, f"✅ {namespace}/{app_name}: green ready {timings['green_ready']:.2f}s, "
+                                       f"cutover {timings['cutover']:.2f}s, drain {timings['drain']:.2f}s")
+            if failures:
+                print_color(RED, f"Wave {number} failed; stopping the rollout.")
+                break
+            print_color(GREEN, f"Wave {number} promoted in {time.monotonic() - wave_start:.2f}s.")
+            if wave_interval and number < len(plan):
+                time.sleep(wave_interval)
+    finally:
+        for watcher in list(watchers.values()) + list(caches.values()):
+            watcher.stop()
     
-    print_color(GREEN, "✅ Green deployment promoted successfully!")
+    print()
+    summary = (f"Promoted {promoted} of {len(fleet)} application(s) in {time.monotonic() - start:.2f}s; "
+               f"{len(failures)} failed, {len(fleet) - promoted - len(failures)} not started.")
+    print_color(RED if failures else GREEN, summary)
+    return not failures
 
-def main():
+def main(argv=None):
     """Main function"""
     parser = argparse.ArgumentParser(description='Promote a blue-green deployment')
-    parser.add_argument('app_name', help='Application name (e.g., app1)')
-    parser.add_argument('namespace', help='Namespace (e.g., production)')
+    parser.add_argument('app_name', nargs='?', help='Application name (e.g., app1)')
+    parser.add_argument('namespace', nargs='?', help='Namespace (e.g., production)')
     parser.add_argument('--replicas', type=int, default=3, help='Number of replicas for the green deployment')
     parser.add_argument('--skip-confirmation', action='store_true', help='Skip confirmation prompt')
+    parser.add_argument('--ready-threshold', type=int, help='Ready green endpoints required before switching traffic (default: replicas)')
+    parser.add_argument('--timeout', type=int, default=600, help='Seconds to wait for green to become ready')
+    parser.add_argument('--cutover-timeout', type=int, default=120, help='Seconds to wait for traffic to move and blue to drain')
+    parser.add_argument('--apps', help='Fleet mode: comma-separated applications, each optionally as namespace/app')
+    parser.add_argument('--apps-file', help='Fleet mode: file with one application (or namespace/app) per line')
+    parser.add_argument('--all', action='store_true', help='Fleet mode: every application with a <app>-bg-active service in --namespace')
+    parser.add_argument('-n', '--namespace', dest='fleet_namespace', help='Namespace of fleet applications given without one')
+    parser.add_argument('--waves', default='5,25,100', help='Cumulative percentages of the fleet promoted per wave (default: 5,25,100)')
+    parser.add_argument('--concurrency', default='4', help='Applications promoted at a time, one value or one per wave (e.g. 1,5,20)')
+    parser.add_argument('--wave-interval', type=float, default=0, help='Seconds to wait between waves')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    fleet_mode = bool(args.apps or args.apps_file or args.all)
+    if fleet_mode and args.app_name:
+        parser.error("positional arguments cannot be combined with --apps, --apps-file or --all")
+    if not fleet_mode and not args.namespace:
+        parser.error("app_name and namespace are required unless --apps, --apps-file or --all is used")
+    if args.all and not args.fleet_namespace:
+        parser.error("--all requires --namespace")
+    if fleet_mode:
+        try:
+            waves = parse_waves(args.waves)
+            concurrency = [int(value) for value in args.concurrency.split(",") if value.strip()]
+        except ValueError as e:
+            parser.error(str(e))
     
-    promote_blue_green(args.app_name, args.namespace, args.replicas, args.skip_confirmation)
+    try:
+        get_client()
+    except KubeConfigError as e:
+        print_color(RED, f"Cannot connect to Kubernetes: {e}")
+        return 1
+    
+    # Fleet mode: promote in waves, no confirmation prompt
+    if fleet_mode:
+        caches = {}
+        try:
+            fleet = parse_fleet(args.apps, args.apps_file, args.fleet_namespace)
+            if args.all:
+                # Discovery reads the cache the promotion then uses
+                caches[args.fleet_namespace] = fleet_cache(args.fleet_namespace)
+                fleet += [(app, args.fleet_namespace)
+                          for app in discover_blue_green_apps(args.fleet_namespace, caches[args.fleet_namespace])
+                          if (app, args.fleet_namespace) not in fleet]
+        except (ValueError, ApiError, OSError) as e:
+            print_color(RED, f"Invalid fleet: {e}")
+            for cache in caches.values():
+                cache.stop()
+            return 1
+        if not fleet:
+            print_color(RED, "No applications to promote.")
+            for cache in caches.values():
+                cache.stop()
+            return 1
+        try:
+            promoted = promote_fleet(fleet, waves, concurrency or [4], args.replicas, args.ready_threshold,
+                                     args.timeout, args.cutover_timeout, args.wave_interval, caches)
+        except (ApiError, OSError) as e:
+            print_color(RED, f"Promotion failed: {e}")
+            return 1
+        return 0 if promoted else 1
+    
+    try:
+        promoted = promote_blue_green(args.app_name, args.namespace, args.replicas, args.skip_confirmation,
+                                      args.ready_threshold, args.timeout, args.cutover_timeout)
+    except (ApiError, OSError) as e:
+        print_color(RED, f"Promotion failed: {e}")
+        return 1
     
-    return 0
+    return 0 if promoted else 1
 
 if __name__ == "__main__":
     sys.exit(main()) 
\ No newline at end of file
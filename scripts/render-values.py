@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Render Values Script
+
+This script shows, without a cluster, the Helm parameters each ArgoCD
+Application will get from the GitOps tree: the base template, the
+environment's Application file and its values file merged in that order
+(effective_values.py). It lines the environments of each app up side by
+side and highlights the parameters that differ between dev, staging and
+production. Results are cached by the content hash of their inputs, so
+only changed applications are rendered again.
+"""
+
+import sys
+import json
+import time
+import argparse
+
+from effective_values import RenderError, compare_environments, default_cache, discover, effective_values, find_root
+from tracing import span
+
+# ANSI color codes
+GREEN = '\033[0;32m'
+RED = '\033[0;31m'
+YELLOW = '\033[0;33m'
+BLUE = '\033[0;34m'
+NC = '\033[0m'  # No Color
+
+def print_color(color, message):
+    """Print colored message"""
+    print(f"{color}{message}{NC}")
+
+def parse_mappings(entries):
+    """{app: values name} from APP=VALUES arguments"""
+    mappings = {}
+    for entry in entries or []:
+        app, separator, values = entry.partition("=")
+        if not separator or not app or not values:
+            raise ValueError(f"invalid mapping '{entry}' (expected APP=VALUES, e.g. nginx=app1)")
+        mappings[app] = values
+    return mappings
+
+def print_comparison(comparison, drift_only=False):
+    """Print one table per app with a column per environment, drifting rows in yellow"""
+    for app, (environments, rows) in comparison.items():
+        shown = [row for row in rows if row[2] or not drift_only]
+        if not shown:
+            continue
+        print_color(BLUE, f"===== {app} ({', '.join(environments)}) =====")
+        table = [["PARAMETER"] + [environment.upper() for environment in environments]]
+        table += [[name] + ["-" if row[environment] is None else row[environment] for environment in environments]
+                  for name, row, _ in shown]
+        widths = [max(len(line[i]) for line in table) for i in range(len(table[0]))]
+        for index, line in enumerate(table):
+            text = "   ".join(value.ljust(width) for value, width in zip(line, widths)).rstrip()
+            print(f"{YELLOW}{text}{NC}" if index and shown[index - 1][2] else text)
+        print()
+
+def render_values(root, apps=None, environments=None, values_for=None, cache=None):
+    """Render the effective values of the selected apps; returns ({(app, env): result}, cache hits)"""
+    pairs = discover(root, values_for)
+    pairs = {key: inputs for key, inputs in pairs.items()
+             if (not apps or key[0] in apps) and (not environments or key[1] in environments)}
+    with span("render", applications=len(pairs)):
+        return effective_values(pairs, cache)
+
+def main(argv=None):
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Show the effective Helm parameters of each application and '
+                                                 'the drift between environments, without a cluster')
+    parser.add_argument('apps', nargs='*', help='Apps to render (e.g., nginx app1; default: all)')
+    parser.add_argument('--root', help='GitOps tree with base/ and environments/ (default: gitops-solution, '
+                                       'the working directory or the repository of this script)')
+    parser.add_argument('--environment', action='append', help='Only this environment (repeatable)')
+    parser.add_argument('--values-for', action='append', metavar='APP=VALUES',
+                        help='Merge helm-values/VALUES-values.yaml into APP (e.g., nginx=app1; repeatable)')
+    parser.add_argument('--drift', action='store_true',
+                        help='Only show the parameters that differ between environments')
+    parser.add_argument('--ignore', action='append', default=[], metavar='PARAMETER',
+                        help='Parameter expected to differ, e.g. replicaCount (repeatable)')
+    parser.add_argument('--fail-on-drift', action='store_true', help='Exit with 1 when a parameter drifts')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Render everything, without reading or writing the cache')
+    parser.add_argument('--output', choices=['table', 'json'], default='table', help='Output format')
+    
+    args = parser.parse_args(argv)
+    try:
+        values_for = parse_mappings(args.values_for)
+    except ValueError as e:
+        parser.error(str(e))
+    root = args.root or find_root()
+    if root is None:
+        print_color(RED, "Error: No GitOps tree found; pass --root.")
+        return 1
+    
+    started = time.monotonic()
+    try:
+        results, hits = render_values(root, args.apps, args.environment, values_for,
+                                      None if args.no_cache else default_cache())
+    except RenderError as e:
+        print_color(RED, f"Error: {e}")
+        return 1
+    elapsed = time.monotonic() - started
+    if not results:
+        print_color(RED, f"Error: No applications to render in {root}.")
+        return 1
+    
+    # Ignored parameters are shown but not counted as drift
+    ignored = set(args.ignore)
+    comparison = {app: (environments, [(name, row, drifting and name not in ignored) for name, row, drifting in rows])
+                  for app, (environments, rows) in compare_environments(results).items()}
+    drifted = {app: [name for name, _, drifting in rows if drifting] for app, (_, rows) in comparison.items()}
+    drifted = {app: names for app, names in drifted.items() if names}
+    
+    if args.output == "json":
+        print(json.dumps({
+            "applications": list(results.values()),
+            "drift": drifted,
+        }, indent=2))
+    else:
+        print_comparison(comparison, args.drift)
+        for result in results.values():
+            if result["unset"]:
+                print_color(RED, f"{result['application']}: no value for {', '.join(result['unset'])}")
+        if drifted:
+            total = sum(len(names) for names in drifted.values())
+            print_color(YELLOW, f"{total} parameter(s) differ between environments in {len(drifted)} app(s).")
+        else:
+            print_color(GREEN, "✅ No drift between environments.")
+    print(f"Rendered {len(results)} application(s) in {elapsed * 1000:.1f}ms ({hits} from cache).", file=sys.stderr)
+    
+    return 1 if drifted and args.fail_on_drift else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Restore Snapshot Script
+
+This script undoes a change made by modify-and-test-helm.py or
+validate-and-promote.py. Both save the Helm spec of the Application (and
+the values file they edit) before changing it. The restore writes the
+values file back and reapplies the saved Helm spec with a single patch
+that also triggers the sync, then reports the time to recover.
+"""
+
+import sys
+import time
+import argparse
+
+from app_waiter import DEGRADED, MISSING, READY, wait_for_applications
+from k8s_client import ApiError, KubeConfigError, get_client
+from snapshots import SnapshotStore, restore
+from tracing import span
+
+# ANSI color codes
+GREEN = '\033[0;32m'
+RED = '\033[0;31m'
+YELLOW = '\033[0;33m'
+BLUE = '\033[0;34m'
+NC = '\033[0m'  # No Color
+
+def print_color(color, message):
+    """Print colored message"""
+    print(f"{color}{message}{NC}")
+
+def describe(snapshot):
+    """One-line summary of the Helm parameters in a snapshot"""
+    parameters = (snapshot.get("helm") or {}).get("parameters") or []
+    if not parameters:
+        return "no Helm parameters"
+    text = ", ".join(f"{parameter.get('name')}={parameter.get('value')}" for parameter in parameters[:4])
+    return text + (f", ... ({len(parameters)} in total)" if len(parameters) > 4 else "")
+
+def print_snapshots(snapshots):
+    """Print snapshots as a table, newest last"""
+    if not snapshots:
+        print("No snapshots found.")
+        return
+    rows = [("APPLICATION", "ID", "OPERATION", "PARAMETERS")]
+    rows.extend((snapshot["application"], snapshot["id"], snapshot.get("operation", ""), describe(snapshot))
+                for snapshot in snapshots)
+    widths = [max(len(row[i]) for row in rows) for i in range(3)]
+    for row in rows:
+        print("   ".join(value.ljust(width) for value, width in zip(row[:3], widths)) + "   " + row[3])
+
+def restore_snapshot(app_name, snapshot_id=None, timeout=300, wait=True, store=None):
+    """Restore an application from a snapshot and wait until it is synced and healthy"""
+    store = store or SnapshotStore()
+    snapshot = store.get(app_name, snapshot_id) if snapshot_id else store.latest(app_name)
+    if snapshot is None:
+        which = f"snapshot {snapshot_id}" if snapshot_id else "snapshot"
+        print_color(RED, f"Error: No {which} of {app_name} in {store.directory}.")
+        return False
+    
+    print_color(BLUE, f"===== Restoring {app_name} from snapshot {snapshot['id']} =====")
+    print_color(YELLOW, f">> Saved by {snapshot.get('operation')} at {snapshot.get('createdAt')}: {describe(snapshot)}")
+    started = time.monotonic()
+    
+    # One patch that also requests the sync, then one values-file write
+    client = get_client()
+    with span("restore", app=app_name):
+        restore(client, snapshot, store)
+    patched = time.monotonic() - started
+    if snapshot.get("valuesFile"):
+        print_color(GREEN, f"Restored {snapshot['valuesFile']}.")
+    print_color(GREEN, f"Restored the Helm spec of {app_name} and requested a sync ({patched:.2f}s).")
+    if not wait:
+        return True
+    
+    print_color(YELLOW, f">> Waiting for {app_name} to be synced and healthy...")
+    with span("sync wait"):
+        result = wait_for_applications(client, [app_name], timeout=timeout)[app_name]
+    recovered = time.monotonic() - started
+    if result["outcome"] == READY:
+        print_color(GREEN, f"✅ {app_name} recovered in {recovered:.1f}s "
+                           f"(patch {patched:.2f}s, sync and health {recovered - patched:.1f}s).")
+        return True
+    if result["outcome"] == DEGRADED:
+        print_color(RED, f"Error: {app_name} is {result['health']} after the restore.")
+    elif result["outcome"] == MISSING:
+        print_color(RED, f"Error: {app_name} no longer exists in ArgoCD.")
+    else:
+        print_color(RED, f"Error: {app_name} did not become healthy within {timeout}s "
+                         f"(Sync: {result['sync']}, Health: {result['health']}).")
+    return False
+
+def main(argv=None):
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Restore an ArgoCD application from a pre-change snapshot')
+    parser.add_argument('app_name', nargs='?', help='Application name (e.g., app1-dev)')
+    parser.add_argument('snapshot_id', nargs='?', help='Snapshot to restore (default: the latest one)')
+    parser.add_argument('--list', action='store_true', help='List the snapshots (of app_name, or of every application)')
+    parser.add_argument('--timeout', type=int, default=300, help='Seconds to wait for sync and health')
+    parser.add_argument('--no-wait', action='store_true', help='Return once the patch is applied')
+    
+    args = parser.parse_args(argv)
+    store = SnapshotStore()
+    
+    if args.list:
+        try:
+            print_snapshots(store.list(args.app_name))
+        except (OSError, ValueError) as e:
+            print_color(RED, f"Cannot read snapshots from {store.directory}: {e}")
+            return 1
+        return 0
+    if not args.app_name:
+        parser.error("app_name is required unless --list is used")
+    
+    try:
+        restored = restore_snapshot(args.app_name, args.snapshot_id, args.timeout, not args.no_wait, store)
+    except KubeConfigError as e:
+        print_color(RED, f"Cannot connect to Kubernetes: {e}")
+        return 1
+    except (ApiError, OSError, ValueError) as e:
+        print_color(RED, f"Restore failed: {e}")
+        return 1
+    
+    return 0 if restored else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Rollback Script
+
+This script rolls an ArgoCD application back to an earlier entry of its
+deployment history. It talks to the ArgoCD API server directly through a
+cached session (argocd_session.py) instead of running argocd login and
+one argocd process per step, and waits for the application to become
+healthy from a single application stream.
+"""
+
+import sys
+import argparse
+
+from app_waiter import DEGRADED, READY
+from argocd_session import ArgoCDError, application_history, get_session
+from k8s_client import ApiError, KubeConfigError
+from tracing import span
+
+# ANSI color codes
+GREEN = '\033[0;32m'
+RED = '\033[0;31m'
+YELLOW = '\033[0;33m'
+BLUE = '\033[0;34m'
+NC = '\033[0m'  # No Color
+
+def print_color(color, message):
+    """Print colored message"""
+    print(f"{color}{message}{NC}")
+
+def print_history(history, current=None):
+    """Print the deployment history like argocd app history"""
+    rows = [("ID", "DATE", "REVISION", "")]
+    for entry in history:
+        rows.append((str(entry.get("id", "")), entry.get("deployedAt", ""), entry.get("revision", ""),
+                     "(current)" if entry.get("id") == current else ""))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("   ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+def ask_revision():
+    """Prompt for the history ID to roll back to; None without input"""
+    try:
+        return input("Enter the revision number to rollback to: ").strip() or None
+    except EOFError:
+        print()
+        return None
+
+def rollback(app_name, revision=None, timeout=300, prune=False):
+    """Roll an application back to a history ID and wait for it to be healthy"""
+    print_color(BLUE, f"===== Rolling Back {app_name} =====")
+    
+    session = get_session()
+    print_color(YELLOW, f">> Using the ArgoCD API at {session.server}...")
+    app = session.get_application(app_name)
+    if app is None:
+        print_color(RED, f"Error: Application {app_name} not found in ArgoCD.")
+        return False
+    
+    # The history comes with the application, no separate call
+    print_color(YELLOW, ">> Application history:")
+    history = application_history(app)
+    if not history:
+        print_color(RED, f"Error: {app_name} has no deployment history to roll back to.")
+        return False
+    print_history(history, history[-1].get("id"))
+    
+    if revision is None:
+        revision = ask_revision()
+    if revision is None:
+        print_color(RED, "Error: No revision given; pass it as the second argument to run unattended.")
+        return False
+    try:
+        history_id = int(revision)
+    except ValueError:
+        print_color(RED, f"Error: Invalid revision '{revision}': expected a history ID.")
+        return False
+    if history_id not in [entry.get("id") for entry in history]:
+        print_color(RED, f"Error: {app_name} has no history entry with ID {history_id}.")
+        return False
+    target = next(entry.get("source") for entry in history if entry.get("id") == history_id)
+    if target == history[-1].get("source"):
+        print_color(GREEN, f"✅ {app_name} is already at revision {history_id}.")
+        return True
+    
+    print_color(YELLOW, f">> Rolling back {app_name} to revision {history_id}...")
+    with span("rollback", app=app_name):
+        session.rollback(app_name, history_id, prune=prune)
+    
+    # Like argocd app wait --health: a rolled-back application is OutOfSync with Git by design.
+    # The rollback is deployed once it is the newest history entry.
+    print_color(YELLOW, f">> Waiting for {app_name} to be healthy...")
+    result = session.wait_for_application(
+        app_name, timeout, health_only=True,
+        until=lambda current: (application_history(current) or [{}])[-1].get("source") == target
+    )
+    if result["outcome"] == READY:
+        print_color(GREEN, f"✅ {app_name} has been rolled back to revision {history_id} "
+                           f"(healthy after {result['elapsed']:.1f}s).")
+        return True
+    if result["outcome"] == DEGRADED:
+        print_color(RED, f"Error: {app_name} is {result['health']} after the rollback.")
+    else:
+        print_color(RED, f"Error: {app_name} did not become healthy within {timeout}s "
+                         f"(Sync: {result['sync']}, Health: {result['health']}).")
+    return False
+
+def main(argv=None):
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Roll an ArgoCD application back to a previous revision')
+    parser.add_argument('app_name', help='Application name (e.g., nginx-dev)')
+    parser.add_argument('revision', nargs='?', help='History ID to roll back to (asked for when omitted)')
+    parser.add_argument('--timeout', type=int, default=300, help='Seconds to wait for the application to be healthy')
+    parser.add_argument('--prune', action='store_true', help='Delete resources that are not part of the revision')
+    
+    args = parser.parse_args(argv)
+    
+    try:
+        rolled_back = rollback(args.app_name, args.revision, args.timeout, args.prune)
+    except ArgoCDError as e:
+        print_color(RED, f"ArgoCD API error: {e}")
+        return 1
+    except (ApiError, KubeConfigError) as e:
+        print_color(RED, f"Rollback failed: {e}")
+        return 1
+    except OSError as e:
+        print_color(RED, f"Cannot reach the ArgoCD API at {get_session().server}: {e}")
+        print("Make sure port forwarding is running: kubectl port-forward svc/argocd-server -n argocd 8080:443")
+        return 1
+    
+    return 0 if rolled_back else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Application Snapshots
+
+Before a script changes the Helm parameters of an Application it records
+what it is about to overwrite: spec.source.helm, the values annotations
+and the content of the values file it edits. Each snapshot is one JSON file
+under $GITOPS_SNAPSHOT_DIR (default
+~/.local/state/gitops-argocd/snapshots/<application>/), and the newest KEEP
+snapshots of an application are kept.
+
+restore() puts a snapshot back without going through the ArgoCD history:
+the Application gets its previous Helm spec and a refresh in a single JSON
+patch, and once that succeeded the values file is rewritten. The state it replaces is saved
+as a "restore" snapshot first, so a restore can be undone the same way.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+from app_patch import VALUES_HASH_ANNOTATION, VALUES_PARAMETERS_ANNOTATION, pointer
+from k8s_client import ARGOCD_NAMESPACE, REFRESH_ANNOTATION, ApiError, resource_path
+
+SNAPSHOT_DIR_ENV = "GITOPS_SNAPSHOT_DIR"
+KEEP = 50
+RESTORE = "restore"
+
+
+def helm_spec(app):
+    """spec.source.helm of an Application, or None"""
+    return ((app.get("spec") or {}).get("source") or {}).get("helm")
+
+
+def _write_atomically(path, text, mode=None):
+    directory = os.path.dirname(path) or "."
+    fd, temporary = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        if mode is not None:
+            os.chmod(temporary, mode)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+class SnapshotStore:
+    """Pre-change snapshots of Applications, newest last"""
+
+    def __init__(self, directory=None, keep=KEEP):
+        self.directory = directory or os.environ.get(SNAPSHOT_DIR_ENV) or os.path.join(
+            os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"), "gitops-argocd", "snapshots")
+        self.keep = keep
+        self.lock = threading.Lock()
+        self._last_micros = None
+
+    def _application_directory(self, application):
+        if not application or "/" in application or application.startswith("."):
+            raise ValueError(f"Invalid application name: {application!r}")
+        return os.path.join(self.directory, application)
+
+    def _new_id(self):
+        # Sortable UTC timestamps, unique within this process
+        with self.lock:
+            micros = int(time.time() * 1e6)
+            if self._last_micros is not None and micros <= self._last_micros:
+                micros = self._last_micros + 1
+            self._last_micros = micros
+        seconds, fraction = divmod(micros, 1000000)
+        return time.strftime("%Y%m%dT%H%M%S", time.gmtime(seconds)) + f".{fraction:06d}Z"
+
+    def save(self, app, operation, values_file=None):
+        """
+        Record the live Application (and the values file, if the operation
+        edits one) before it is changed. Returns the snapshot.
+        """
+        metadata = app.get("metadata") or {}
+        snapshot = {
+            "id": self._new_id(),
+            "application": metadata["name"],
+            "namespace": metadata.get("namespace") or ARGOCD_NAMESPACE,
+            "operation": operation,
+            "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "resourceVersion": metadata.get("resourceVersion"),
+            "helm": helm_spec(app),
+            "valuesHash": (metadata.get("annotations") or {}).get(VALUES_HASH_ANNOTATION),
+            "valuesParameters": (metadata.get("annotations") or {}).get(VALUES_PARAMETERS_ANNOTATION),
+            "valuesFile": None,
+            "values": None,
+        }
+        if values_file is not None:
+            snapshot["valuesFile"] = os.path.abspath(values_file)
+            try:
+                with open(values_file, "r") as f:
+                    snapshot["values"] = f.read()
+            except FileNotFoundError:
+                pass
+        directory = self._application_directory(snapshot["application"])
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        _write_atomically(os.path.join(directory, f"{snapshot['id']}.json"), json.dumps(snapshot, indent=2))
+        self._prune(directory)
+        return snapshot
+
+    def discard(self, snapshot):
+        """Forget a snapshot, e.g. when the operation turned out to change nothing"""
+        try:
+            os.unlink(os.path.join(self._application_directory(snapshot["application"]), f"{snapshot['id']}.json"))
+        except FileNotFoundError:
+            pass
+
+    def _prune(self, directory):
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".json"))
+        for name in names[:max(0, len(names) - self.keep)]:
+            try:
+                os.unlink(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+    def _load(self, path):
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def list(self, application=None):
+        """Snapshots of one application (or of all of them), oldest first"""
+        if application is not None:
+            applications = [application]
+        else:
+            try:
+                applications = sorted(os.listdir(self.directory))
+            except FileNotFoundError:
+                return []
+        snapshots = []
+        for name in applications:
+            directory = self._application_directory(name)
+            try:
+                files = sorted(entry for entry in os.listdir(directory) if entry.endswith(".json"))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            snapshots.extend(self._load(os.path.join(directory, entry)) for entry in files)
+        return snapshots
+
+    def get(self, application, snapshot_id):
+        """One snapshot by ID, or None"""
+        try:
+            return self._load(os.path.join(self._application_directory(application), f"{snapshot_id}.json"))
+        except FileNotFoundError:
+            return None
+
+    def latest(self, application, include_restores=False):
+        """
+        The newest snapshot of an application, or None. Snapshots taken by a
+        restore are skipped unless include_restores, so restoring twice does
+        not flip back to the state the first restore replaced.
+        """
+        for snapshot in reversed(self.list(application)):
+            if include_restores or snapshot.get("operation") != RESTORE:
+                return snapshot
+        return None
+
+
+def restore_patch(app, snapshot):
+    """JSON patch that gives a live Application the Helm spec of a snapshot and refreshes it"""
+    metadata = app.get("metadata") or {}
+    if (app.get("spec") or {}).get("source") is None:
+        raise ValueError(f"Application {metadata.get('name')} has no spec.source (multi-source is not supported)")
+    operations = []
+    if snapshot.get("helm") is not None:
+        # add replaces an existing member, so this works whether or not helm is set
+        operations.append({"op": "add", "path": pointer("spec", "source", "helm"), "value": snapshot["helm"]})
+    elif helm_spec(app) is not None:
+        operations.append({"op": "remove", "path": pointer("spec", "source", "helm")})
+
+    annotations = metadata.get("annotations")
+    new_annotations = {REFRESH_ANNOTATION: "normal"}
+    if snapshot.get("valuesHash"):
+        new_annotations[VALUES_HASH_ANNOTATION] = snapshot["valuesHash"]
+    if snapshot.get("valuesParameters"):
+        new_annotations[VALUES_PARAMETERS_ANNOTATION] = snapshot["valuesParameters"]
+    if annotations is None:
+        operations.append({"op": "add", "path": pointer("metadata", "annotations"), "value": new_annotations})
+    else:
+        for key, value in new_annotations.items():
+            operations.append({"op": "add", "path": pointer("metadata", "annotations", key), "value": value})
+        # A stale hash would make the next edit of the same values look like a no-op
+        if not snapshot.get("valuesHash") and VALUES_HASH_ANNOTATION in annotations:
+            operations.append({"op": "remove", "path": pointer("metadata", "annotations", VALUES_HASH_ANNOTATION)})
+        # Parameters owned after the snapshot are not ours any more once its Helm spec is back
+        if not snapshot.get("valuesParameters") and VALUES_PARAMETERS_ANNOTATION in annotations:
+            operations.append({"op": "remove",
+                               "path": pointer("metadata", "annotations", VALUES_PARAMETERS_ANNOTATION)})
+    return operations
+
+
+def restore_values_file(snapshot):
+    """Write the values file of a snapshot back (or remove it if it did not exist); returns its path"""
+    path = snapshot.get("valuesFile")
+    if path is None:
+        return None
+    if snapshot.get("values") is None:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomically(path, snapshot["values"], mode=0o644)
+    return path
+
+
+def restore(client, snapshot, store=None, attempts=3):
+    """
+    Put a snapshot back: one JSON patch, then one values-file write.
+
+    With a store, the state being replaced is saved first as a "restore"
+    snapshot. Returns the Application as it was before the patch. The
+    values file is only written once the patch succeeded, so a failed
+    restore leaves both as they were. A patch that conflicts (409) is
+    rebuilt from a fresh GET and retried; restore_patch() has no test ops,
+    so any other rejection means the patch itself is invalid and is
+    raised at once.
+    """
+    path = resource_path("applications", snapshot.get("namespace") or ARGOCD_NAMESPACE, snapshot["application"])
+    app = client.get(path)
+    if store is not None:
+        store.save(app, RESTORE, snapshot.get("valuesFile"))
+    for attempt in range(attempts):
+        try:
+            client.patch(path, restore_patch(app, snapshot), patch_type="json")
+            break
+        except ApiError as e:
+            if e.status != 409 or attempt == attempts - 1:
+                raise
+            app = client.get(path)
+    restore_values_file(snapshot)
+    return app
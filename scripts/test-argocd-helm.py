@@ -6,12 +6,27 @@ This script tests Helm charts deployed with ArgoCD by checking application state
 and verifying resources in the appropriate namespaces.
 """
 
-import subprocess
 import sys
-import os
 import json
-import base64
 import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from app_waiter import MISSING, refresh_patch, wait_for_applications
+from argocd_session import admin_password, mask
+from change_detection import ChangeDetectionError, affected_applications, changed_files
+from cluster_cache import ClusterCache
+from k8s_client import (
+    ARGOCD_NAMESPACE, DEFAULT_RESOURCE_KINDS, ENVIRONMENT_RESOURCE_KINDS, INSTANCE_LABEL, ApiError,
+    KubeConfigError, application_resources, application_status, deployment_ready, get_application,
+    get_client, resource_path
+)
+from tracing import span, traced
+
+DEFAULT_APPLICATIONS = ["app1-dev", "app1-staging", "app1-production"]
+
+# Columns of the fleet result table
+RESULT_COLUMNS = ["name", "project", "namespace", "sync", "health", "resources", "deployments", "result", "error"]
 
 # ANSI color codes
 GREEN = '\033[0;32m'
@@ -23,71 +38,87 @@ def print_color(color, message):
     """Print colored message"""
     print(f"{color}{message}{NC}")
 
-def run_command(command, capture_output=True, check=True):
-    """Run a shell command and return the output"""
-    try:
-        result = subprocess.run(
-            command,
-            shell=True,
-            check=check,
-            text=True,
-            stdout=subprocess.PIPE if capture_output else None,
-            stderr=subprocess.PIPE if capture_output else None
-        )
-        return result.stdout.strip() if capture_output else None
-    except subprocess.CalledProcessError as e:
-        if capture_output:
-            print_color(RED, f"Command failed: {command}")
-            print_color(RED, f"Error: {e.stderr}")
-        return None
-
+@traced("prerequisites")
 def check_prerequisites():
-    """Check if kubectl and ArgoCD are installed"""
-    # Check if kubectl is installed
-    if run_command("which kubectl", check=False) is None:
-        print_color(RED, "kubectl is not installed. Please install it first.")
+    """Check if the cluster is reachable and ArgoCD is installed"""
+    # Check if the cluster connection settings can be loaded
+    try:
+        client = get_client()
+    except KubeConfigError as e:
+        print_color(RED, f"Cannot connect to Kubernetes: {e}")
         sys.exit(1)
     
     # Check if ArgoCD is installed
-    if run_command("kubectl get namespace argocd", check=False) is None:
+    try:
+        namespace = client.get_cached(resource_path("namespaces", name=ARGOCD_NAMESPACE))
+    except (ApiError, OSError) as e:
+        print_color(RED, f"Failed to query the Kubernetes API: {e}")
+        sys.exit(1)
+    if namespace is None:
         print_color(RED, "ArgoCD namespace not found. Please install ArgoCD first.")
         sys.exit(1)
 
+@traced("password fetch")
 def get_argocd_password():
     """Get ArgoCD admin password"""
     print_color(YELLOW, "Getting ArgoCD admin password...")
-    password_base64 = run_command(
-        "kubectl -n argocd get secret argocd-initial-admin-secret -o jsonpath=\"{.data.password}\""
-    )
-    if password_base64:
-        password = base64.b64decode(password_base64).decode('utf-8')
-        print_color(GREEN, f"ArgoCD admin password retrieved: {password}")
+    password = admin_password()
+    if password:
+        # Never echo the secret itself: logs and CI output outlive the terminal
+        print_color(GREEN, f"ArgoCD admin password retrieved: {mask(password)}")
         print_color(YELLOW, "To access ArgoCD UI, run:")
         print("kubectl port-forward svc/argocd-server -n argocd 8080:443")
-        print(f"Then access ArgoCD at https://localhost:8080 with username: admin, password: {password}")
+        print("Then access ArgoCD at https://localhost:8080 with username: admin and the password from:")
+        print("kubectl -n argocd get secret argocd-initial-admin-secret -o jsonpath='{.data.password}' | base64 -d")
         return password
     else:
         print_color(RED, "Failed to get ArgoCD admin password.")
         return None
 
-def test_application(app_name):
-    """Test an ArgoCD application"""
+def print_resources(resources):
+    """Print the managed resources of an application as a table"""
+    if not resources:
+        print("No resources found.")
+        return
+    rows = [("KIND", "NAME", "NAMESPACE", "SYNC", "HEALTH")]
+    for resource in resources:
+        rows.append((
+            resource.get("kind", ""),
+            resource.get("name", ""),
+            resource.get("namespace", ""),
+            resource.get("status", ""),
+            (resource.get("health") or {}).get("status", ""),
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("   ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+@traced("test application")
+def test_application(app_name, cache=None):
+    """Test an ArgoCD application (read from cache when one is given)"""
     # Extract environment from app name
     env = app_name.split('-')[-1]
     
     print()
     print_color(YELLOW, f"Testing application: {app_name}")
     
-    # Check if application exists
-    if run_command(f"kubectl get application {app_name} -n argocd", check=False) is None:
+    # Fetch the whole application once; sync, health and resources are read from it
+    try:
+        if cache is not None:
+            app = cache.get("applications", ARGOCD_NAMESPACE, app_name)
+        else:
+            app = get_application(get_client(), app_name)
+    except (ApiError, OSError) as e:
+        print_color(RED, f"Failed to get application {app_name}: {e}")
+        return False
+    if app is None:
         print_color(RED, f"Application {app_name} does not exist in ArgoCD.")
         return False
     
+    sync_status, health_status = application_status(app)
+    
     # Check application status
     print_color(YELLOW, "Checking application status...")
-    sync_status = run_command(
-        f"kubectl get application {app_name} -n argocd -o jsonpath=\"{{.status.sync.status}}\""
-    )
     if sync_status:
         print_color(GREEN, f"Sync Status: {sync_status}")
     else:
@@ -96,9 +127,6 @@ def test_application(app_name):
     
     # Check health status
     print_color(YELLOW, "Checking health status...")
-    health_status = run_command(
-        f"kubectl get application {app_name} -n argocd -o jsonpath=\"{{.status.health.status}}\""
-    )
     if health_status:
         print_color(GREEN, f"Health Status: {health_status}")
     else:
@@ -108,34 +136,239 @@ def test_application(app_name):
     # Check Kubernetes resources based on environment
     print_color(YELLOW, "Checking Kubernetes resources...")
     
-    resource_commands = {
-        'dev': f"kubectl get deployments,services,configmaps -n dev -l \"app.kubernetes.io/instance={app_name}\" -o wide",
-        'staging': f"kubectl get deployments,services,configmaps,ingress -n staging -l \"app.kubernetes.io/instance={app_name}\" -o wide",
-        'production': f"kubectl get deployments,services,configmaps,ingress,hpa -n production -l \"app.kubernetes.io/instance={app_name}\" -o wide"
-    }
-    
-    if env in resource_commands:
+    if env in ENVIRONMENT_RESOURCE_KINDS:
         print_color(YELLOW, f"Checking {env} environment resources...")
-        run_command(resource_commands[env], capture_output=False, check=False)
+        print_resources(application_resources(app, ENVIRONMENT_RESOURCE_KINDS[env]))
     else:
         print_color(YELLOW, f"Unknown environment: {env}. Checking basic resources...")
-        run_command(f"kubectl get deployments,services -l \"app.kubernetes.io/instance={app_name}\" -o wide", 
-                   capture_output=False, check=False)
+        print_resources(application_resources(app, DEFAULT_RESOURCE_KINDS))
     
     print_color(GREEN, f"Test completed for {app_name}")
     return True
 
-def main():
+@traced("discover applications")
+def discover_applications(selector=None, project=None):
+    """List all Applications in the ArgoCD namespace with a single call"""
+    apps = get_client().list(resource_path("applications", ARGOCD_NAMESPACE), label_selector=selector)["items"]
+    if project:
+        apps = [app for app in apps if (app.get("spec") or {}).get("project") == project]
+    return apps
+
+@traced("evaluate application")
+def evaluate_application(app, cache=None):
+    """
+    Test a discovered Application object and return a result row.
+    
+    With a cache holding the readiness of every Deployment, the live
+    workloads are looked up locally instead of listed per application.
+    """
+    name = app["metadata"]["name"]
+    namespace = ((app.get("spec") or {}).get("destination") or {}).get("namespace") or name.split('-')[-1]
+    sync_status, health_status = application_status(app)
+    kinds = ENVIRONMENT_RESOURCE_KINDS.get(namespace, DEFAULT_RESOURCE_KINDS)
+    result = {
+        "name": name,
+        "project": (app.get("spec") or {}).get("project", ""),
+        "namespace": namespace,
+        "sync": sync_status or "",
+        "health": health_status or "",
+        "resources": len(application_resources(app, kinds)),
+        "deployments": "",
+        "result": "fail",
+        "error": "",
+    }
+    
+    # Confirm the live workloads are ready, not just what the Application reports
+    # (counted while the pages stream in; the deployment objects are not kept)
+    ready = total = 0
+    try:
+        if cache is not None:
+            states = cache.by_instance("deployments", namespace, name)
+            ready, total = sum(states), len(states)
+        else:
+            for deployment in get_client().iter_list(
+                    resource_path("deployments", namespace), label_selector=f"{INSTANCE_LABEL}={name}"):
+                total += 1
+                ready += deployment_ready(deployment)
+    except (ApiError, OSError, ValueError) as e:
+        result["error"] = f"failed to list deployments: {e}"
+        return result
+    result["deployments"] = f"{ready}/{total}"
+    
+    if sync_status != "Synced":
+        result["error"] = "not synced"
+    elif health_status != "Healthy":
+        result["error"] = "not healthy"
+    elif ready != total:
+        result["error"] = "deployments not ready"
+    else:
+        result["result"] = "pass"
+    return result
+
+def missing_result(name):
+    """Failing result row for an Application that no longer exists"""
+    return {
+        "name": name,
+        "project": "",
+        "namespace": name.split('-')[-1],
+        "sync": "",
+        "health": "",
+        "resources": 0,
+        "deployments": "",
+        "result": MISSING,
+        "error": "application not found",
+    }
+
+def print_results(results, output):
+    """Print the fleet result table as text, TSV or JSON"""
+    if output == "json":
+        print(json.dumps(results, indent=2))
+        return
+    rows = [[column.upper() for column in RESULT_COLUMNS]]
+    rows += [[str(result[column]) for column in RESULT_COLUMNS] for result in results]
+    if output == "tsv":
+        for row in rows:
+            print("\t".join(row))
+        return
+    widths = [max(len(row[i]) for row in rows) for i in range(len(RESULT_COLUMNS))]
+    for row in rows:
+        print("   ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+@traced("change detection")
+def select_changed(apps, revision_range=None):
+    """
+    The discovered Applications affected by the changes in the working tree
+    (or in revision_range), or all of them when git cannot tell.
+    """
+    try:
+        paths = changed_files(revision_range)
+    except ChangeDetectionError as e:
+        print(f"{YELLOW}Cannot detect changes ({e}); testing every application.{NC}", file=sys.stderr)
+        return apps
+    affected = affected_applications(paths, apps)
+    names = set()
+    for path, path_names in affected.items():
+        names.update(path_names)
+        print(f"{path}: {', '.join(path_names) or 'no application'}", file=sys.stderr)
+    print(f"{YELLOW}{len(paths)} changed file(s) affect {len(names)} of {len(apps)} application(s).{NC}",
+          file=sys.stderr)
+    return [app for app in apps if app["metadata"]["name"] in names]
+
+@traced("sync wait")
+def refresh_and_wait(apps, workers=16, timeout=150):
+    """
+    Ask ArgoCD to refresh the applications (one merge patch each, in
+    parallel) and wait for them from one watch. Returns the Application
+    objects as they are afterwards and the names of the applications that
+    were deleted in the meantime.
+    """
+    client = get_client()
+    names = [app["metadata"]["name"] for app in apps]
+    
+    def refresh(name):
+        with span("patch", app=name):
+            try:
+                client.patch(resource_path("applications", ARGOCD_NAMESPACE, name), refresh_patch(automated=False))
+            except ApiError as e:
+                if e.status != 404:
+                    raise
+                return False
+            return True
+    
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        found = list(executor.map(refresh, names))
+    missing = [name for name, exists in zip(names, found) if not exists]
+    names = [name for name, exists in zip(names, found) if exists]
+    results = wait_for_applications(client, names, timeout=timeout) if names else {}
+    missing += [name for name in names if results[name]["app"] is None]
+    # Evaluate the settled objects the watch delivered, not the ones listed before the refresh
+    return [results[name]["app"] for name in names if results[name]["app"] is not None], missing
+
+def test_fleet(selector=None, project=None, workers=16, output="table", changed=None, timeout=150):
+    """
+    Discover Applications and test them concurrently.
+    
+    With changed (a git revision range, or "" for the working tree) only
+    the applications affected by the changes are refreshed, waited for and
+    tested.
+    """
+    start = time.monotonic()
+    try:
+        apps = discover_applications(selector, project)
+    except (ApiError, OSError) as e:
+        print_color(RED, f"Failed to list applications: {e}")
+        return False
+    missing = []
+    if changed is not None:
+        apps = select_changed(apps, changed or None)
+        try:
+            if apps:
+                apps, missing = refresh_and_wait(apps, workers, timeout)
+        except (ApiError, OSError) as e:
+            print_color(RED, f"Failed to refresh the changed applications: {e}")
+            return False
+    
+    # One cluster-wide Deployment list, reduced to readiness, instead of one list per application
+    cache = None
+    if len(apps) > 1:
+        try:
+            cache = ClusterCache(get_client(), ["deployments"], watch=False,
+                                 transforms={"deployments": deployment_ready}).start()
+        except (ApiError, OSError, ValueError) as e:
+            print_color(YELLOW, f"Failed to list deployments ({e}); listing them per application.")
+    
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(lambda app: evaluate_application(app, cache), apps))
+    # A changed application that was deleted fails the run rather than dropping out of it
+    results += [missing_result(name) for name in missing]
+    
+    print_results(results, output)
+    failed = sum(1 for result in results if result["result"] != "pass")
+    summary = f"Tested {len(results)} applications in {time.monotonic() - start:.2f}s: {len(results) - failed} passed, {failed} failed."
+    # Keep stdout machine-readable; the summary goes to stderr
+    print(f"{RED if failed else GREEN}{summary}{NC}", file=sys.stderr)
+    return failed == 0
+
+def main(argv=None):
     """Main function"""
+    parser = argparse.ArgumentParser(description='Test Helm charts deployed with ArgoCD')
+    parser.add_argument('applications', nargs='*', help=f'Applications to test (default: {" ".join(DEFAULT_APPLICATIONS)})')
+    parser.add_argument('--all', action='store_true', help='Discover and test every Application in the argocd namespace')
+    parser.add_argument('-l', '--selector', help='Label selector used to filter discovered Applications')
+    parser.add_argument('--project', help='Only test Applications in this ArgoCD project')
+    parser.add_argument('--workers', type=int, default=16, help='Number of Applications tested in parallel')
+    parser.add_argument('--output', choices=['table', 'tsv', 'json'], default='table', help='Fleet result format')
+    parser.add_argument('--changed', nargs='?', const='', metavar='RANGE',
+                        help='Only refresh, wait for and test the Applications affected by the changes in the working tree, '
+                             'or in a git revision range such as origin/main...HEAD')
+    parser.add_argument('--timeout', type=int, default=150, help='Seconds to wait for sync and health (with --changed)')
+    
+    args = parser.parse_args(argv)
+    if args.changed is not None and args.applications:
+        parser.error("applications cannot be combined with --changed")
+    
     check_prerequisites()
+    
+    # Fleet mode: discover with one list call and test concurrently
+    if args.all or args.selector or args.project or args.changed is not None:
+        return 0 if test_fleet(args.selector, args.project, args.workers, args.output, args.changed, args.timeout) else 1
+    
     get_argocd_password()
     
     # Test applications
-    applications = ["app1-dev", "app1-staging", "app1-production"]
+    applications = args.applications or DEFAULT_APPLICATIONS
     success = True
     
+    # Several applications are read from one list of the argocd namespace
+    cache = None
+    if len(applications) > 1:
+        try:
+            cache = ClusterCache(get_client(), ["applications"], ARGOCD_NAMESPACE, watch=False).start()
+        except (ApiError, OSError, ValueError) as e:
+            print_color(YELLOW, f"Failed to list applications ({e}); fetching them one by one.")
+    
     for app in applications:
-        if not test_application(app):
+        if not test_application(app, cache):
             success = False
     
     print()
@@ -144,4 +377,4 @@ def main():
     return 0 if success else 1
 
 if __name__ == "__main__":
-    sys.exit(main()) 
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
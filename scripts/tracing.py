@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Tracing and Metrics
+
+A small instrumentation layer shared by the Python scripts. Every external
+call (Kubernetes API requests, watches, kubectl/exec-plugin subprocesses)
+and every script phase (prerequisites, password fetch, values edit, patch,
+sync wait, cutover, verify, ...) is recorded as a span with its duration,
+status and payload size.
+
+Tracing is off unless one of these environment variables is set:
+
+  GITOPS_TRACE_FILE    write a JSON trace (Chrome trace event format, open it
+                       in chrome://tracing or https://ui.perfetto.dev)
+  GITOPS_METRICS_FILE  write OpenMetrics text: a duration histogram, call and
+                       error counters and payload bytes per span name
+  GITOPS_TRACE_SUMMARY print the time spent per span name to stderr on exit
+
+The files are written when the process exits. When tracing is off, span()
+returns a shared no-op context manager.
+"""
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+TRACE_FILE_ENV = "GITOPS_TRACE_FILE"
+METRICS_FILE_ENV = "GITOPS_METRICS_FILE"
+SUMMARY_ENV = "GITOPS_TRACE_SUMMARY"
+
+# Histogram buckets for span durations, in seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_START = time.perf_counter()
+
+
+class Span:
+    """One timed operation, used as a context manager; attributes are exported as trace args"""
+
+    __slots__ = ("name", "category", "start", "duration", "status", "attrs", "thread", "tracer")
+
+    def __init__(self, name, category, start, attrs, tracer=None):
+        self.name = name
+        self.category = category
+        self.start = start
+        self.duration = 0.0
+        self.status = "ok"
+        self.attrs = attrs
+        self.thread = threading.get_ident()
+        self.tracer = tracer
+
+    def set(self, **attrs):
+        """Attach attributes (e.g. response_bytes, exit_code, http_status) to the span"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None and not (exc_type is SystemExit and exc.code in (0, None)):
+            self.status = "error"
+            self.attrs.setdefault("error", exc_type.__name__)
+        self.tracer.add(self)
+        return False
+
+
+class _NoopSpan:
+    """Stand-in returned while tracing is off"""
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class Tracer:
+    """Collects finished spans and exports them"""
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_file = None
+        self.metrics_file = None
+        self.summary = False
+        self.spans = []
+        self.lock = threading.Lock()
+        self._exported = False
+
+    def configure(self, trace_file=None, metrics_file=None, summary=False):
+        """Turn tracing on for the given outputs and export them at exit"""
+        self.trace_file = trace_file
+        self.metrics_file = metrics_file
+        self.summary = summary
+        was_enabled = self.enabled
+        self.enabled = bool(trace_file or metrics_file or summary)
+        if self.enabled and not was_enabled:
+            atexit.register(self.export)
+
+    def span(self, name, category="phase", **attrs):
+        """Context manager that times the enclosed block as a span"""
+        if not self.enabled:
+            return _NOOP
+        return Span(name, category, 0.0, attrs, self)
+
+    def record(self, name, category, start, duration, status="ok", **attrs):
+        """Add a span measured by the caller (start is a time.perf_counter() value)"""
+        if not self.enabled:
+            return
+        current = Span(name, category, start, attrs)
+        current.duration = duration
+        current.status = status
+        self.add(current)
+
+    def add(self, finished):
+        with self.lock:
+            self.spans.append(finished)
+
+    # -- export ----------------------------------------------------------------
+
+    def export(self):
+        """Write the configured trace and metrics files"""
+        if self._exported or not self.enabled:
+            return
+        self._exported = True
+        end = time.perf_counter()
+        with self.lock:
+            spans = list(self.spans)
+        startup = _process_startup_seconds()
+        if startup is not None:
+            spans.insert(0, _finished("interpreter startup", "process", _START - startup, startup))
+        spans.insert(0, _finished("process", "process", _START - (startup or 0), end - _START + (startup or 0)))
+        try:
+            if self.trace_file:
+                with open(self.trace_file, "w") as f:
+                    json.dump(chrome_trace(spans), f)
+            if self.metrics_file:
+                with open(self.metrics_file, "w") as f:
+                    f.write(openmetrics(spans))
+        except OSError as e:
+            print(f"Failed to write trace output: {e}", file=sys.stderr)
+        if self.summary:
+            print_summary(spans, sys.stderr)
+
+
+def _finished(name, category, start, duration):
+    current = Span(name, category, start, {})
+    current.duration = duration
+    return current
+
+
+def _process_startup_seconds():
+    """Seconds between process creation and this module's import (Linux only)"""
+    try:
+        with open("/proc/self/stat") as f:
+            # The command name may contain spaces; fields after it are space separated
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, uptime - started - (time.perf_counter() - _START))
+
+
+def chrome_trace(spans):
+    """Spans as a Chrome trace event document"""
+    threads = {}
+    events = []
+    pid = os.getpid()
+    origin = min((span.start for span in spans), default=_START)
+    for span in spans:
+        tid = threads.setdefault(span.thread, len(threads) + 1)
+        args = dict(span.attrs, status=span.status)
+        events.append({
+            "name": span.name, "cat": span.category, "ph": "X", "pid": pid, "tid": tid,
+            "ts": round((span.start - origin) * 1e6, 1), "dur": round(span.duration * 1e6, 1), "args": args,
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms",
+            "otherData": {"command": " ".join(sys.argv)}}
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def openmetrics(spans):
+    """Spans aggregated per (category, name) as OpenMetrics text"""
+    groups = {}
+    for span in spans:
+        group = groups.setdefault((span.category, span.name), {"durations": [], "errors": 0, "bytes": 0})
+        group["durations"].append(span.duration)
+        group["errors"] += span.status != "ok"
+        group["bytes"] += int(span.attrs.get("request_bytes", 0)) + int(span.attrs.get("response_bytes", 0))
+
+    lines = [
+        "# TYPE gitops_span_duration_seconds histogram",
+        "# UNIT gitops_span_duration_seconds seconds",
+        "# HELP gitops_span_duration_seconds Duration of traced operations.",
+    ]
+    for (category, name), group in sorted(groups.items()):
+        labels = f'category="{_label(category)}",name="{_label(name)}"'
+        durations = sorted(group["durations"])
+        index = 0
+        for bound in DURATION_BUCKETS:
+            while index < len(durations) and durations[index] <= bound:
+                index += 1
+            lines.append(f'gitops_span_duration_seconds_bucket{{{labels},le="{float(bound)}"}} {index}')
+        lines.append(f'gitops_span_duration_seconds_bucket{{{labels},le="+Inf"}} {len(durations)}')
+        lines.append(f"gitops_span_duration_seconds_count{{{labels}}} {len(durations)}")
+        lines.append(f"gitops_span_duration_seconds_sum{{{labels}}} {sum(durations):.6f}")
+    lines += [
+        "# TYPE gitops_span_errors counter",
+        "# HELP gitops_span_errors Traced operations that failed.",
+    ]
+    for (category, name), group in sorted(groups.items()):
+        lines.append(f'gitops_span_errors_total{{category="{_label(category)}",name="{_label(name)}"}} '
+                     f'{group["errors"]}')
+    lines += [
+        "# TYPE gitops_payload_bytes counter",
+        "# UNIT gitops_payload_bytes bytes",
+        "# HELP gitops_payload_bytes Request plus response bytes of traced calls.",
+    ]
+    for (category, name), group in sorted(groups.items()):
+        if group["bytes"]:
+            lines.append(f'gitops_payload_bytes_total{{category="{_label(category)}",name="{_label(name)}"}} '
+                         f'{group["bytes"]}')
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def print_summary(spans, stream):
+    """Print total and call count per span name, slowest first"""
+    totals = {}
+    for span in spans:
+        total = totals.setdefault((span.category, span.name), [0.0, 0, 0])
+        total[0] += span.duration
+        total[1] += 1
+        total[2] += span.status != "ok"
+    rows = [("CATEGORY", "NAME", "CALLS", "ERRORS", "TOTAL (s)", "MEAN (ms)")]
+    for (category, name), (seconds, calls, errors) in sorted(totals.items(), key=lambda item: -item[1][0]):
+        rows.append((category, name, str(calls), str(errors), f"{seconds:.3f}", f"{seconds / calls * 1000:.1f}"))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("   ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip(), file=stream)
+
+
+tracer = Tracer()
+tracer.configure(os.environ.get(TRACE_FILE_ENV) or None, os.environ.get(METRICS_FILE_ENV) or None,
+                 os.environ.get(SUMMARY_ENV, "").lower() in ("1", "true", "yes"))
+
+span = tracer.span
+record = tracer.record
+
+
+def traced(name, category="phase"):
+    """Decorator that records every call of a function as a span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Validate and Promote Script
+
+This script validates an application in one environment and promotes its
+configuration to the next environment. Every object the validation needs
+(the source and target Applications, the source pods, services and
+endpoints) is fetched once, with all requests in flight at the same time.
+Every gate is evaluated on that snapshot and all failures are reported
+together. The promoted Helm parameters are applied to the target
+Application with a single patch that also triggers the sync.
+"""
+
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import latency_history
+from app_patch import apply_parameters
+from app_waiter import DEGRADED, MISSING, READY, wait_for_applications
+from k8s_client import (ARGOCD_NAMESPACE, INSTANCE_LABEL, ApiError, KubeConfigError, application_status,
+                        get_client, resource_path, resource_summary)
+from snapshots import SnapshotStore
+from tracing import span, traced
+
+# ANSI color codes
+GREEN = '\033[0;32m'
+RED = '\033[0;31m'
+YELLOW = '\033[0;33m'
+BLUE = '\033[0;34m'
+NC = '\033[0m'  # No Color
+
+DEFAULT_KEYS = ["replicaCount", "image.tag"]
+
+def print_color(color, message):
+    """Print colored message"""
+    print(f"{color}{message}{NC}")
+
+def target_application_name(app_name, source_env, target_env):
+    """Name of the target Application (nginx-dev -> nginx-staging)"""
+    if app_name.endswith(f"-{source_env}"):
+        return app_name[:-len(source_env)] + target_env
+    return app_name.replace(source_env, target_env, 1)
+
+def count_ready(items, kind):
+    """(ready, total) over streamed objects, using their structured summaries"""
+    ready = total = 0
+    for item in items:
+        summary = resource_summary(kind, item)
+        # Completed pods (e.g. hooks) do not serve traffic
+        if kind == "pods" and summary["status"] == "Succeeded":
+            continue
+        total += 1
+        ready += bool(summary["ready"])
+    return ready, total
+
+@traced("fetch")
+def fetch_snapshot(client, app_name, target_app_name, source_env):
+    """
+    Fetch what the gates and the promotion need, once and concurrently.
+    
+    Pods, services and endpoints are paged and reduced to (ready, total)
+    counts as they stream in, so large namespaces are never held in memory.
+    """
+    selector = f"{INSTANCE_LABEL}={app_name}"
+    
+    def counted(kind):
+        return lambda: count_ready(client.iter_list(resource_path(kind, source_env), label_selector=selector), kind)
+    
+    requests = {
+        "source": lambda: client.get_or_none(resource_path("applications", ARGOCD_NAMESPACE, app_name)),
+        "target": lambda: client.get_or_none(resource_path("applications", ARGOCD_NAMESPACE, target_app_name)),
+        "pods": counted("pods"),
+        "services": counted("services"),
+        "endpoints": counted("endpoints"),
+    }
+    with ThreadPoolExecutor(max_workers=len(requests)) as executor:
+        futures = {name: executor.submit(request) for name, request in requests.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+def gate_application(app):
+    """The application is Healthy and Synced"""
+    sync_status, health_status = application_status(app)
+    if health_status != "Healthy" or sync_status != "Synced":
+        return False, f"Health: {health_status}, Sync: {sync_status}"
+    return True, "Healthy and Synced"
+
+def gate_pods(counts):
+    """Every pod of the application is Ready"""
+    ready, total = counts
+    if not total or ready != total:
+        return False, f"Ready: {ready}/{total}"
+    return True, f"{ready}/{total} pods ready"
+
+def gate_services(counts):
+    """The application has a service"""
+    if not counts[1]:
+        return False, "no service found"
+    return True, f"{counts[1]} service(s)"
+
+def gate_endpoints(counts):
+    """The application's endpoints have ready addresses"""
+    if not counts[0]:
+        return False, "no endpoints with ready addresses"
+    return True, f"{counts[0]} of {counts[1]} endpoints with ready addresses"
+
+def validate(snapshot):
+    """Evaluate every gate on the snapshot; returns [(gate, passed, detail)]"""
+    gates = [
+        ("application", gate_application, snapshot["source"]),
+        ("pods", gate_pods, snapshot["pods"]),
+        ("services", gate_services, snapshot["services"]),
+        ("endpoints", gate_endpoints, snapshot["endpoints"]),
+    ]
+    return [(name,) + gate(data) for name, gate, data in gates]
+
+def promoted_parameters(app, keys=None):
+    """Helm parameters of the source Application to copy (all of them when keys is None)"""
+    live = ((((app.get("spec") or {}).get("source") or {}).get("helm") or {}).get("parameters")) or []
+    by_name = {parameter.get("name"): parameter for parameter in live}
+    if keys is None:
+        return [dict(parameter) for parameter in live], []
+    parameters = [dict(by_name[key]) for key in keys if key in by_name]
+    return parameters, [key for key in keys if key not in by_name]
+
+def promote(app_name, source_env, target_env, keys=None, timeout=300, store=None):
+    """
+    Validate the source application and promote its parameters to the
+    target. With a store, the target's Helm spec is saved before the patch.
+    """
+    target_app_name = target_application_name(app_name, source_env, target_env)
+    print_color(BLUE, f"===== Validating and Promoting {app_name} from {source_env} to {target_env} =====")
+    
+    client = get_client()
+    started = time.monotonic()
+    snapshot = fetch_snapshot(client, app_name, target_app_name, source_env)
+    for name, label in (("source", app_name), ("target", target_app_name)):
+        if snapshot[name] is None:
+            print_color(RED, f"Error: Application {label} not found in ArgoCD.")
+            return False
+    
+    # Validate source application health
+    print_color(YELLOW, f">> Validating {app_name} in {source_env} environment...")
+    with span("validation"):
+        results = validate(snapshot)
+    validated = all(passed for _, passed, _ in results)
+    latency_history.record_application(snapshot["source"], "validation", time.monotonic() - started,
+                                       "pass" if validated else "fail")
+    for gate, passed, detail in results:
+        print_color(GREEN if passed else RED, f"{'✅' if passed else '❌'} {gate}: {detail}")
+    if not validated:
+        print_color(RED, f"Error: Validation failed for {app_name} in {source_env}.")
+        return False
+    print_color(GREEN, f"✅ Validation passed for {app_name} in {source_env}!")
+    
+    # Promote the configuration in a single patch
+    parameters, missing = promoted_parameters(snapshot["source"], keys)
+    for key in missing:
+        print_color(YELLOW, f"Warning: {app_name} has no '{key}' parameter; not promoted.")
+    if not parameters:
+        print_color(RED, f"Error: {app_name} has no parameters to promote.")
+        return False
+    print_color(YELLOW, f">> Promoting configuration from {app_name} to {target_app_name}...")
+    for parameter in parameters:
+        print(f"{parameter['name']}: {parameter['value']}")
+    saved = None
+    if store is not None:
+        with span("snapshot", app=target_app_name):
+            saved = store.save(snapshot["target"], "validate-and-promote")
+    with span("patch", app=target_app_name):
+        changed = apply_parameters(client, target_app_name, parameters, app=snapshot["target"], complete=False)
+    if not changed:
+        if saved is not None:
+            store.discard(saved)
+        print_color(GREEN, f"✅ {target_app_name} already runs this configuration.")
+        return True
+    print_color(GREEN, f"Updated {len(changed)} parameter(s) on {target_app_name} and requested a sync.")
+    if saved is not None:
+        print_color(YELLOW, f"Saved snapshot {saved['id']}; undo with ./restore-snapshot.py {target_app_name}")
+    
+    # Wait for the application to be healthy
+    print_color(YELLOW, f">> Waiting for {target_app_name} to be healthy...")
+    with span("sync wait"):
+        result = wait_for_applications(client, [target_app_name], timeout=timeout)[target_app_name]
+    if result["outcome"] == READY:
+        print_color(GREEN, f"✅ {app_name} has been promoted from {source_env} to {target_env} "
+                           f"({target_app_name} synced and healthy in {result['elapsed']:.1f}s).")
+        return True
+    if result["outcome"] == DEGRADED:
+        print_color(RED, f"Error: {target_app_name} is {result['health']}.")
+    elif result["outcome"] == MISSING:
+        print_color(RED, f"Error: {target_app_name} no longer exists in ArgoCD.")
+    else:
+        print_color(RED, f"Error: {target_app_name} did not become healthy within {timeout}s "
+                         f"(Sync: {result['sync']}, Health: {result['health']}).")
+    return False
+
+def main(argv=None):
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Validate an application and promote it to the next environment')
+    parser.add_argument('app_name', help='Source Application name (e.g., app1-dev)')
+    parser.add_argument('source_env', help='Source environment (e.g., dev)')
+    parser.add_argument('target_env', help='Target environment (e.g., staging)')
+    parser.add_argument('--keys', default=','.join(DEFAULT_KEYS), help=f'Comma-separated Helm parameters to promote (default: {",".join(DEFAULT_KEYS)})')
+    parser.add_argument('--all-parameters', action='store_true', help='Promote every Helm parameter of the source application')
+    parser.add_argument('--timeout', type=int, default=300, help='Seconds to wait for the target to be healthy')
+    parser.add_argument('--no-snapshot', action='store_true', help='Do not save a snapshot of the target before promoting')
+    
+    args = parser.parse_args(argv)
+    keys = None if args.all_parameters else [key.strip() for key in args.keys.split(",") if key.strip()]
+    
+    try:
+        get_client()
+    except KubeConfigError as e:
+        print_color(RED, f"Cannot connect to Kubernetes: {e}")
+        return 1
+    
+    try:
+        promoted = promote(args.app_name, args.source_env, args.target_env, keys, args.timeout,
+                           None if args.no_snapshot else SnapshotStore())
+    except (ApiError, OSError, ValueError) as e:
+        print_color(RED, f"Promotion failed: {e}")
+        return 1
+    
+    return 0 if promoted else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Values Schema
+
+Checks Helm value edits against a chart's values schema (the JSON Schema
+format of a chart's values.schema.json) before anything is written or
+patched. A schema file is compiled once into a tree of nodes and cached
+per process, keyed by its path and modification time. The node of each
+edited key path is looked up once and memoized, so checking an edit
+costs a few dictionary hits.
+
+Supported keywords: type, enum, const, properties, patternProperties,
+additionalProperties, items, anyOf/oneOf, allOf (properties only),
+minimum/maximum (and their exclusive forms), minLength/maxLength, pattern
+and local $ref (#/definitions/... or #/$defs/...). Other keywords are
+ignored.
+
+Besides checking, an edit is converted to the declared type: '4' becomes
+4 for an integer and 1.25 becomes '1.25' for a string, so Helm gets the
+type the chart expects.
+"""
+
+import difflib
+import json
+import os
+import re
+import threading
+
+from helm_values import ValuesError, format_path, parse_path, parse_scalar
+
+SCHEMA_SUFFIX = "-values.schema.json"
+JSON_TYPES = ("string", "integer", "number", "boolean", "object", "array", "null")
+
+
+class SchemaError(Exception):
+    """Raised when a schema file cannot be read or compiled"""
+
+
+class ValidationError(ValueError):
+    """Raised for an edit the schema rejects"""
+
+
+class Node:
+    """One compiled (sub)schema"""
+
+    def __init__(self):
+        self.types = None  # frozenset of JSON types; None accepts any
+        self.enum = None
+        self.properties = {}
+        self.pattern_properties = []
+        self.additional = None  # Node, False for no unknown keys, None for anything
+        self.items = None
+        self.any_of = []
+        self.minimum = None
+        self.maximum = None
+        self.exclusive_minimum = None
+        self.exclusive_maximum = None
+        self.min_length = None
+        self.max_length = None
+        self.pattern = None
+
+
+def _json_type(value):
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, float):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, list):
+        return "array"
+    return type(value).__name__
+
+
+def _accepts(types, value):
+    kind = _json_type(value)
+    return kind in types or (kind == "integer" and "number" in types) or (
+        kind == "number" and "integer" in types and value.is_integer())
+
+
+class CompiledSchema:
+    """A values schema compiled into nodes, with the node of each key path memoized"""
+
+    def __init__(self, schema, source="schema"):
+        if not isinstance(schema, dict):
+            raise SchemaError(f"{source}: the schema must be a JSON object")
+        self.schema = schema
+        self.source = source
+        self._refs = {}
+        self.root = self._compile(schema)
+        self._nodes = {}
+        self.lock = threading.Lock()
+
+    # -- compilation ---------------------------------------------------------
+
+    def _resolve(self, ref):
+        if ref in self._refs:
+            return self._refs[ref]
+        if not ref.startswith("#/"):
+            raise SchemaError(f"{self.source}: only local $ref values are supported, not {ref!r}")
+        target = self.schema
+        for part in ref[2:].split("/"):
+            part = part.replace("~1", "/").replace("~0", "~")
+            if not isinstance(target, dict) or part not in target:
+                raise SchemaError(f"{self.source}: unresolvable $ref {ref!r}")
+            target = target[part]
+        # Registered before compiling, so recursive definitions terminate
+        node = self._refs[ref] = Node()
+        self._compile(target, node)
+        return node
+
+    def _compile(self, schema, node=None):
+        if not isinstance(schema, dict) and schema is not True:
+            raise SchemaError(f"{self.source}: invalid subschema {schema!r}")
+        if schema is not True and "$ref" in schema:
+            # Like draft-07, $ref replaces its siblings
+            target = self._resolve(schema["$ref"])
+            if node is None:
+                return target
+            node.__dict__.update(target.__dict__)
+            return node
+        node = node or Node()
+        if schema is True:
+            return node
+        kind = schema.get("type")
+        if kind is not None:
+            types = [kind] if isinstance(kind, str) else list(kind)
+            unknown = [name for name in types if name not in JSON_TYPES]
+            if unknown:
+                raise SchemaError(f"{self.source}: unknown type {unknown[0]!r}")
+            node.types = frozenset(types)
+        if "enum" in schema:
+            node.enum = tuple(schema["enum"])
+        if "const" in schema:
+            node.enum = (schema["const"],)
+        for name, subschema in (schema.get("properties") or {}).items():
+            node.properties[name] = self._compile(subschema)
+        for pattern, subschema in (schema.get("patternProperties") or {}).items():
+            node.pattern_properties.append((re.compile(pattern), self._compile(subschema)))
+        additional = schema.get("additionalProperties")
+        if additional is False:
+            node.additional = False
+        elif isinstance(additional, dict):
+            node.additional = self._compile(additional)
+        if isinstance(schema.get("items"), dict):
+            node.items = self._compile(schema["items"])
+        for keyword in ("anyOf", "oneOf"):
+            node.any_of.extend(self._compile(subschema) for subschema in schema.get(keyword) or [])
+        for subschema in schema.get("allOf") or []:
+            node.properties.update(self._compile(subschema).properties)
+        node.minimum = schema.get("minimum")
+        node.maximum = schema.get("maximum")
+        node.exclusive_minimum = schema.get("exclusiveMinimum")
+        node.exclusive_maximum = schema.get("exclusiveMaximum")
+        node.min_length = schema.get("minLength")
+        node.max_length = schema.get("maxLength")
+        if schema.get("pattern"):
+            node.pattern = re.compile(schema["pattern"])
+        return node
+
+    # -- lookups -------------------------------------------------------------
+
+    def _child(self, node, part, path):
+        """The node of one key or index below node; None when anything goes"""
+        if node.any_of and not node.properties and node.items is None:
+            for alternative in node.any_of:
+                try:
+                    child = self._child(alternative, part, path)
+                except ValidationError:
+                    continue
+                return child
+            raise ValidationError(f"{format_path(path)}: not allowed by any of the alternatives of "
+                                  f"{format_path(path[:-1]) or 'the values'}")
+        if isinstance(part, int):
+            if node.types is not None and "array" not in node.types:
+                raise ValidationError(f"{format_path(path)}: {format_path(path[:-1])} is not a list")
+            return node.items
+        if node.types is not None and "object" not in node.types:
+            raise ValidationError(f"{format_path(path)}: {format_path(path[:-1])} is a "
+                                  f"{'/'.join(sorted(node.types))}, not a mapping")
+        if part in node.properties:
+            return node.properties[part]
+        for pattern, child in node.pattern_properties:
+            if pattern.search(part):
+                return child
+        if node.additional is False:
+            message = f"{format_path(path)}: unknown key"
+            close = difflib.get_close_matches(part, list(node.properties), n=1)
+            if close:
+                message += f" (did you mean {format_path(path[:-1] + (close[0],))}?)"
+            raise ValidationError(message)
+        return node.additional
+
+    def node(self, path):
+        """The node of a key path (tuple or dotted text); None when the schema does not constrain it"""
+        path = parse_path(path)
+        with self.lock:
+            if path in self._nodes:
+                return self._nodes[path]
+        node = self.root
+        for depth in range(len(path)):
+            node = self._child(node, path[depth], path[:depth + 1])
+            if node is None:
+                break
+        with self.lock:
+            self._nodes[path] = node
+        return node
+
+    # -- checks --------------------------------------------------------------
+
+    def _coerce(self, node, value, path, raw):
+        types = node.types
+        if raw and isinstance(value, str):
+            # Command-line text: the typed reading wins when the schema accepts it
+            parsed = parse_scalar(value)
+            if types is None:
+                return parsed
+            if not isinstance(parsed, str) and _accepts(types, parsed):
+                value = parsed
+        if types is None:
+            return value
+        if _accepts(types, value):
+            # 4.0 for an integer
+            return int(value) if isinstance(value, float) and "number" not in types else value
+        if isinstance(value, str):
+            parsed = parse_scalar(value)
+            if not isinstance(parsed, str) and _accepts(types, parsed):
+                return int(parsed) if isinstance(parsed, float) and "number" not in types else parsed
+        elif "string" in types and isinstance(value, (bool, int, float)):
+            return ("true" if value else "false") if isinstance(value, bool) else str(value)
+        raise ValidationError(f"{format_path(path)}: expected {' or '.join(sorted(types))}, got {value!r}")
+
+    def _check(self, node, value, path, raw=False):
+        """value converted and checked against node"""
+        if node.any_of:
+            errors = []
+            for alternative in node.any_of:
+                try:
+                    value = self._check(alternative, value, path, raw)
+                    raw = False
+                    break
+                except ValidationError as e:
+                    errors.append(str(e).partition(": ")[2])
+            else:
+                raise ValidationError(f"{format_path(path)}: matches none of the allowed forms ({'; '.join(errors)})")
+        value = self._coerce(node, value, path, raw)
+        if node.enum is not None and value not in node.enum:
+            allowed = ", ".join(json.dumps(option) for option in node.enum)
+            raise ValidationError(f"{format_path(path)}: {value!r} is not one of {allowed}")
+        kind = _json_type(value)
+        if kind in ("integer", "number"):
+            for limit, fails, words in ((node.minimum, lambda v, l: v < l, "at least"),
+                                        (node.maximum, lambda v, l: v > l, "at most"),
+                                        (node.exclusive_minimum, lambda v, l: v <= l, "more than"),
+                                        (node.exclusive_maximum, lambda v, l: v >= l, "less than")):
+                if isinstance(limit, (int, float)) and not isinstance(limit, bool) and fails(value, limit):
+                    raise ValidationError(f"{format_path(path)}: {value} is not {words} {limit}")
+        elif kind == "string":
+            if node.min_length is not None and len(value) < node.min_length:
+                raise ValidationError(f"{format_path(path)}: {value!r} is shorter than {node.min_length}")
+            if node.max_length is not None and len(value) > node.max_length:
+                raise ValidationError(f"{format_path(path)}: {value!r} is longer than {node.max_length}")
+            if node.pattern is not None and not node.pattern.search(value):
+                raise ValidationError(f"{format_path(path)}: {value!r} does not match {node.pattern.pattern}")
+        elif kind == "object":
+            checked = {}
+            for key, item in value.items():
+                child = self._child(node, str(key), path + (str(key),))
+                checked[key] = item if child is None else self._check(child, item, path + (str(key),))
+            value = checked
+        elif kind == "array" and node.items is not None:
+            value = [self._check(node.items, item, path + (index,)) for index, item in enumerate(value)]
+        return value
+
+    def check(self, key, value, raw=False):
+        """
+        Check one edit and return its value converted to the declared type.
+
+        raw marks command-line text: it is read like YAML where the schema
+        does not say otherwise ('3' is a number, 'true' a boolean). Raises
+        ValidationError for an unknown key or a value the schema rejects.
+        """
+        try:
+            path = parse_path(key)
+            node = self.node(path)
+            if node is None:
+                return parse_scalar(value) if raw else value
+            return self._check(node, value, path, raw)
+        except ValuesError as e:
+            raise ValidationError(f"{key}: {e}") from None
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load_schema(path):
+    """The compiled schema in a JSON file, compiled once per process and file version"""
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        raise SchemaError(f"Cannot read schema {path}: {e.strerror}") from None
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        if key in _cache:
+            return _cache[key]
+    try:
+        with open(path, "r") as f:
+            schema = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SchemaError(f"Cannot read schema {path}: {e}") from None
+    try:
+        compiled = CompiledSchema(schema, path)
+    except re.error as e:
+        raise SchemaError(f"{path}: invalid pattern: {e}") from None
+    with _cache_lock:
+        # Older versions of the same file are dropped
+        for stale in [cached for cached in _cache if cached[0] == key[0]]:
+            del _cache[stale]
+        _cache[key] = compiled
+    return compiled
+
+
+def schema_directories():
+    """Where find_schema() looks: gitops-solution/schemas, ./schemas and the schemas of this repository"""
+    return ["gitops-solution/schemas", "schemas",
+            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "schemas")]
+
+
+def find_schema(chart, directories=None):
+    """Path of <chart>-values.schema.json in the schema directories, or None"""
+    if not chart:
+        return None
+    for directory in directories or schema_directories():
+        path = os.path.join(directory, f"{os.path.basename(chart.rstrip('/'))}{SCHEMA_SUFFIX}")
+        if os.path.isfile(path):
+            return path
+    return None
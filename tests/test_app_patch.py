@@ -0,0 +1,131 @@
+"""Tests of the Application patch builder: removed values and retried patches"""
+
+import copy
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+os.environ["GITOPS_LATENCY_DB"] = "off"
+
+from app_patch import (VALUES_HASH_ANNOTATION, VALUES_PARAMETERS_ANNOTATION, apply_parameters,  # noqa: E402
+                       application_patch, helm_parameters)
+from fake_apiserver import json_patch  # noqa: E402
+from k8s_client import ApiError  # noqa: E402
+
+
+def application(parameters, annotations=None):
+    return {
+        "metadata": {"name": "app1-dev", "namespace": "argocd", "annotations": annotations},
+        "spec": {"source": {"helm": {"parameters": parameters}},
+                 "syncPolicy": {"automated": {"prune": True, "selfHeal": True}}},
+    }
+
+
+def patched(app, values, complete=True):
+    operations, changed = application_patch(app, helm_parameters(values), complete=complete)
+    return json_patch(app, operations), changed
+
+
+def parameters(app):
+    return {parameter["name"]: parameter["value"] for parameter in app["spec"]["source"]["helm"]["parameters"]}
+
+
+class ApplicationPatchTest(unittest.TestCase):
+
+    def test_key_deleted_from_the_values_is_removed(self):
+        app, _ = patched(application([]), {"image": {"tag": "v1"}, "replicaCount": 2})
+        app, changed = patched(app, {"image": {"tag": "v1"}})
+        self.assertEqual(app["spec"]["source"]["helm"]["parameters"], [{"name": "image.tag", "value": "v1"}])
+        self.assertEqual(changed, ["replicaCount"])
+
+    def test_parameter_set_by_hand_is_kept(self):
+        manual = {"name": "service.type", "value": "NodePort"}
+        app, _ = patched(application([manual]), {"replicaCount": 2})
+        app, _ = patched(app, {"replicaCount": 3})
+        self.assertEqual(app["spec"]["source"]["helm"]["parameters"],
+                         [manual, {"name": "replicaCount", "value": "3"}])
+
+    def test_partial_update_keeps_the_other_parameters(self):
+        values = {"replicaCount": 2, "image": {"tag": "v1"}, "service": {"type": "ClusterIP"}}
+        app, _ = patched(application([]), values)
+        owned = app["metadata"]["annotations"][VALUES_PARAMETERS_ANNOTATION]
+        app, changed = patched(app, {"image": {"tag": "v2"}}, complete=False)
+        self.assertEqual(parameters(app), {"replicaCount": "2", "image.tag": "v2", "service.type": "ClusterIP"})
+        self.assertEqual(changed, ["image.tag"])
+        self.assertEqual(app["metadata"]["annotations"][VALUES_PARAMETERS_ANNOTATION], owned)
+        # The values file applies again afterwards instead of looking already applied
+        self.assertNotIn(VALUES_HASH_ANNOTATION, app["metadata"]["annotations"])
+        app, changed = patched(app, values)
+        self.assertEqual(parameters(app)["image.tag"], "v1")
+
+    def test_partial_update_that_changes_nothing_is_empty(self):
+        app, _ = patched(application([]), {"replicaCount": 2})
+        self.assertEqual(application_patch(app, helm_parameters({"replicaCount": 2}), complete=False), ([], []))
+
+
+class FakeClient:
+    """
+    Holds one Application and applies JSON patches to it. PATCH answers the
+    given errors in turn first; changes queued in concurrent are made to
+    the Application just before a PATCH arrives.
+    """
+
+    def __init__(self, app, *errors):
+        self.app = app
+        self.errors = list(errors)
+        self.concurrent = []
+        self.patches = 0
+
+    def get(self, path):
+        return copy.deepcopy(self.app)
+
+    def patch(self, path, operations, patch_type=None):
+        self.patches += 1
+        if self.concurrent:
+            self.concurrent.pop(0)(self.app)
+        if self.errors:
+            raise self.errors.pop(0)
+        try:
+            self.app = json_patch(self.app, operations)
+        except ValueError as e:
+            raise ApiError(422, "Invalid", str(e))
+
+
+class ApplyParametersTest(unittest.TestCase):
+
+    def apply(self, client, app=None):
+        return apply_parameters(client, "app1-dev", [{"name": "replicaCount", "value": "2"}], app=app)
+
+    def test_failed_test_op_is_retried(self):
+        client = FakeClient(application([{"name": "replicaCount", "value": "1"}]),
+                            ApiError(422, "Invalid", "test failed at /spec/source/helm/parameters/0/name"),
+                            ApiError(409, "Conflict"))
+        self.assertEqual(self.apply(client), ["replicaCount"])
+        self.assertEqual(client.patches, 3)
+
+    def test_value_changed_underneath_the_patch_is_retried(self):
+        client = FakeClient(application([{"name": "replicaCount", "value": "1"}]))
+        stale = client.get("")
+
+        def edit(app):
+            app["spec"]["source"]["helm"]["parameters"][0]["value"] = "5"
+
+        client.concurrent.append(edit)
+        self.assertEqual(self.apply(client, app=stale), ["replicaCount"])
+        self.assertEqual(client.patches, 2)
+        self.assertEqual(parameters(client.app), {"replicaCount": "2"})
+
+    def test_invalid_patch_is_not_retried(self):
+        client = FakeClient(application([{"name": "replicaCount", "value": "1"}]),
+                            ApiError(422, "Invalid", "spec.source.helm.parameters: Invalid value"))
+        with self.assertRaises(ApiError):
+            self.apply(client)
+        self.assertEqual(client.patches, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
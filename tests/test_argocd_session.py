@@ -0,0 +1,61 @@
+"""Tests of the ArgoCD session's application stream"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+os.environ["GITOPS_LATENCY_DB"] = "off"
+
+from app_waiter import TIMEOUT  # noqa: E402
+from argocd_session import ArgoCDSession  # noqa: E402
+
+
+class QuietStreamHandler(BaseHTTPRequestHandler):
+    """Opens the application stream and then sends nothing"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.wfile.flush()
+        self.server.release.wait(10)
+
+
+class WatchTimeoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), QuietStreamHandler)
+        self.server.daemon_threads = True
+        self.server.release = threading.Event()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        host, port = self.server.server_address[:2]
+        self.session = ArgoCDSession(server=f"http://{host}:{port}", token="fixed-token")
+
+    def tearDown(self):
+        self.server.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+        self.session.pool.close()
+
+    def test_quiet_stream_ends_at_the_deadline(self):
+        self.assertEqual(list(self.session.watch_application("app1-dev", 0.3)), [])
+
+    def test_wait_times_out_instead_of_raising(self):
+        start = time.monotonic()
+        result = self.session.wait_for_application("app1-dev", timeout=0.5)
+        self.assertEqual(result["outcome"], TIMEOUT)
+        self.assertLess(time.monotonic() - start, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
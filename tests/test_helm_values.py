@@ -0,0 +1,46 @@
+"""Tests of in-place deletes in the values engine"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from helm_values import ValuesDocument  # noqa: E402
+
+
+def deleted(text, path):
+    document = ValuesDocument(text)
+    document.delete(path)
+    return document.to_text()
+
+
+class DeleteTest(unittest.TestCase):
+
+    def test_first_key_of_a_list_item(self):
+        self.assertEqual(deleted("x:\n- a: 1\n  b: 2\n", "x[0].a"), "x:\n- b: 2\n")
+
+    def test_first_item_of_a_nested_list_keeps_the_outer_marker(self):
+        self.assertEqual(deleted("x:\n- - a\n  - b\n- c\n", "x[0][0]"), "x:\n- - b\n- c\n")
+
+    def test_first_item_of_an_indented_nested_list(self):
+        self.assertEqual(deleted("x:\n  - - a\n    - b\n", "x[0][0]"), "x:\n  - - b\n")
+
+    def test_first_item_below_two_markers(self):
+        self.assertEqual(deleted("x:\n- - - a\n    - b\n", "x[0][0][0]"), "x:\n- - - b\n")
+
+    def test_first_item_of_a_nested_list_holding_a_mapping(self):
+        self.assertEqual(deleted("x:\n- - a: 1\n    b: 2\n  - c\n", "x[0][0]"), "x:\n- - c\n")
+
+    def test_later_item_of_a_nested_list(self):
+        self.assertEqual(deleted("x:\n- - a\n  - b\n- c\n", "x[0][1]"), "x:\n- - a\n- c\n")
+
+    def test_only_item_of_a_nested_list(self):
+        self.assertEqual(deleted("x:\n- - a\n", "x[0][0]"), "x:\n- []\n")
+
+    def test_whole_nested_list(self):
+        self.assertEqual(deleted("x:\n- - a\n  - b\n- c\n", "x[0]"), "x:\n- c\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Tests of restoring a snapshot: patch first, values file after"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from k8s_client import ApiError  # noqa: E402
+from snapshots import restore  # noqa: E402
+
+
+class FakeClient:
+    """Answers PATCH with the given errors in turn, then succeeds"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.patches = 0
+
+    def get(self, path):
+        return {"metadata": {"name": "app1-dev", "namespace": "argocd", "annotations": {}},
+                "spec": {"source": {"helm": {"parameters": [{"name": "replicaCount", "value": "3"}]}}}}
+
+    def patch(self, path, operations, patch_type=None):
+        self.patches += 1
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+class RestoreTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.values_file = os.path.join(directory.name, "values.yaml")
+        with open(self.values_file, "w") as f:
+            f.write("replicaCount: 3\n")
+        self.snapshot = {"application": "app1-dev", "namespace": "argocd", "valuesHash": None,
+                         "helm": {"parameters": [{"name": "replicaCount", "value": "1"}]},
+                         "valuesFile": self.values_file, "values": "replicaCount: 1\n"}
+
+    def values(self):
+        with open(self.values_file) as f:
+            return f.read()
+
+    def test_values_file_is_written_after_the_patch(self):
+        client = FakeClient(ApiError(409, "Conflict"))
+        restore(client, self.snapshot)
+        self.assertEqual(client.patches, 2)
+        self.assertEqual(self.values(), "replicaCount: 1\n")
+
+    def test_invalid_patch_is_not_retried_and_keeps_the_values_file(self):
+        client = FakeClient(ApiError(422, "Invalid", "spec.source.helm: Invalid value"))
+        with self.assertRaises(ApiError):
+            restore(client, self.snapshot)
+        self.assertEqual(client.patches, 1)
+        self.assertEqual(self.values(), "replicaCount: 3\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Tests of a promotion against the fake API server"""
+
+import contextlib
+import importlib.util
+import io
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+os.environ["GITOPS_LATENCY_DB"] = "off"
+
+from app_patch import VALUES_PARAMETERS_ANNOTATION, apply_parameters, helm_parameters  # noqa: E402
+from app_waiter import wait_for_applications  # noqa: E402
+from fake_apiserver import FakeApiServer, FakeCluster  # noqa: E402
+from k8s_client import get_client, resource_path  # noqa: E402
+
+
+def load_script(name):
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(ROOT, "scripts", f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def parameters(app):
+    return {parameter["name"]: parameter["value"] for parameter in app["spec"]["source"]["helm"]["parameters"]}
+
+
+class PromoteTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cluster = FakeCluster(sync_delay=0.05, rollout_delay=0.05)
+        cluster.seed(1)
+        cls.server = FakeApiServer(("127.0.0.1", 0), cluster)
+        cls.server.start()
+        os.environ["KUBE_API_SERVER"] = cls.server.url
+        cls.client = get_client()
+        cls.module = load_script("validate-and-promote")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_promotion_leaves_the_other_parameters_of_the_target(self):
+        apply_parameters(self.client, "app1-dev", helm_parameters({"replicaCount": 3, "image": {"tag": "v2"}}))
+        target = {"replicaCount": 1, "image": {"tag": "v1"}, "service": {"type": "NodePort"},
+                  "resources": {"limits": {"cpu": "500m"}}}
+        apply_parameters(self.client, "app1-staging", helm_parameters(target))
+        # The source must be synced and healthy again to pass validation
+        wait_for_applications(self.client, ["app1-dev", "app1-staging"], timeout=30)
+        path = resource_path("applications", "argocd", "app1-staging")
+        owned = self.client.get(path)["metadata"]["annotations"][VALUES_PARAMETERS_ANNOTATION]
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            promoted = self.module.promote("app1-dev", "dev", "staging", keys=["replicaCount", "image.tag"],
+                                           timeout=30)
+
+        self.assertTrue(promoted)
+        app = self.client.get(path)
+        self.assertEqual(parameters(app), {"replicaCount": "3", "image.tag": "v2", "service.type": "NodePort",
+                                           "resources.limits.cpu": "500m"})
+        self.assertEqual(app["metadata"]["annotations"][VALUES_PARAMETERS_ANNOTATION], owned)
+
+
+if __name__ == "__main__":
+    unittest.main()